@@ -1,12 +1,30 @@
+import asyncio
 import base64
+import importlib
 import os
 import io
 import json
 import logging
-from typing import List, Dict, Any
+import threading
+from typing import TYPE_CHECKING, AsyncIterator, List, Dict, Any, Optional, Tuple, Union
 from PIL import Image
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
+from images import EncodedImage, prepare_image_bytes
+from menu import CompiledMenu, as_compiled_menu
+from metrics import LLM_TOKENS, PARSE_FALLBACKS, PAYLOAD_BYTES, STAGE_SECONDS
+from preferences import PreferenceState
+from routing import (
+    astream_with_cascade,
+    invoke_with_cascade,
+    is_valid_menu_json,
+    reply_validator,
+)
+from cassette import call_inputs
+from tracing import span
+from tokens import count_message_tokens, fit_conversation_prompt, fit_images_to_budget
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+    from langchain.schema import HumanMessage, SystemMessage
 
 # CONFIGURE LOGGING
 logging.basicConfig(
@@ -19,6 +37,34 @@ logger = logging.getLogger("menu_analyzer")
 LLM_MODEL = os.getenv("OPENAI_API_MODEL")
 MAX_QUESTIONS = 5
 MAX_MENU_ITEMS = 100
+# Menu photos sent per extraction; further pages are dropped with a warning
+MAX_MENU_PAGES = int(os.getenv("MAX_MENU_PAGES", "5"))
+
+
+# LAZY LANGCHAIN IMPORTS
+# LangChain and the OpenAI client take about a second to import, so they are
+# loaded on first use (or by load_langchain) rather than with this module
+_LAZY_IMPORTS = {
+    "ChatOpenAI": ("langchain_openai", "ChatOpenAI"),
+    "HumanMessage": ("langchain.schema", "HumanMessage"),
+    "SystemMessage": ("langchain.schema", "SystemMessage"),
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attribute = _LAZY_IMPORTS[name]
+    value = getattr(importlib.import_module(module), attribute)
+    globals()[name] = value
+    return value
+
+
+def load_langchain() -> None:
+    """Import the LangChain names used here, keeping any already set (or patched)."""
+    for name in _LAZY_IMPORTS:
+        if name not in globals():
+            __getattr__(name)
 
 
 # HELPER FUNCTIONS
@@ -34,26 +80,128 @@ def convert_to_pil_image(image_input):
     raise TypeError("Unsupported image type from Gallery")
 
 
-def convert_to_base64(image):
-    buffer = io.BytesIO()
-    convert_to_pil_image(image).save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode()
+def downscale_image(image, max_side=None):
+    image = convert_to_pil_image(image)
+    if not max_side or max(image.size) <= max_side:
+        return image
+    resized = image.copy()
+    resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return resized
 
 
-# LLM WRAPPERS
-def extract_menu_items(menu_images: List[Any]) -> List[Dict[str, str]]:
-    if not menu_images:
-        logger.warning("No menu images provided for extraction")
-        return []
+def convert_to_base64(image, max_side=None):
+    image = downscale_image(image, max_side)
+    with STAGE_SECONDS.time(stage="image_encode"):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return base64.b64encode(buffer.getvalue()).decode()
 
-    logger.info(f"Processing {len(menu_images)} menu images for extraction")
-    image_parts = [
-        {
-            "type": "image_url",
-            "image_url": {"url": f"data:image/png;base64,{convert_to_base64(img)}"},
-        }
-        for img in menu_images[:MAX_QUESTIONS]
+
+def image_size(image):
+    if isinstance(image, EncodedImage):
+        return image.size
+    return convert_to_pil_image(image).size
+
+
+def image_data_url(image, max_side=None):
+    # Pre-encoded uploads are sent as-is unless the budget asks for a smaller size
+    if isinstance(image, EncodedImage):
+        if max_side and max(image.size) > max_side:
+            image = prepare_image_bytes(image.data, max_side)
+        url = image.to_data_url()
+    else:
+        url = f"data:image/png;base64,{convert_to_base64(image, max_side)}"
+    PAYLOAD_BYTES.inc(len(url), kind="model_image")
+    return url
+
+
+# PROMPT LAYOUT
+# Conversation prompts are laid out as a static prefix (system instructions + menu)
+# followed by the per-turn tail, so the prefix is byte-identical on every turn and
+# the provider's prompt cache can serve it.
+WAITER_SYSTEM_PROMPT = (
+    "You are an attentive, helpful waiter. The restaurant menu is listed in the next message. "
+    "Follow the task in the final message and reply ONLY in the language it names."
+)
+
+# Prompt token usage per stage, including how much of it was served from cache
+PROMPT_USAGE_STATS: Dict[str, Dict[str, int]] = {}
+# Updated from request threads and background refreshes at the same time
+_PROMPT_USAGE_LOCK = threading.Lock()
+
+
+def build_conversation_prompt(menu_fragment: str, task_text: str) -> list:
+    load_langchain()
+    return [
+        SystemMessage(content=WAITER_SYSTEM_PROMPT),
+        HumanMessage(content=menu_fragment),
+        HumanMessage(content=task_text),
     ]
+
+
+def fit_conversation(stage, menu, preferences, build_task) -> list:
+    menu_fragment, task_text, _ = fit_conversation_prompt(
+        stage,
+        menu,
+        preferences,
+        build_task,
+        fixed_tokens=count_message_tokens([WAITER_SYSTEM_PROMPT]),
+        compactions=((PreferenceState.compacted, "compacted preference state"),),
+    )
+    return build_conversation_prompt(menu_fragment, task_text)
+
+
+def record_prompt_usage(stage: str, response: Any) -> Dict[str, int]:
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    if not usage:
+        token_usage = (getattr(response, "response_metadata", None) or {}).get(
+            "token_usage"
+        ) or {}
+        prompt_tokens = token_usage.get("prompt_tokens", 0)
+        cached_tokens = (token_usage.get("prompt_tokens_details") or {}).get(
+            "cached_tokens", 0
+        )
+    prompt_tokens = prompt_tokens or 0
+    cached_tokens = cached_tokens or 0
+    completion_tokens = usage.get("output_tokens") or (
+        (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    ).get("completion_tokens", 0)
+    LLM_TOKENS.inc(prompt_tokens, stage=stage, kind="prompt")
+    LLM_TOKENS.inc(cached_tokens, stage=stage, kind="cached")
+    LLM_TOKENS.inc(completion_tokens or 0, stage=stage, kind="completion")
+
+    with _PROMPT_USAGE_LOCK:
+        stats = PROMPT_USAGE_STATS.setdefault(
+            stage, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        )
+        stats["calls"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+    logger.info(
+        f"{stage} prompt tokens: {prompt_tokens} ({cached_tokens} cached, {prompt_tokens - cached_tokens} uncached)"
+    )
+    return {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens}
+
+
+def get_prompt_usage_stats() -> Dict[str, Dict[str, Any]]:
+    with _PROMPT_USAGE_LOCK:
+        usage = {stage: dict(stats) for stage, stats in PROMPT_USAGE_STATS.items()}
+    summary = {}
+    for stage, stats in usage.items():
+        prompt_tokens, cached_tokens = stats["prompt_tokens"], stats["cached_tokens"]
+        summary[stage] = {
+            **stats,
+            "uncached_tokens": prompt_tokens - cached_tokens,
+            "cache_hit_ratio": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        }
+    return summary
+
+
+# LLM WRAPPERS
+def extraction_prompt(menu_images: List[Any]) -> list:
+    load_langchain()
     system_message = SystemMessage(
         content=(
             """
@@ -62,97 +210,333 @@ def extract_menu_items(menu_images: List[Any]) -> List[Dict[str, str]]:
                  """
         )
     )
-    human_message = HumanMessage(
-        content=[*image_parts, {"type": "text", "text": "Extract now."}]
+    instruction_part = {"type": "text", "text": "Extract now."}
+    fixed_tokens = count_message_tokens(
+        [system_message, HumanMessage(content=[instruction_part])]
     )
+    max_side, decision = fit_images_to_budget(
+        [image_size(img) for img in menu_images], fixed_tokens=fixed_tokens
+    )
+    LLM_TOKENS.inc(decision.final_tokens - fixed_tokens, stage="extract", kind="image")
+    image_parts = [
+        {
+            "type": "image_url",
+            "image_url": {"url": image_data_url(img, max_side)},
+        }
+        for img in menu_images
+    ]
+    human_message = HumanMessage(content=[*image_parts, instruction_part])
+    return [system_message, human_message]
 
-    logger.info("Calling LLM to extract menu items")
+
+def is_dish(item: Any) -> bool:
+    """Whether a parsed item can be used as a dish (it needs a name)."""
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get("name"), str)
+        and bool(item["name"].strip())
+    )
+
+
+@STAGE_SECONDS.time(stage="parse")
+def parse_menu_reply(response_text: str) -> List[Dict[str, str]]:
     try:
-        response_text = (
-            ChatOpenAI(model=LLM_MODEL, temperature=0)
-            .invoke([system_message, human_message])
-            .content
-        )
-        menu_items = json.loads(response_text)[:MAX_MENU_ITEMS]
+        parsed = json.loads(response_text)
+        if not isinstance(parsed, list):
+            parsed = [parsed]
+        # Items without a name cannot be shown, compiled or recommended
+        menu_items = [item for item in parsed if is_dish(item)]
+        if len(menu_items) < len(parsed):
+            logger.warning(
+                f"Dropped {len(parsed) - len(menu_items)} extracted items without a name"
+            )
+        menu_items = menu_items[:MAX_MENU_ITEMS]
         logger.info(f"Successfully extracted {len(menu_items)} menu items")
         return menu_items
     except json.JSONDecodeError:
         logger.warning(
             "Failed to parse JSON response, falling back to line-by-line parsing"
         )
+        PARSE_FALLBACKS.inc()
         parsed_items = [
             {"name": line.strip("- •"), "description": ""}
             for line in response_text.split("\n")
-            if line.strip()
+            if line.strip("- •").strip()
         ][:MAX_MENU_ITEMS]
         logger.info(f"Extracted {len(parsed_items)} items using fallback method")
         return parsed_items
+
+
+def limit_menu_pages(menu_images: List[Any]) -> List[Any]:
+    if len(menu_images) > MAX_MENU_PAGES:
+        logger.warning(
+            f"Extracting the first {MAX_MENU_PAGES} of {len(menu_images)} menu pages (MAX_MENU_PAGES)"
+        )
+    return menu_images[:MAX_MENU_PAGES]
+
+
+def extract_menu_items(
+    menu_images: List[Any], raise_errors: bool = False
+) -> List[Dict[str, str]]:
+    """Extract the dishes from menu photos; [] on failure unless raise_errors."""
+    if not menu_images:
+        logger.warning("No menu images provided for extraction")
+        return []
+
+    logger.info(f"Processing {len(menu_images)} menu images for extraction")
+    load_langchain()
+    menu_images = limit_menu_pages(menu_images)
+    with span("build_prompt", stage="extract", images=len(menu_images)):
+        messages = extraction_prompt(menu_images)
+
+    logger.info("Calling LLM to extract menu items")
+    try:
+        with call_inputs(images=len(menu_images)):
+            response = invoke_with_cascade(
+                "extract",
+                messages,
+                temperature=0,
+                chat_model=ChatOpenAI,
+                validate=is_valid_menu_json,
+            )
+        record_prompt_usage("extract", response)
+        with span("parse", chars=len(response.content)) as parsed:
+            dishes = parse_menu_reply(response.content)
+            parsed.set(dishes=len(dishes))
+        return dishes
     except Exception as e:
         logger.error(f"Error extracting menu items: {str(e)}")
+        if raise_errors:
+            raise
         return []
 
 
-def generate_next_question(
-    dishes: List[Dict[str, str]], question_answer_history: List[str], language: str
-) -> str:
+class MenuStreamParser:
+    """Picks complete dish objects out of a JSON array as its text grows."""
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.text = ""
+        self.position: Optional[int] = None
+        self.items: List[Dict[str, str]] = []
+
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        """Parse the reply so far; a reply that is not a continuation restarts."""
+        if not text.startswith(self.text):
+            self.reset()
+        self.text = text
+        if self.position is None:
+            start = text.find("[")
+            if start < 0:
+                return self.items
+            self.position = start + 1
+        while True:
+            while self.position < len(text) and text[self.position] in " \t\r\n,":
+                self.position += 1
+            if self.position >= len(text) or text[self.position] != "{":
+                return self.items
+            try:
+                item, self.position = self._decoder.raw_decode(text, self.position)
+            except json.JSONDecodeError:
+                # The object is still arriving
+                return self.items
+            if isinstance(item, dict) and item.get("name"):
+                self.items.append(item)
+
+
+async def astream_menu_items(
+    menu_images: List[Any],
+) -> AsyncIterator[Tuple[int, int, List[Dict[str, str]]]]:
+    """Extract the menu page by page, yielding (page, pages, dishes so far).
+
+    Dishes are yielded as soon as each one is complete in the streamed
+    reply. A dish already read from an earlier page is not repeated.
+    """
+    menu_images = limit_menu_pages(menu_images)
+    logger.info(f"Streaming extraction of {len(menu_images)} menu pages")
+    load_langchain()
+    dishes: List[Dict[str, str]] = []
+    seen = set()
+
+    def merge(page_items: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        new_items = [
+            item
+            for item in page_items
+            if str(item["name"]).strip().casefold() not in seen
+        ]
+        return (dishes + new_items)[:MAX_MENU_ITEMS]
+
+    for page, image in enumerate(menu_images, start=1):
+        # Encoding may decode and resize the photo; keep it off the event loop
+        messages = await asyncio.to_thread(extraction_prompt, [image])
+        parser = MenuStreamParser()
+        response = None
+        try:
+            async for response in astream_with_cascade(
+                "extract",
+                messages,
+                temperature=0,
+                chat_model=ChatOpenAI,
+                validate=is_valid_menu_json,
+            ):
+                yield page, len(menu_images), merge(parser.feed(response.content))
+            if response is None:
+                continue
+            record_prompt_usage("extract", response)
+            page_items = parse_menu_reply(response.content)
+        except Exception as e:
+            logger.error(f"Error extracting menu page {page}: {str(e)}")
+            continue
+        dishes = merge(page_items)
+        seen.update(str(item["name"]).strip().casefold() for item in dishes)
+        yield page, len(menu_images), dishes
+
+
+def question_prompt(
+    dishes: Union[CompiledMenu, List[Dict[str, str]]],
+    question_answer_history: List[str],
+    language: str,
+    preferences: Optional[PreferenceState] = None,
+) -> list:
+    menu = as_compiled_menu(dishes)
+    # Only the answers the state has not seen yet are folded in
+    preferences = PreferenceState.from_history(question_answer_history, preferences)
     question_number = len(question_answer_history) // 2 + 1
     logger.info(f"Generating question #{question_number} in {language}")
 
-    menu_summary = "; ".join(
-        f"{dish['name']}: {dish.get('description', '')}" for dish in dishes
-    )
-    conversation_history = "\n".join(
-        f"Q{i + 1}: {question}\nA{i + 1}: {answer}"
-        for i, (question, answer) in enumerate(
-            zip(question_answer_history[0::2], question_answer_history[1::2])
+    def build_task(state: PreferenceState) -> str:
+        return (
+            f"Reply ONLY in {language}.\n{state.render()}\n\n"
+            "Ask ONE concise new question that targets an undecided preference. Avoid repeating topics. Return only the sentence."
         )
-    )
-    system_message = SystemMessage(
-        content=f"Reply ONLY in {language} as an attentive waiter."
-    )
-    prompt_text = (
-        f"Menu excerpt: {menu_summary}.\n{conversation_history}\n"
-        "Ask ONE concise new question that targets an undecided preference. Avoid repeating topics. Return only the sentence."
-    )
 
-    question_response = (
-        ChatOpenAI(model=LLM_MODEL, temperature=0.6)
-        .invoke([system_message, HumanMessage(content=prompt_text)])
-        .content.strip()
+    return fit_conversation("question", menu, preferences, build_task)
+
+
+def recommend_prompt(
+    dishes: Union[CompiledMenu, List[Dict[str, str]]],
+    question_answer_history: List[str],
+    language: str,
+    preferences: Optional[PreferenceState] = None,
+) -> list:
+    menu = as_compiled_menu(dishes)
+    # Only the answers the state has not seen yet are folded in
+    preferences = PreferenceState.from_history(question_answer_history, preferences)
+    logger.info(
+        f"Generating dish recommendations in {language} based on {len(menu)} dishes and {len(question_answer_history) // 2} Q&A pairs"
     )
+
+    def build_task(state: PreferenceState) -> str:
+        user_profile = state.render(include_questions=False)
+        return (
+            f"Reply ONLY in {language}.\n"
+            "Using the menu and guest profile, pick the TOP 3 matching dishes (ranked) and justify each in ≤30 words. Respond markdown without backticks and without any beginning or ending notes.\n\n"
+            f"Guest:\n{user_profile}"
+        )
+
+    return fit_conversation("recommend", menu, preferences, build_task)
+
+
+def generate_next_question(
+    dishes: Union[CompiledMenu, List[Dict[str, str]]],
+    question_answer_history: List[str],
+    language: str,
+    preferences: Optional[PreferenceState] = None,
+) -> str:
+    with span("build_prompt", stage="question"):
+        messages = question_prompt(
+            dishes, question_answer_history, language, preferences
+        )
+    with call_inputs(
+        dishes=dishes,
+        qa=question_answer_history,
+        language=language,
+        preferences=preferences,
+    ):
+        response = invoke_with_cascade(
+            "question",
+            messages,
+            temperature=0.6,
+            chat_model=ChatOpenAI,
+            validate=reply_validator(language),
+        )
+    record_prompt_usage("question", response)
+    question_response = response.content.strip()
     logger.info(f"Generated question: {question_response[:50]}...")
     return question_response
 
 
 def recommend_dishes(
-    dishes: List[Dict[str, str]], question_answer_history: List[str], language: str
+    dishes: Union[CompiledMenu, List[Dict[str, str]]],
+    question_answer_history: List[str],
+    language: str,
+    preferences: Optional[PreferenceState] = None,
 ) -> str:
-    logger.info(
-        f"Generating dish recommendations in {language} based on {len(dishes)} dishes and {len(question_answer_history) // 2} Q&A pairs"
-    )
+    with span("build_prompt", stage="recommend"):
+        messages = recommend_prompt(
+            dishes, question_answer_history, language, preferences
+        )
+    with call_inputs(
+        dishes=dishes,
+        qa=question_answer_history,
+        language=language,
+        preferences=preferences,
+    ):
+        response = invoke_with_cascade(
+            "recommend",
+            messages,
+            temperature=0.4,
+            chat_model=ChatOpenAI,
+            validate=reply_validator(language),
+        )
+    record_prompt_usage("recommend", response)
+    logger.info("Successfully generated dish recommendations")
+    return response.content
 
-    user_answers = question_answer_history[1::2]
-    formatted_menu = "\n".join(
-        f"- {dish['name']}: {dish.get('description', '')}" for dish in dishes
-    )
-    user_profile = "\n".join(
-        f"A{i + 1}: {answer}" for i, answer in enumerate(user_answers)
-    )
-    system_message = SystemMessage(
-        content=f"Reply ONLY in {language} as a helpful waiter."
-    )
-    prompt_text = (
-        "Using the menu and guest profile, pick the TOP 3 matching dishes (ranked) and justify each in ≤30 words. Respond markdown without backticks and without any beginning or ending notes.\n\n"
-        f"Menu:\n{formatted_menu}\n\nGuest:\n{user_profile}"
-    )
 
-    response = (
-        ChatOpenAI(model=LLM_MODEL, temperature=0.4)
-        .invoke([system_message, HumanMessage(content=prompt_text)])
-        .content
-    )
-    logger.info("Successfully generated dish recommendations")
-    return response
+# STREAMING
+async def _astream_reply(
+    stage: str, messages: list, temperature: float, language: str
+) -> AsyncIterator[str]:
+    response = None
+    async for response in astream_with_cascade(
+        stage,
+        messages,
+        temperature=temperature,
+        chat_model=ChatOpenAI,
+        validate=reply_validator(language),
+    ):
+        yield response.content
+    if response is not None:
+        record_prompt_usage(stage, response)
+
+
+async def astream_next_question(
+    dishes: Union[CompiledMenu, List[Dict[str, str]]],
+    question_answer_history: List[str],
+    language: str,
+    preferences: Optional[PreferenceState] = None,
+) -> AsyncIterator[str]:
+    """Like generate_next_question, yielding the question so far as tokens arrive."""
+    messages = question_prompt(dishes, question_answer_history, language, preferences)
+    async for text in _astream_reply("question", messages, 0.6, language):
+        yield text.strip()
+
+
+async def astream_recommendations(
+    dishes: Union[CompiledMenu, List[Dict[str, str]]],
+    question_answer_history: List[str],
+    language: str,
+    preferences: Optional[PreferenceState] = None,
+) -> AsyncIterator[str]:
+    """Like recommend_dishes, yielding the recommendations so far as tokens arrive."""
+    messages = recommend_prompt(dishes, question_answer_history, language, preferences)
+    async for text in _astream_reply("recommend", messages, 0.4, language):
+        yield text
 
 
 if __name__ == "__main__":
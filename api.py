@@ -1,14 +1,60 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import Depends, FastAPI, UploadFile, File, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, NotRequired, Optional, TypedDict
 from pydantic import BaseModel
-from PIL import Image
-import io
+import asyncio
 import os
 import logging
 import traceback
 from dotenv import load_dotenv
-from ai import extract_menu_items, generate_next_question, recommend_dishes
+from ai import (
+    extract_menu_items,
+    generate_next_question,
+    get_prompt_usage_stats,
+    load_langchain,
+    recommend_dishes,
+)
+from routing import STAGE_MODELS, get_routing_stats
+from images import DECODE_STATS
+from uploads import (
+    UPLOAD_STATS,
+    current_rss_bytes,
+    RequestSizeLimitMiddleware,
+    get_upload_limits,
+    prepare_uploads,
+)
+from catalog import (
+    CATALOG,
+    MENU_REFRESHER,
+    CatalogEntry,
+    image_digests,
+    require_catalog_writer,
+)
+from menu import MENU_CACHE, CompiledMenu, compile_menu, get_compiled_menu
+from tokens import load_encoding
+from memtrace import (
+    MEMORY_TOP_N,
+    MEMORY_TRACE,
+    MEMORY_TRACKER,
+    ROUTE_ALLOCATIONS,
+    RouteAllocationMiddleware,
+)
+from metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware, render_metrics
+from preferences import PreferenceState
+from responses import FastJSONResponse
+from profiling import (
+    PROFILE_INTERVAL,
+    PROFILE_MAX_REQUESTS,
+    PROFILE_MAX_SECONDS,
+    PROFILES,
+    ProfilerBusyError,
+    ProfilingMiddleware,
+    require_profiling_token,
+)
+from tracing import SINK, TracingMiddleware, annotate, span
 
 
 # CONFIGURE LOGGING
@@ -22,7 +68,72 @@ logger = logging.getLogger("menu_analyzer")
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+# How often the event loop is probed for scheduling lag
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a periodic sleeper."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            self.samples += 1
+            self.total_lag += self.last_lag
+            self.max_lag = max(self.max_lag, self.last_lag)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def summary(self):
+        # samples and total_ms let a client average the lag over its own window
+        return {
+            "last_ms": 1000 * self.last_lag,
+            "avg_ms": 1000 * self.total_lag / self.samples if self.samples else 0.0,
+            "max_ms": 1000 * self.max_lag,
+            "samples": self.samples,
+            "total_ms": 1000 * self.total_lag,
+        }
+
+
+loop_lag = LoopLagMonitor()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_lag.start()
+    if MEMORY_TRACE:
+        MEMORY_TRACKER.start()
+    # Import LangChain and load the tokenizer vocabulary (downloaded once) in
+    # the background so the server accepts requests at once and the first LLM
+    # call does not pay for either
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, load_langchain)
+    loop.run_in_executor(None, load_encoding)
+    yield
+    await MENU_REFRESHER.stop()
+    await loop_lag.stop()
+    # Traces are written by a background thread; let it finish the queue
+    await asyncio.to_thread(SINK.flush)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Optional CORS middleware for frontend
 app.add_middleware(
@@ -32,40 +143,195 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Reject oversized uploads while they stream in, before they are parsed
+app.add_middleware(RequestSizeLimitMiddleware)
+# Outside the size limit, so rejected and failed requests are timed too; the
+# allocation, tracing and profiling middlewares below wrap it in turn
+app.add_middleware(
+    MetricsMiddleware,
+    endpoints=("/extract_menu", "/next_question", "/recommend", "/health", "/metrics"),
+)
+# Per-route allocation peaks, only while tracemalloc is on
+app.add_middleware(
+    RouteAllocationMiddleware, routes=("/extract_menu", "/next_question", "/recommend")
+)
+# Outside the metrics middleware, so every response carries its X-Request-ID
+app.add_middleware(TracingMiddleware)
+# Counts the whole request towards an armed per-route profile
+app.add_middleware(ProfilingMiddleware)
+
+
+def collect_service_stats():
+    """Expose the existing stats objects as Prometheus families at scrape time."""
+    decode = DECODE_STATS.summary()
+    routing = get_routing_stats()
+    uploads = UPLOAD_STATS.summary()
+    lag = loop_lag.summary()
+    yield (
+        "menu_analyzer_images_total",
+        "counter",
+        "Prepared images by path (passthrough or decoded).",
+        [
+            ({"path": "passthrough"}, decode["passthrough"]),
+            ({"path": "decoded"}, decode["decoded"]),
+        ],
+    )
+    yield (
+        "menu_analyzer_llm_requests_total",
+        "counter",
+        "LLM requests per stage, before escalation.",
+        [({"stage": stage}, stats["calls"]) for stage, stats in routing.items()],
+    )
+    yield (
+        "menu_analyzer_llm_escalations_total",
+        "counter",
+        "Escalations to a larger model per stage.",
+        [({"stage": stage}, stats["escalations"]) for stage, stats in routing.items()],
+    )
+    yield (
+        "menu_analyzer_event_loop_lag_seconds",
+        "gauge",
+        "Event loop scheduling lag (last, avg and max since start).",
+        [
+            ({"quantity": quantity}, lag[f"{quantity}_ms"] / 1000)
+            for quantity in ("last", "avg", "max")
+        ],
+    )
+    yield (
+        "menu_analyzer_upload_peak_bytes",
+        "gauge",
+        "Largest number of upload bytes held by one request.",
+        [({}, uploads["max_peak_bytes"])],
+    )
+    yield (
+        "menu_analyzer_process_resident_bytes",
+        "gauge",
+        "Resident set size of this worker.",
+        [({}, uploads["rss_bytes"])],
+    )
+    yield (
+        "menu_analyzer_menu_cache_entries",
+        "gauge",
+        "Compiled menus held in the menu cache.",
+        [({}, len(MENU_CACHE))],
+    )
+
+
+REGISTRY.register_collector("service", collect_service_stats)
 
 
 class QAHistory(BaseModel):
     qa: List[str]
 
 
-class Dish(BaseModel):
+class Dish(TypedDict):
+    # Validated straight into plain dicts, without a model instance per dish
     name: str
     description: str
-    price: str = ""
+    price: NotRequired[str]
 
 
 class RecommendRequest(BaseModel):
-    dishes: List[Dish]
+    dishes: List[Dish] = []
     qa: List[str]
     language: str
+    # Digest returned by /extract_menu; lets clients skip resending the dishes
+    menu_id: Optional[str] = None
+    # Preference state returned by the previous /next_question call
+    preferences: Optional[Dict[str, Any]] = None
+    # Starts a conversation from the restaurant's stored menu, without photos
+    restaurant_id: Optional[str] = None
+
+
+def resolve_menu(payload: RecommendRequest) -> CompiledMenu:
+    if payload.menu_id:
+        menu = get_compiled_menu(payload.menu_id)
+        if menu is not None:
+            return menu
+        logger.info(f"Menu {payload.menu_id} not cached, compiling from request")
+    if payload.dishes:
+        return compile_menu(payload.dishes)
+    if payload.restaurant_id:
+        return compile_menu(stored_menu(payload.restaurant_id).dishes)
+    raise HTTPException(
+        status_code=400,
+        detail="Unknown menu_id and no dishes or restaurant_id provided",
+    )
+
+
+def stored_menu(restaurant_id: str) -> CatalogEntry:
+    entry = CATALOG.latest(restaurant_id)
+    if entry is None:
+        raise HTTPException(
+            status_code=404, detail=f"No stored menu for restaurant {restaurant_id}"
+        )
+    return entry
+
+
+def refresh_menu(restaurant_id: str, images: List[Any], digests: List[str]) -> None:
+    """Extract the menu again and store it as a new version if it changed."""
+    # Errors and empty replies raise, so the refresher counts them as failed
+    dishes = extract_menu_items(images, raise_errors=True)
+    if not dishes:
+        raise ValueError("No dishes extracted")
+    CATALOG.store(restaurant_id, dishes, digests)
 
 
 @app.post("/extract_menu")
-async def extract_menu(files: List[UploadFile] = File(...)):
+async def extract_menu(
+    files: List[UploadFile] = File(...),
+    restaurant_id: Optional[str] = Query(None, min_length=1, max_length=128),
+    authorization: Optional[str] = Header(None),
+):
     try:
         if len(files) == 0:
             raise HTTPException(status_code=400, detail="No files provided")
+        if restaurant_id:
+            # Storing and refreshing a restaurant's menu are catalog writes
+            require_catalog_writer(authorization)
 
         logger.info(f"Processing {len(files)} images for menu extraction")
-        images = []
-        for file in files:
-            img_data = await file.read()
-            image = Image.open(io.BytesIO(img_data)).convert("RGB")
-            images.append(image)
+        with span("preprocess", files=len(files)):
+            images = await prepare_uploads(files)
+
+        if restaurant_id:
+            # The same photos of a known restaurant are served from the catalog;
+            # a stale menu is served as is and re-extracted in the background
+            digests = image_digests(images)
+            entry = await run_in_threadpool(
+                CATALOG.find_by_images, restaurant_id, digests
+            )
+            if entry is not None:
+                if entry.is_stale():
+                    MENU_REFRESHER.schedule(
+                        restaurant_id,
+                        lambda: refresh_menu(restaurant_id, images, digests),
+                    )
+                menu_id = compile_menu(entry.dishes).digest
+                annotate(menu_id=menu_id, dishes=len(entry.dishes), catalog="hit")
+                return FastJSONResponse(
+                    {
+                        "dishes": entry.dishes,
+                        "menu_id": menu_id,
+                        "catalog": entry.to_dict(),
+                    }
+                )
 
-        dishes = extract_menu_items(images)
+        # The LLM call blocks, so keep it off the event loop as well
+        dishes = await run_in_threadpool(extract_menu_items, images)
         logger.info(f"Successfully extracted {len(dishes)} menu items")
-        return {"dishes": dishes}
+        menu_id = compile_menu(dishes).digest if dishes else None
+        annotate(menu_id=menu_id, dishes=len(dishes))
+        content = {"dishes": dishes, "menu_id": menu_id}
+        if restaurant_id and dishes:
+            entry = await run_in_threadpool(
+                CATALOG.store, restaurant_id, dishes, digests
+            )
+            content["catalog"] = entry.to_dict()
+        # Returned as a response so the dishes skip FastAPI's jsonable_encoder pass
+        return FastJSONResponse(content)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error extracting menu: {str(e)}")
         logger.error(traceback.format_exc())
@@ -75,14 +341,21 @@ async def extract_menu(files: List[UploadFile] = File(...)):
 @app.post("/next_question")
 def next_question(payload: RecommendRequest):
     try:
+        menu = resolve_menu(payload)
+        annotate(menu_id=menu.digest, qa=len(payload.qa))
         logger.info(
-            f"Generating next question in {payload.language} for {len(payload.dishes)} dishes"
+            f"Generating next question in {payload.language} for {len(menu)} dishes"
+        )
+        preferences = PreferenceState.from_history(
+            payload.qa, PreferenceState.from_dict(payload.preferences)
+        )
+        question = generate_next_question(
+            menu, payload.qa, payload.language, preferences
         )
-        # Convert Pydantic models to dictionaries
-        dishes_dict = [dish.dict() for dish in payload.dishes]
-        question = generate_next_question(dishes_dict, payload.qa, payload.language)
         logger.info(f"Generated question: {question[:50]}...")
-        return {"question": question}
+        return {"question": question, "preferences": preferences.to_dict()}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating question: {str(e)}")
         logger.error(traceback.format_exc())
@@ -94,14 +367,21 @@ def next_question(payload: RecommendRequest):
 @app.post("/recommend")
 def recommend(payload: RecommendRequest):
     try:
+        menu = resolve_menu(payload)
+        annotate(menu_id=menu.digest, qa=len(payload.qa))
         logger.info(
-            f"Generating recommendations in {payload.language} for {len(payload.dishes)} dishes"
+            f"Generating recommendations in {payload.language} for {len(menu)} dishes"
+        )
+        recommendation = recommend_dishes(
+            menu,
+            payload.qa,
+            payload.language,
+            PreferenceState.from_dict(payload.preferences),
         )
-        # Convert Pydantic models to dictionaries
-        dishes_dict = [dish.dict() for dish in payload.dishes]
-        recommendation = recommend_dishes(dishes_dict, payload.qa, payload.language)
         logger.info("Successfully generated recommendations")
         return {"recommendations": recommendation}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating recommendations: {str(e)}")
         logger.error(traceback.format_exc())
@@ -110,7 +390,112 @@ def recommend(payload: RecommendRequest):
         )
 
 
+@app.get("/restaurants/{restaurant_id}/menu")
+def restaurant_menu(restaurant_id: str):
+    """The latest stored menu; its menu_id starts a conversation without photos."""
+    entry = stored_menu(restaurant_id)
+    menu = compile_menu(entry.dishes)
+    annotate(menu_id=menu.digest, dishes=len(menu), catalog="lookup")
+    return FastJSONResponse(
+        {"dishes": entry.dishes, "menu_id": menu.digest, "catalog": entry.to_dict()}
+    )
+
+
 # Health check endpoint
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "model": os.getenv("OPENAI_API_MODEL", "default model")}
+    return {
+        "status": "ok",
+        "model": os.getenv("OPENAI_API_MODEL", "default model"),
+        # OPENAI_BASE_URL points the app at a compatible server such as llm_stub.py
+        "llm_base_url": os.getenv("OPENAI_BASE_URL")
+        or os.getenv("OPENAI_API_BASE")
+        or "https://api.openai.com/v1",
+        "stage_models": {
+            stage: [model or "default model" for model in models]
+            for stage, models in STAGE_MODELS.items()
+        },
+        "routing": get_routing_stats(),
+        "prompt_usage": get_prompt_usage_stats(),
+        "image_decode": DECODE_STATS.summary(),
+        "event_loop_lag": loop_lag.summary(),
+        "uploads": {**UPLOAD_STATS.summary(), "limits": get_upload_limits()},
+        "catalog": {**CATALOG.summary(), "refresh": MENU_REFRESHER.summary()},
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
+# DEBUG PROFILING (disabled unless PROFILING_TOKEN is set)
+@app.get("/debug/profile", dependencies=[Depends(require_profiling_token)])
+async def profile(
+    seconds: float = Query(10.0, gt=0, le=PROFILE_MAX_SECONDS),
+    interval: float = Query(PROFILE_INTERVAL, ge=0.001, le=1.0),
+    idle: bool = False,
+):
+    """Sample every thread of this worker and return collapsed stacks."""
+    try:
+        profiler = PROFILES.start(seconds, interval, idle)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await asyncio.sleep(seconds)
+    await asyncio.to_thread(profiler.stop)
+    logger.info(f"Profiled worker: {profiler.summary()}")
+    return PlainTextResponse(profiler.collapsed(), headers=profiler.headers())
+
+
+@app.post(
+    "/debug/profile/requests",
+    status_code=202,
+    dependencies=[Depends(require_profiling_token)],
+)
+def arm_request_profile(
+    route: str,
+    count: int = Query(10, gt=0, le=PROFILE_MAX_REQUESTS),
+    interval: float = Query(PROFILE_INTERVAL, ge=0.001, le=1.0),
+):
+    """Profile the next `count` requests to `route`."""
+    try:
+        return PROFILES.arm(route, count, interval).status()
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/debug/profile/requests", dependencies=[Depends(require_profiling_token)])
+def request_profile():
+    """Status while the armed profile runs, collapsed stacks once it is done."""
+    profile = PROFILES.request_profile
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No request profile armed")
+    if not profile.done:
+        return JSONResponse(profile.status(), status_code=202)
+    return PlainTextResponse(
+        profile.profiler.collapsed(), headers=profile.profiler.headers()
+    )
+
+
+@app.get("/debug/memory", dependencies=[Depends(require_profiling_token)])
+def memory(
+    limit: int = Query(MEMORY_TOP_N, gt=0, le=200),
+    against: str = Query("previous", pattern="^(previous|baseline)$"),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    snapshot: bool = True,
+):
+    """Top allocation sites by growth, plus peak allocation per route."""
+    if not MEMORY_TRACKER.tracing:
+        raise HTTPException(
+            status_code=409,
+            detail="Memory tracing is off; start with MEMORY_TRACE=1 or --trace-memory",
+        )
+    if snapshot:
+        MEMORY_TRACKER.snapshot()
+    return {
+        **MEMORY_TRACKER.summary(),
+        "rss_bytes": current_rss_bytes(),
+        "against": against,
+        "top": MEMORY_TRACKER.top(limit, against, group_by),
+        "routes": ROUTE_ALLOCATIONS.summary(),
+    }
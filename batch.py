@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set
+from ai import extract_menu_items
+from images import prepare_image_file
+from menu import compile_menu
+
+logger = logging.getLogger("menu_analyzer")
+
+# Restaurants extracted at the same time (each one is a single LLM call)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+
+
+# DISCOVERY
+def find_restaurants(root: str) -> Dict[str, List[str]]:
+    """Map each restaurant folder under root to its menu images, in name order.
+
+    Images in nested folders belong to the top-level restaurant folder.
+    """
+    restaurants = {}
+    for entry in sorted(os.scandir(root), key=lambda entry: entry.name):
+        if not entry.is_dir() or entry.name.startswith("."):
+            continue
+        paths = []
+        for directory, _, names in os.walk(entry.path):
+            paths.extend(
+                os.path.join(directory, name)
+                for name in names
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        if paths:
+            restaurants[entry.name] = sorted(paths)
+    return restaurants
+
+
+def completed_restaurants(output: str) -> Set[str]:
+    """Restaurants already extracted successfully in an existing output file."""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run interrupted mid-write leaves a partial last line
+                continue
+            if record.get("status") == "ok":
+                done.add(record["restaurant"])
+    return done
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        if not file.tell():
+            return True
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
+
+
+# EXTRACTION
+def process_restaurant(name: str, paths: List[str]) -> Dict[str, Any]:
+    """Extract one restaurant's menu and return its JSONL record."""
+    start = time.perf_counter()
+    record: Dict[str, Any] = {"restaurant": name, "images": len(paths)}
+    try:
+        images = [prepare_image_file(path) for path in paths]
+        prepared = time.perf_counter()
+        # Failed LLM calls raise here, so they are retried on resume
+        dishes = extract_menu_items(images, raise_errors=True)
+        extracted = time.perf_counter()
+        if not dishes:
+            raise ValueError("No dishes extracted")
+        record.update(
+            status="ok",
+            dishes=dishes,
+            menu_id=compile_menu(dishes).digest,
+            prepare_ms=round(1000 * (prepared - start), 1),
+            extract_ms=round(1000 * (extracted - prepared), 1),
+        )
+    except Exception as e:
+        logger.error(f"Batch extraction failed for {name}: {str(e)}")
+        record.update(status="error", error=str(e))
+    record["total_ms"] = round(1000 * (time.perf_counter() - start), 1)
+    return record
+
+
+class BatchProgress:
+    """Completed/failed counts and throughput for a running batch."""
+
+    def __init__(self, total: int, skipped: int = 0):
+        self._lock = threading.Lock()
+        self.total = total
+        self.skipped = skipped
+        self.completed = 0
+        self.failed = 0
+        self.dishes = 0
+        self.started = time.perf_counter()
+
+    def record(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.completed += 1
+            if record["status"] == "ok":
+                self.dishes += len(record["dishes"])
+            else:
+                self.failed += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            rate = self.completed / elapsed if elapsed else 0.0
+            remaining = self.total - self.completed
+            return {
+                "total": self.total,
+                "skipped": self.skipped,
+                "completed": self.completed,
+                "failed": self.failed,
+                "dishes": self.dishes,
+                "elapsed_s": round(elapsed, 1),
+                "restaurants_per_min": round(60 * rate, 2),
+                "eta_s": round(remaining / rate, 1) if rate else None,
+            }
+
+    def log(self, name: str) -> None:
+        stats = self.summary()
+        logger.info(
+            f"[{stats['completed']}/{stats['total']}] {name}: {stats['failed']} failed, {stats['restaurants_per_min']} restaurants/min, ETA {stats['eta_s']}s"
+        )
+
+
+def run_batch(
+    root: str,
+    output: str,
+    workers: Optional[int] = None,
+    resume: bool = True,
+) -> Dict[str, Any]:
+    """Extract every restaurant under root, appending one JSONL record each.
+
+    With resume, restaurants that already have a successful record in the
+    output are skipped; failed ones are retried.
+    """
+    restaurants = find_restaurants(root)
+    done = completed_restaurants(output) if resume else set()
+    pending = {name: paths for name, paths in restaurants.items() if name not in done}
+    progress = BatchProgress(len(pending), skipped=len(restaurants) - len(pending))
+    logger.info(
+        f"Batch: {len(pending)} restaurants to extract, {progress.skipped} already done, {workers or BATCH_WORKERS} workers"
+    )
+
+    mode = "a" if resume else "w"
+    with (
+        open(output, mode, encoding="utf-8") as sink,
+        ThreadPoolExecutor(
+            max_workers=workers or BATCH_WORKERS, thread_name_prefix="batch"
+        ) as pool,
+    ):
+        if resume and not _ends_with_newline(output):
+            # Start after the partial line left by an interrupted run
+            sink.write("\n")
+        futures = {
+            pool.submit(process_restaurant, name, paths): name
+            for name, paths in pending.items()
+        }
+        for future in as_completed(futures):
+            record = future.result()
+            # Written as soon as each restaurant finishes so an interrupted
+            # run can resume from the output file
+            sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+            sink.flush()
+            progress.record(record)
+            progress.log(futures[future])
+
+    stats = progress.summary()
+    logger.info(f"Batch finished: {stats}")
+    return stats
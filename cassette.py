@@ -0,0 +1,359 @@
+import asyncio
+import atexit
+import collections
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+)
+
+logger = logging.getLogger("menu_analyzer")
+
+# "record" appends every LLM call to the cassette, "replay" answers from it
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off")
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", os.path.join("cassettes", "llm_calls.jsonl"))
+# "prompt" replays the call with the identical prompt; "stage" replays a
+# stage's calls in recorded order, so changed prompts can be replayed too
+LLM_CASSETTE_MATCH = os.getenv("LLM_CASSETTE_MATCH", "prompt")
+# Replayed calls wait their recorded latency times this factor (0: no waiting)
+LLM_REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+
+_DATA_URL = re.compile(r"^data:([^;,]+)?(;base64)?,")
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+# Inputs of the ai.py call in progress, stored with the calls it makes
+_call_inputs: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "call_inputs", default=None
+)
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when the cassette has no call to answer with."""
+
+
+def image_digest(url: str) -> Dict[str, Any]:
+    """Stand-in for an image part: its digest and size instead of the bytes."""
+    match = _DATA_URL.match(url)
+    return {
+        "sha256": hashlib.sha256(url.encode()).hexdigest(),
+        "mime_type": match.group(1) if match else None,
+        "bytes": len(url) - match.end() if match else len(url),
+    }
+
+
+def prompt_record(messages: Sequence[Any]) -> List[Dict[str, Any]]:
+    """Messages as JSON, with image data replaced by digests."""
+    record = []
+    for message in messages:
+        content = getattr(message, "content", message)
+        if not isinstance(content, str):
+            content = [
+                {"type": "image", **image_digest(part["image_url"]["url"])}
+                if part.get("type") == "image_url"
+                else part
+                for part in content
+            ]
+        record.append({"role": getattr(message, "type", "user"), "content": content})
+    return record
+
+
+def prompt_key(
+    stage: str, model: Optional[str], temperature: float, prompt: List[Dict[str, Any]]
+) -> str:
+    canonical = json.dumps(
+        [stage, model, temperature, prompt], sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+@contextmanager
+def call_inputs(**inputs: Any) -> Iterator[None]:
+    """Attach the ai.py call's inputs to the LLM calls it makes, for replay."""
+    token = _call_inputs.set(inputs)
+    try:
+        yield
+    finally:
+        _call_inputs.reset(token)
+
+
+def _jsonable(value: Any) -> Any:
+    # Menus and preference states are stored as the plain data they were built from
+    if hasattr(value, "as_list"):
+        return value.as_list()
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    return value
+
+
+def _usage(response: Any) -> Optional[Dict[str, Any]]:
+    usage = getattr(response, "usage_metadata", None)
+    return dict(usage) if usage else None
+
+
+def is_complete(record: Dict[str, Any]) -> bool:
+    """Whether a recorded call got its whole reply (older records have no flag)."""
+    return record.get("complete", True)
+
+
+# CASSETTE
+class Cassette:
+    """A JSONL file of LLM calls: prompts, replies, usage and timings.
+
+    Recorded calls are appended by a background thread, so streaming replies
+    on the event loop never wait for the disk; pending ones are written at exit.
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CASSETTE,
+        mode: str = LLM_CASSETTE_MODE,
+        match: str = LLM_CASSETTE_MATCH,
+        latency_scale: float = LLM_REPLAY_LATENCY_SCALE,
+    ):
+        self.path = path
+        self.mode = mode
+        self.match = match
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._by_stage: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._loaded = False
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self.prompt_changed = 0
+
+    def _load(self) -> None:
+        # Calls recorded by this process are replayable too
+        self.flush()
+        with self._lock:
+            if self._loaded:
+                return
+            records = []
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as file:
+                    records = [json.loads(line) for line in file if line.strip()]
+            # Streams cut short hold a truncated reply, so they are never replayed
+            complete = [record for record in records if is_complete(record)]
+            for record in complete:
+                self._by_key.setdefault(record["key"], collections.deque()).append(
+                    record
+                )
+                self._by_stage.setdefault(record["stage"], collections.deque()).append(
+                    record
+                )
+            self._loaded = True
+            logger.info(
+                f"Loaded {len(complete)} LLM calls from {self.path} ({len(records) - len(complete)} incomplete skipped)"
+            )
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Queue a recorded call for the writer thread."""
+        if self._writer is None:
+            self._start()
+        self._queue.put(record)
+
+    def flush(self) -> None:
+        """Wait until every queued call is written."""
+        self._queue.join()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._run, name="cassette-writer", daemon=True
+                )
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            try:
+                self._append(record)
+            except Exception as e:
+                logger.error(f"Error writing LLM call to {self.path}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.path)
+        with self._lock:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.recorded += 1
+
+    def find(self, stage: str, key: str) -> Dict[str, Any]:
+        """Next recorded call for this prompt (or stage); each queue cycles."""
+        self._load()
+        with self._lock:
+            queue = self._by_key.get(key)
+            if not queue and self.match == "stage":
+                queue = self._by_stage.get(stage)
+            if not queue:
+                self.misses += 1
+                raise CassetteMissError(f"No recorded {stage} call in {self.path}")
+            record = queue[0]
+            queue.rotate(-1)
+            self.replayed += 1
+            self.prompt_changed += record["key"] != key
+            return record
+
+    def wrap(self, chat_model: Callable[..., Any], stage: str) -> Callable[..., Any]:
+        """Chat model factory that records or replays; unchanged when off."""
+        if self.mode == "record":
+            return lambda **kwargs: RecordingChatModel(
+                chat_model(**kwargs), self, stage, kwargs
+            )
+        if self.mode == "replay":
+            return lambda **kwargs: ReplayChatModel(self, stage, kwargs)
+        return chat_model
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": self.path,
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "misses": self.misses,
+                "prompt_changed": self.prompt_changed,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_key.clear()
+            self._by_stage.clear()
+            self._loaded = False
+            self.recorded = self.replayed = self.misses = self.prompt_changed = 0
+
+
+CASSETTE = Cassette()
+
+
+class RecordingChatModel:
+    """Passes calls through to the real model and writes them to the cassette."""
+
+    def __init__(
+        self, llm: Any, cassette: Cassette, stage: str, kwargs: Dict[str, Any]
+    ):
+        self.llm = llm
+        self.cassette = cassette
+        self.stage = stage
+        self.model = kwargs.get("model")
+        self.temperature = kwargs.get("temperature")
+
+    def _record(
+        self, messages, response, seconds, first_token_seconds=None, complete=True
+    ):
+        prompt = prompt_record(messages)
+        self.cassette.write(
+            {
+                "key": prompt_key(self.stage, self.model, self.temperature, prompt),
+                "stage": self.stage,
+                "model": self.model,
+                "temperature": self.temperature,
+                "recorded_at": time.time(),
+                "inputs": {
+                    name: _jsonable(value)
+                    for name, value in (_call_inputs.get() or {}).items()
+                },
+                "prompt": prompt,
+                "response": response.content,
+                "usage": _usage(response),
+                "latency_s": round(seconds, 4),
+                "first_token_s": None
+                if first_token_seconds is None
+                else round(first_token_seconds, 4),
+                # False when the stream failed or its consumer stopped early
+                "complete": complete,
+            }
+        )
+
+    def invoke(self, messages: Sequence[Any]) -> Any:
+        start = time.perf_counter()
+        response = self.llm.invoke(messages)
+        self._record(messages, response, time.perf_counter() - start)
+        return response
+
+    async def astream(self, messages: Sequence[Any]) -> AsyncIterator[Any]:
+        start = time.perf_counter()
+        response = first_token = None
+        complete = False
+        try:
+            async for chunk in self.llm.astream(messages):
+                if response is None:
+                    first_token = time.perf_counter() - start
+                response = chunk if response is None else response + chunk
+                yield chunk
+            complete = True
+        finally:
+            # Also runs when the consumer closes the stream early
+            if response is not None:
+                self._record(
+                    messages,
+                    response,
+                    time.perf_counter() - start,
+                    first_token,
+                    complete,
+                )
+
+
+class ReplayChatModel:
+    """Answers from the cassette, with the recorded latency scaled."""
+
+    def __init__(self, cassette: Cassette, stage: str, kwargs: Dict[str, Any]):
+        self.cassette = cassette
+        self.stage = stage
+        self.model = kwargs.get("model")
+        self.temperature = kwargs.get("temperature")
+
+    def _find(self, messages: Sequence[Any]) -> Dict[str, Any]:
+        prompt = prompt_record(messages)
+        key = prompt_key(self.stage, self.model, self.temperature, prompt)
+        return self.cassette.find(self.stage, key)
+
+    def invoke(self, messages: Sequence[Any]) -> Any:
+        from langchain_core.messages import AIMessage
+
+        record = self._find(messages)
+        time.sleep(record["latency_s"] * self.cassette.latency_scale)
+        return AIMessage(content=record["response"], usage_metadata=record["usage"])
+
+    async def astream(self, messages: Sequence[Any]) -> AsyncIterator[Any]:
+        from langchain_core.messages import AIMessageChunk
+
+        record = self._find(messages)
+        scale = self.cassette.latency_scale
+        first_token = record["first_token_s"] or record["latency_s"]
+        pieces = _TOKEN.findall(record["response"]) or [""]
+        # The rest of the recorded time is spread evenly over the pieces
+        gap = max(0.0, record["latency_s"] - first_token) / len(pieces)
+        await asyncio.sleep(first_token * scale)
+        for index, piece in enumerate(pieces):
+            if index:
+                await asyncio.sleep(gap * scale)
+            last = index == len(pieces) - 1
+            yield AIMessageChunk(
+                content=piece, usage_metadata=record["usage"] if last else None
+            )
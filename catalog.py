@@ -0,0 +1,304 @@
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from fastapi import Header, HTTPException
+from menu import menu_digest
+
+logger = logging.getLogger("menu_analyzer")
+
+# SQLite file holding extracted menus by restaurant; created on first use
+MENU_CATALOG = os.getenv("MENU_CATALOG", "menu_catalog.sqlite3")
+# Menus not confirmed by an extraction for this long are refreshed in the
+# background the next time their photos are uploaded
+MENU_STALE_SECONDS = float(os.getenv("MENU_STALE_SECONDS", str(7 * 24 * 3600)))
+# Wait after a failed refresh before the next one; doubles with each failure
+MENU_REFRESH_BACKOFF_SECONDS = float(os.getenv("MENU_REFRESH_BACKOFF_SECONDS", "300"))
+# When set, storing menus under a restaurant_id needs this bearer token.
+# Without it any client can publish a restaurant's menu (trusted clients only)
+CATALOG_WRITE_TOKEN = os.getenv("CATALOG_WRITE_TOKEN", "")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS menus (
+    restaurant_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    menu_id TEXT NOT NULL,
+    images_key TEXT NOT NULL,
+    image_digests TEXT NOT NULL,
+    dishes TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (restaurant_id, version)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS menus_by_images ON menus (restaurant_id, images_key);
+"""
+_COLUMNS = (
+    "restaurant_id, version, menu_id, image_digests, dishes, created_at, refreshed_at"
+)
+
+
+def image_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def image_digests(images: Sequence[Any]) -> List[str]:
+    """Digests of prepared images (EncodedImage) in upload order."""
+    return [image_digest(image.data) for image in images]
+
+
+def _images_key(digests: Sequence[str]) -> str:
+    return hashlib.sha256("\n".join(digests).encode()).hexdigest()[:32]
+
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    """One stored version of a restaurant's menu."""
+
+    restaurant_id: str
+    version: int
+    menu_id: str
+    image_digests: List[str]
+    dishes: List[Dict[str, str]]
+    # When this version was first extracted, and last confirmed by an extraction
+    created_at: float
+    refreshed_at: float
+
+    def is_stale(self, max_age: Optional[float] = None) -> bool:
+        if max_age is None:
+            max_age = MENU_STALE_SECONDS
+        return time.time() - self.refreshed_at > max_age
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "restaurant_id": self.restaurant_id,
+            "version": self.version,
+            "menu_id": self.menu_id,
+            "images": len(self.image_digests),
+            "created_at": self.created_at,
+            "refreshed_at": self.refreshed_at,
+            "stale": self.is_stale(),
+        }
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "CatalogEntry":
+        restaurant_id, version, menu_id, digests, dishes, created, refreshed = row
+        return cls(
+            restaurant_id,
+            version,
+            menu_id,
+            json.loads(digests),
+            json.loads(dishes),
+            created,
+            refreshed,
+        )
+
+
+# CATALOG
+class MenuCatalog:
+    """Versioned menus keyed by restaurant id and the digests of their photos."""
+
+    def __init__(self, path: str = MENU_CATALOG):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "confirmed": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        # Called with the lock held
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+            logger.info(f"Opened menu catalog {self.path}")
+        return self._connection
+
+    def _query_one(self, sql: str, parameters: Sequence[Any]) -> Optional[CatalogEntry]:
+        with self._lock:
+            row = self._connect().execute(sql, parameters).fetchone()
+            self._stats["hits" if row else "misses"] += 1
+        return CatalogEntry.from_row(row) if row else None
+
+    def latest(self, restaurant_id: str) -> Optional[CatalogEntry]:
+        return self._query_one(
+            f"SELECT {_COLUMNS} FROM menus WHERE restaurant_id = ? "
+            "ORDER BY version DESC LIMIT 1",
+            (restaurant_id,),
+        )
+
+    def find_by_images(
+        self, restaurant_id: str, digests: Sequence[str]
+    ) -> Optional[CatalogEntry]:
+        """Latest version extracted from exactly these photos, in this order."""
+        return self._query_one(
+            f"SELECT {_COLUMNS} FROM menus WHERE restaurant_id = ? AND images_key = ? "
+            "ORDER BY version DESC LIMIT 1",
+            (restaurant_id, _images_key(digests)),
+        )
+
+    def store(
+        self,
+        restaurant_id: str,
+        dishes: List[Dict[str, str]],
+        digests: Sequence[str],
+    ) -> CatalogEntry:
+        """Add a version for new photos or a changed menu, else confirm the stored one.
+
+        Photos that were superseded by newer ones only confirm their own
+        version, so a late refresh of old photos cannot hide a newer menu.
+        """
+        menu_id, images_key = menu_digest(dishes), _images_key(digests)
+        now = time.time()
+        with self._lock, self._connect() as connection:
+            latest = connection.execute(
+                "SELECT version FROM menus WHERE restaurant_id = ? "
+                "ORDER BY version DESC LIMIT 1",
+                (restaurant_id,),
+            ).fetchone()
+            row = connection.execute(
+                "SELECT version, menu_id, dishes, created_at FROM menus "
+                "WHERE restaurant_id = ? AND images_key = ? "
+                "ORDER BY version DESC LIMIT 1",
+                (restaurant_id, images_key),
+            ).fetchone()
+            if row and (row[1] == menu_id or row[0] != latest[0]):
+                version, created_at = row[0], row[3]
+                if row[1] != menu_id:
+                    logger.info(
+                        f"Kept menu v{version} for {restaurant_id}: its photos were superseded"
+                    )
+                    menu_id, dishes = row[1], json.loads(row[2])
+                connection.execute(
+                    "UPDATE menus SET refreshed_at = ? "
+                    "WHERE restaurant_id = ? AND version = ?",
+                    (now, restaurant_id, version),
+                )
+                self._stats["confirmed"] += 1
+            else:
+                version, created_at = (latest[0] + 1 if latest else 1), now
+                connection.execute(
+                    "INSERT INTO menus VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        restaurant_id,
+                        version,
+                        menu_id,
+                        images_key,
+                        json.dumps(list(digests)),
+                        json.dumps(dishes, ensure_ascii=False),
+                        now,
+                        now,
+                    ),
+                )
+                self._stats["stored"] += 1
+                logger.info(
+                    f"Stored menu {menu_id} v{version} for {restaurant_id} ({len(dishes)} dishes)"
+                )
+        return CatalogEntry(
+            restaurant_id, version, menu_id, list(digests), dishes, created_at, now
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": self.path,
+                "stale_seconds": MENU_STALE_SECONDS,
+                **self._stats,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+CATALOG = MenuCatalog()
+
+
+def require_catalog_writer(authorization: Optional[str] = Header(None)) -> None:
+    """Check the CATALOG_WRITE_TOKEN bearer token, when one is configured."""
+    if not CATALOG_WRITE_TOKEN:
+        return
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), CATALOG_WRITE_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=401, detail="Invalid catalog write token")
+
+
+# BACKGROUND REFRESH
+class MenuRefresher:
+    """Runs menu refreshes in the background, at most one per restaurant.
+
+    A failed refresh is retried no sooner than MENU_REFRESH_BACKOFF_SECONDS
+    later, doubling with each further failure up to MENU_STALE_SECONDS.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # restaurant_id -> (consecutive failures, monotonic time of next attempt)
+        self._backoff: Dict[str, Tuple[int, float]] = {}
+        self.refreshed = 0
+        self.failed = 0
+
+    def schedule(self, restaurant_id: str, refresh: Callable[[], Any]) -> bool:
+        """Start `refresh` in a worker thread unless one is running or backing off."""
+        if restaurant_id in self._tasks:
+            return False
+        failures, retry_at = self._backoff.get(restaurant_id, (0, 0.0))
+        if time.monotonic() < retry_at:
+            return False
+        # A fresh context keeps the refresh out of the request's trace
+        self._tasks[restaurant_id] = asyncio.get_running_loop().create_task(
+            self._run(restaurant_id, refresh), context=contextvars.Context()
+        )
+        return True
+
+    async def _run(self, restaurant_id: str, refresh: Callable[[], Any]) -> None:
+        try:
+            await asyncio.to_thread(refresh)
+            self.refreshed += 1
+            self._backoff.pop(restaurant_id, None)
+        except Exception as e:
+            self.failed += 1
+            failures = self._backoff.get(restaurant_id, (0, 0.0))[0] + 1
+            delay = min(
+                MENU_REFRESH_BACKOFF_SECONDS * 2 ** (failures - 1),
+                max(MENU_STALE_SECONDS, MENU_REFRESH_BACKOFF_SECONDS),
+            )
+            self._backoff[restaurant_id] = (failures, time.monotonic() + delay)
+            logger.error(
+                f"Error refreshing menu for {restaurant_id}: {str(e)}; retrying in {delay:.0f}s"
+            )
+        finally:
+            self._tasks.pop(restaurant_id, None)
+
+    async def wait(self) -> None:
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        await self.wait()
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._tasks),
+            "backing_off": len(self._backoff),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+        }
+
+
+MENU_REFRESHER = MenuRefresher()
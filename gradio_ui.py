@@ -1,6 +1,12 @@
 import logging
+import os
 import gradio as gr
-from ai import extract_menu_items, generate_next_question, recommend_dishes
+from PIL import UnidentifiedImageError
+from ai import astream_menu_items, astream_next_question, astream_recommendations
+from images import ImageTooLargeError, prepare_image_file_async
+from menu import compile_menu
+from preferences import PreferenceState
+from sessions import SESSION_STORE, SESSION_TTL_SECONDS, get_session_stats
 
 # CONFIGURE LOGGING
 logging.basicConfig(
@@ -12,6 +18,36 @@ logger = logging.getLogger("menu_analyzer")
 
 # Constants
 MAX_QUESTIONS = 5
+# Queue: events processed at once per event type, and requests allowed to wait
+GRADIO_CONCURRENCY = int(os.getenv("GRADIO_CONCURRENCY", "16"))
+GRADIO_EXTRACT_CONCURRENCY = int(os.getenv("GRADIO_EXTRACT_CONCURRENCY", "4"))
+GRADIO_QUEUE_SIZE = int(os.getenv("GRADIO_QUEUE_SIZE", "100"))
+
+
+def conversation_pairs(question_answer_list, pending=None):
+    """Chatbot rows for the Q&A so far, plus the reply still being streamed."""
+    messages = question_answer_list + ([pending] if pending is not None else [])
+    return [[None, messages[0]]] + [
+        [messages[i], messages[i + 1] if i + 1 < len(messages) else None]
+        for i in range(1, len(messages), 2)
+    ]
+
+
+DISH_TABLE_HEADERS = ["Dish", "Description", "Price"]
+
+
+def gallery_paths(gallery_value):
+    # A filepath Gallery holds (path, caption) pairs
+    return [
+        item[0] if isinstance(item, (list, tuple)) else item for item in gallery_value
+    ]
+
+
+def dish_rows(dishes):
+    return [
+        [dish.get("name", ""), dish.get("description", ""), dish.get("price", "")]
+        for dish in dishes
+    ]
 
 
 # USER INTERFACE
@@ -22,7 +58,11 @@ def build_ui():
         gr.Markdown("### 📸 Not Sure What to Order? Let AI Recommend!")
         with gr.Row(equal_height=True):
             with gr.Column(scale=1):
-                menu_gallery = gr.Gallery(label="Menu photo(s)", type="pil", height=600)
+                # Photos arrive as file paths and go through the same byte-level
+                # pipeline as API uploads, decoded only if they must shrink
+                menu_gallery = gr.Gallery(
+                    label="Menu photo(s)", type="filepath", height=600
+                )
                 language_dropdown = gr.Dropdown(
                     label="Conversation language",
                     choices=[
@@ -37,6 +77,13 @@ def build_ui():
                     value="English",
                 )
                 start_button = gr.Button("Start", variant="primary")
+                extract_status = gr.Markdown()
+                dish_table = gr.Dataframe(
+                    headers=DISH_TABLE_HEADERS,
+                    label="Dishes",
+                    interactive=False,
+                    wrap=True,
+                )
 
             with gr.Column(scale=2):
                 chat_interface = gr.Chatbot(height=700)
@@ -49,75 +96,174 @@ def build_ui():
                     )
                     send_button = gr.Button("Send", scale=1)
 
+        # Only the session id lives in Gradio; the conversation is kept in the
+        # bounded SESSION_STORE and dropped when the browser session closes
         app_state = gr.State(
-            value={"stage": "await", "lang": "English", "dishes": [], "qa": []}
+            value=None,
+            time_to_live=SESSION_TTL_SECONDS,
+            delete_callback=SESSION_STORE.discard,
         )
 
-        def initialize_conversation(selected_language, menu_images, current_state):
+        async def initialize_conversation(selected_language, menu_images, session_id):
             logger.info(f"Initializing conversation in {selected_language}")
-            current_state.update(lang=selected_language)
+            session_id, session = SESSION_STORE.session(session_id)
+            session.lang = selected_language
 
             if not menu_images:
                 logger.warning("No menu images provided")
-                return gr.Warning("Please upload menu photo(s)."), current_state
+                gr.Warning("Please upload menu photo(s).")
+                yield gr.update(), session_id, gr.update(), gr.update()
+                return
 
-            extracted_dishes = extract_menu_items(menu_images)
+            try:
+                menu_images = [
+                    await prepare_image_file_async(path)
+                    for path in gallery_paths(menu_images)
+                ]
+            except (ImageTooLargeError, UnidentifiedImageError, OSError) as e:
+                logger.warning(f"Unusable menu photo: {str(e)}")
+                gr.Warning("One of the photos is too large or not an image.")
+                yield gr.update(), session_id, gr.update(), gr.update()
+                return
+
+            # Fill the dish table as dishes are parsed, page by page
+            extracted_dishes = []
+            async for page, pages, extracted_dishes in astream_menu_items(menu_images):
+                yield (
+                    gr.update(),
+                    session_id,
+                    gr.update(value=dish_rows(extracted_dishes)),
+                    f"Reading page {page}/{pages} · {len(extracted_dishes)} dishes found",
+                )
             if not extracted_dishes:
                 logger.warning("No dishes could be extracted from images")
-                return gr.Warning("Couldn't parse dishes."), current_state
+                gr.Warning("Couldn't parse dishes.")
+                yield gr.update(), session_id, gr.update(value=[]), ""
+                return
 
             logger.info(f"Successfully extracted {len(extracted_dishes)} dishes")
-            first_question = generate_next_question(
-                extracted_dishes, [], selected_language
-            )
-            current_state.update(
-                stage="asking", dishes=extracted_dishes, qa=[first_question]
+            status = f"{len(extracted_dishes)} dishes from {len(menu_images)} page(s)"
+            # Compile once so every following turn reuses the serialized menu
+            menu = compile_menu(extracted_dishes)
+            session.stage, session.menu = "streaming", menu
+            session.qa, session.preferences = [], None
+            table = gr.update(value=dish_rows(menu.as_list()))
+            first_question = ""
+            try:
+                async for first_question in astream_next_question(
+                    menu, [], selected_language
+                ):
+                    yield (
+                        gr.update(value=[[None, first_question]]),
+                        session_id,
+                        table,
+                        status,
+                    )
+            except Exception as e:
+                logger.error(f"Error generating the first question: {str(e)}")
+                session.stage = "await"
+                gr.Warning("Couldn't start the conversation, please try again.")
+                yield gr.update(value=[]), session_id, table, status
+                return
+            session.stage, session.qa = "asking", [first_question]
+            logger.info(f"Conversation initialized successfully ({get_session_stats()})")
+            yield (
+                gr.update(value=[[None, first_question]]),
+                session_id,
+                table,
+                status,
             )
-            logger.info("Conversation initialized successfully")
-            return gr.update(value=[[None, first_question]]), current_state
 
         start_button.click(
             initialize_conversation,
             [language_dropdown, menu_gallery, app_state],
-            [chat_interface, app_state],
+            [chat_interface, app_state, dish_table, extract_status],
+            concurrency_limit=GRADIO_EXTRACT_CONCURRENCY,
+            concurrency_id="extract",
         )
 
-        def process_conversation(user_message, current_state):
-            if current_state["stage"] != "asking":
+        async def process_conversation(user_message, session_id):
+            session_id, session = SESSION_STORE.session(session_id)
+            if session.stage != "asking":
                 logger.debug("Ignoring input - conversation not in asking stage")
-                return current_state, gr.update()
+                if session.stage == "await":
+                    gr.Warning("Please upload menu photo(s) and press Start.")
+                yield session_id, gr.update()
+                return
 
             logger.info("Processing user response")
-            question_answer_list = current_state["qa"] + [user_message]
-            current_state["qa"] = question_answer_list
+            question_answer_list = session.qa + [user_message]
+            previous_preferences = session.preferences
+            session.qa = question_answer_list
+            # Fold only the new answer into the running preference summary
+            preferences = PreferenceState.from_history(
+                question_answer_list, session.preferences
+            )
+            session.preferences = preferences
 
             if len(question_answer_list) // 2 >= MAX_QUESTIONS:
                 logger.info(
                     f"Reached max questions ({MAX_QUESTIONS}), generating final recommendations"
                 )
-                bot_response = recommend_dishes(
-                    current_state["dishes"], question_answer_list, current_state["lang"]
-                )
-                current_state["stage"] = "done"
-                logger.info("Conversation completed")
+                stream, next_stage = astream_recommendations, "done"
             else:
                 question_number = len(question_answer_list) // 2 + 1
                 logger.info(f"Generating question {question_number}/{MAX_QUESTIONS}")
-                bot_response = generate_next_question(
-                    current_state["dishes"], question_answer_list, current_state["lang"]
+                stream, next_stage = astream_next_question, "asking"
+
+            # Answers sent while the reply is streaming are ignored
+            session.stage = "streaming"
+            bot_response = ""
+            yield (
+                session_id,
+                gr.update(value=conversation_pairs(question_answer_list, bot_response)),
+            )
+            try:
+                async for bot_response in stream(
+                    session.menu,
+                    question_answer_list,
+                    session.lang,
+                    preferences,
+                ):
+                    yield (
+                        session_id,
+                        gr.update(
+                            value=conversation_pairs(question_answer_list, bot_response)
+                        ),
+                    )
+            except Exception as e:
+                logger.error(f"Error generating a reply: {str(e)}")
+                # Drop the answer, and what was learned from it, so it can be sent again
+                session.stage, session.qa = "asking", question_answer_list[:-1]
+                session.preferences = previous_preferences
+                gr.Warning("Something went wrong, please send your answer again.")
+                yield (
+                    session_id,
+                    gr.update(value=conversation_pairs(session.qa)),
                 )
+                return
 
             question_answer_list.append(bot_response)
-            conversation_pairs = [[None, question_answer_list[0]]] + [
-                [question_answer_list[i], question_answer_list[i + 1]]
-                for i in range(1, len(question_answer_list), 2)
-            ]
-            return current_state, gr.update(value=conversation_pairs)
-
-        user_input.submit(
-            process_conversation, [user_input, app_state], [app_state, chat_interface]
-        ).then(lambda: "", None, user_input)
-        send_button.click(
-            process_conversation, [user_input, app_state], [app_state, chat_interface]
-        ).then(lambda: "", None, user_input)
+            session.stage = next_stage
+            if next_stage == "done":
+                logger.info("Conversation completed")
+            yield (
+                session_id,
+                gr.update(value=conversation_pairs(question_answer_list)),
+            )
+
+        for trigger in (user_input.submit, send_button.click):
+            trigger(
+                process_conversation,
+                [user_input, app_state],
+                [app_state, chat_interface],
+                concurrency_limit=GRADIO_CONCURRENCY,
+                concurrency_id="conversation",
+            ).then(lambda: "", None, user_input)
+
+        # Session counts and memory for operators, e.g. with gradio_client:
+        # Client(url).predict(api_name="/session_stats"); skips the queue
+        gr.api(get_session_stats, api_name="session_stats", queue=False)
+
+    demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_QUEUE_SIZE)
     return demo
@@ -1,6 +1,10 @@
+import importlib.util
 import logging
+import os
 import sys
-import importlib.util
+from functools import lru_cache
+from importlib.machinery import PathFinder
+from types import ModuleType
 from ai import extract_menu_items, generate_next_question, recommend_dishes
 
 
@@ -12,24 +16,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger("menu_analyzer")
 
-real_gradio_spec = importlib.util.find_spec("gradio", None)
-for path in sys.path:
-    if "__pycache__" in path or "/menu-analyzer-ai" in path:
-        continue
-    try:
-        real_gradio_spec = importlib.util.find_spec("gradio", [path])
-        if real_gradio_spec:
-            break
-    except (ImportError, AttributeError):
-        continue
-
-if real_gradio_spec:
-    real_gradio = importlib.util.module_from_spec(real_gradio_spec)
-    real_gradio_spec.loader.exec_module(real_gradio)
-    gr = real_gradio
-else:
-    # Fallback
-    import gradio as gr
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _is_project_module(module_file: str, project_dir: str) -> bool:
+    return os.path.abspath(module_file).startswith(project_dir + os.sep)
+
+
+@lru_cache(maxsize=None)
+def resolve_gradio(project_dir: str = PROJECT_DIR) -> ModuleType:
+    """Return the installed Gradio package, importing it at most once.
+
+    An already imported Gradio is reused as-is. Only when a module inside the
+    project shadows it is the installed package looked up on the rest of
+    sys.path; it is then registered in sys.modules so every later
+    `import gradio` shares the same instance.
+    """
+    module = sys.modules.get("gradio")
+    if module is None:
+        spec = importlib.util.find_spec("gradio")
+        if spec is None or not _is_project_module(spec.origin or "", project_dir):
+            return importlib.import_module("gradio")
+        paths = [
+            path
+            for path in sys.path
+            if os.path.abspath(path or os.curdir) != project_dir
+        ]
+        spec = PathFinder.find_spec("gradio", paths)
+        if spec is None:
+            raise ImportError("Gradio is not installed outside the project")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["gradio"] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules["gradio"]
+            raise
+    return module
+
+
+gr = resolve_gradio()
 
 # Constants
 MAX_QUESTIONS = 5
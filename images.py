@@ -0,0 +1,250 @@
+import asyncio
+import base64
+import io
+import logging
+import os
+import struct
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+from PIL import Image
+from metrics import STAGE_SECONDS
+from tracing import run_in_context, span
+
+logger = logging.getLogger("menu_analyzer")
+
+# Uploads within these limits are forwarded as-is, without decoding
+PASSTHROUGH_MIME_TYPES = ("image/jpeg", "image/png", "image/webp")
+MAX_PASSTHROUGH_BYTES = int(os.getenv("MAX_PASSTHROUGH_BYTES", str(8 * 1024 * 1024)))
+MAX_PASSTHROUGH_PIXELS = int(os.getenv("MAX_PASSTHROUGH_PIXELS", "16000000"))
+MAX_PASSTHROUGH_SIDE = int(os.getenv("MAX_PASSTHROUGH_SIDE", "4096"))
+# Everything else is decoded, fitted into this size and re-encoded as JPEG
+MAX_ENCODE_SIDE = int(os.getenv("MAX_ENCODE_SIDE", "2048"))
+JPEG_QUALITY = 90
+# Larger images are rejected before decoding (decompression-bomb protection)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+# Decoding runs on this many worker threads, off the event loop
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# JPEG start-of-frame markers that carry the image size (not DHT/JPG/DAC)
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image exceeds the pixel limit."""
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """Image bytes ready to be sent to the model, with their MIME type and size."""
+
+    mime_type: str
+    data: bytes
+    width: int
+    height: int
+    passthrough: bool = False
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode()
+
+    def to_data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.to_base64()}"
+
+
+# HEADER SNIFFING
+def _sniff_jpeg(data: bytes) -> Optional[Tuple[int, int]]:
+    position = 2
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        (length,) = struct.unpack(">H", data[position + 2 : position + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[position + 5 : position + 9])
+            return width, height
+        position += 2 + length
+    return None
+
+
+def _sniff_webp(data: bytes) -> Optional[Tuple[int, int]]:
+    chunk = data[12:16]
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    return None
+
+
+def sniff_image(data: bytes) -> Optional[Tuple[str, int, int]]:
+    """Return (mime_type, width, height) from the header, or None if unknown."""
+    size = None
+    if data.startswith(b"\x89PNG\r\n\x1a\n") and data[12:16] == b"IHDR":
+        mime_type, size = "image/png", struct.unpack(">II", data[16:24])
+    elif data.startswith(b"\xff\xd8"):
+        mime_type, size = "image/jpeg", _sniff_jpeg(data)
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        mime_type, size = "image/webp", _sniff_webp(data)
+    if not size or not all(size):
+        return None
+    return mime_type, size[0], size[1]
+
+
+def image_pixels(data: bytes) -> int:
+    """Return the pixel count from the header, without decoding the image."""
+    sniffed = sniff_image(data)
+    if sniffed:
+        return sniffed[1] * sniffed[2]
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(data)) as image:
+                return image.width * image.height
+    except (Image.DecompressionBombWarning, Image.DecompressionBombError) as e:
+        raise ImageTooLargeError(str(e)) from e
+
+
+# PREPROCESSING
+class DecodeStats:
+    """Counts of pass-through and decoded uploads, with decode timings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def record(self, passthrough: bool, seconds: float) -> None:
+        with self._lock:
+            self._stats["images"] += 1
+            if passthrough:
+                self._stats["passthrough"] += 1
+            else:
+                self._stats["decoded"] += 1
+                self._stats["decode_seconds"] += seconds
+                self._stats["max_decode_seconds"] = max(
+                    self._stats["max_decode_seconds"], seconds
+                )
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        decoded = stats.pop("decoded")
+        return {
+            **stats,
+            "decoded": decoded,
+            "avg_decode_ms": 1000 * stats["decode_seconds"] / decoded
+            if decoded
+            else 0.0,
+            "max_decode_ms": 1000 * stats.pop("max_decode_seconds"),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats = {
+                "images": 0,
+                "passthrough": 0,
+                "decoded": 0,
+                "decode_seconds": 0.0,
+                "max_decode_seconds": 0.0,
+            }
+
+
+DECODE_STATS = DecodeStats()
+IMAGE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=IMAGE_WORKERS, thread_name_prefix="image-decode"
+)
+
+
+def _fit_size(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def encode_image(image: Image.Image, max_side: Optional[int] = None) -> EncodedImage:
+    max_side = min(max_side or MAX_ENCODE_SIDE, MAX_ENCODE_SIDE)
+    with STAGE_SECONDS.time(stage="image_decode"):
+        if image.format == "JPEG":
+            # Let libjpeg decode at a reduced DCT scale close to the target size
+            image.draft("RGB", _fit_size(*image.size, max_side))
+        image.load()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+    if max(image.size) > max_side:
+        with STAGE_SECONDS.time(stage="image_resize"):
+            image = image.copy()
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    with STAGE_SECONDS.time(stage="image_encode"):
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+    return EncodedImage("image/jpeg", buffer.getvalue(), *image.size)
+
+
+def prepare_image_bytes(data: bytes, max_side: Optional[int] = None) -> EncodedImage:
+    """Turn uploaded bytes into an EncodedImage, decoding only when needed."""
+    start = time.perf_counter()
+    sniffed = sniff_image(data)
+    pixels = sniffed[1] * sniffed[2] if sniffed else image_pixels(data)
+    if pixels > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(
+            f"Image has {pixels} pixels, the limit is {MAX_IMAGE_PIXELS}"
+        )
+    if sniffed:
+        mime_type, width, height = sniffed
+        if (
+            mime_type in PASSTHROUGH_MIME_TYPES
+            and len(data) <= MAX_PASSTHROUGH_BYTES
+            and width * height <= MAX_PASSTHROUGH_PIXELS
+            and max(width, height) <= (max_side or MAX_PASSTHROUGH_SIDE)
+        ):
+            DECODE_STATS.record(True, time.perf_counter() - start)
+            return EncodedImage(mime_type, data, width, height, passthrough=True)
+
+    with span("image_decode", bytes=len(data)), Image.open(io.BytesIO(data)) as image:
+        encoded = encode_image(image, max_side)
+    elapsed = time.perf_counter() - start
+    DECODE_STATS.record(False, elapsed)
+    logger.info(
+        f"Re-encoded {len(data)} byte upload to {encoded.width}x{encoded.height} JPEG ({len(encoded.data)} bytes) in {1000 * elapsed:.0f} ms"
+    )
+    return encoded
+
+
+async def prepare_image_bytes_async(
+    data: bytes, max_side: Optional[int] = None
+) -> EncodedImage:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        IMAGE_EXECUTOR, run_in_context(prepare_image_bytes, data, max_side)
+    )
+
+
+def prepare_image_file(path: str, max_side: Optional[int] = None) -> EncodedImage:
+    with open(path, "rb") as file:
+        return prepare_image_bytes(file.read(), max_side)
+
+
+async def prepare_image_file_async(
+    path: str, max_side: Optional[int] = None
+) -> EncodedImage:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        IMAGE_EXECUTOR, run_in_context(prepare_image_file, path, max_side)
+    )
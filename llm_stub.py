@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+"""
+Local OpenAI-compatible stand-in for the chat completions API.
+
+Answers /v1/chat/completions (plain and streamed, text and image inputs)
+with canned replies chosen from the prompt: a menu JSON array for
+extraction, a question, or recommendations. Latency, token rate and
+injected 429/500 errors are configurable, so the app can be load-tested
+end to end without an API key or network access.
+
+Point the app at it with OPENAI_BASE_URL:
+
+    python llm_stub.py --port 8001 --latency-ms 400 --tokens-per-second 80
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub uv run main.py --mode api
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logger = logging.getLogger("menu_analyzer")
+
+DEFAULT_MENU = [
+    {"name": "Margherita", "description": "Tomato, mozzarella, basil", "price": "9.50 €"},
+    {"name": "Diavola", "description": "Spicy salami, chili 🌶️", "price": "11.00 €"},
+    {"name": "Quattro Formaggi", "description": "Four cheeses, vegetarian", "price": "12.00 €"},
+    {"name": "Insalata Verde", "description": "Green salad, vegan", "price": "6.50 €"},
+    {"name": "Tiramisu", "description": "Mascarpone, coffee, cocoa", "price": "6.00 €"},
+]
+DEFAULT_QUESTION = "Do you prefer something spicy or something mild today?"
+DEFAULT_RECOMMENDATIONS = (
+    "1. **Diavola** - Spicy salami matches your taste for heat.\n"
+    "2. **Margherita** - A light classic if you want something simpler.\n"
+    "3. **Tiramisu** - A sweet finish that goes well with both."
+)
+# Rough OpenAI figures: ~4 characters per token, a low-detail image tile
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 85
+
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+@dataclass
+class StubConfig:
+    # Time to first token: fixed, or drawn from a uniform or lognormal distribution
+    latency_ms: float = 300.0
+    latency_jitter_ms: float = 100.0
+    latency_distribution: str = "lognormal"
+    # 0 streams every token at once
+    tokens_per_second: float = 60.0
+    # Share of requests answered with a 429 or a 500
+    rate_limit_rate: float = 0.0
+    error_rate: float = 0.0
+    retry_after_s: float = 1.0
+    menu: List[Dict[str, str]] = field(default_factory=lambda: list(DEFAULT_MENU))
+    question: str = DEFAULT_QUESTION
+    recommendations: str = DEFAULT_RECOMMENDATIONS
+    seed: Optional[int] = None
+
+
+class StubStats:
+    """Requests served by the stub, by stage and status."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.streamed = 0
+        self.images = 0
+        self.completion_tokens = 0
+
+    def record(self, stage: str, status: int, stream: bool, images: int, tokens: int):
+        with self._lock:
+            self.requests[stage] += 1
+            self.statuses[str(status)] += 1
+            self.streamed += stream
+            self.images += images
+            self.completion_tokens += tokens
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "statuses": dict(self.statuses),
+                "streamed": self.streamed,
+                "images": self.images,
+                "completion_tokens": self.completion_tokens,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.statuses.clear()
+            self.streamed = self.images = self.completion_tokens = 0
+
+
+def message_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(p.get("text", "") for p in content if p.get("type") == "text")
+    return "\n".join(parts)
+
+
+def count_images(messages: List[Dict[str, Any]]) -> int:
+    return sum(
+        1
+        for message in messages
+        if isinstance(message.get("content"), list)
+        for part in message["content"]
+        if part.get("type") == "image_url"
+    )
+
+
+def classify(messages: List[Dict[str, Any]]) -> str:
+    """Which app stage a prompt belongs to, judged from its instructions."""
+    text = message_text(messages)
+    if "menu parser" in text or count_images(messages):
+        return "extract"
+    if "Ask ONE" in text:
+        return "question"
+    return "recommend"
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class StubModel:
+    """Draws latencies and failures and builds OpenAI-shaped replies."""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.stats = StubStats()
+
+    def first_token_delay(self) -> float:
+        config = self.config
+        if config.latency_distribution == "uniform":
+            delay = self.random.uniform(
+                config.latency_ms - config.latency_jitter_ms,
+                config.latency_ms + config.latency_jitter_ms,
+            )
+        elif config.latency_distribution == "lognormal" and config.latency_ms > 0:
+            # Median latency_ms, with the jitter as the spread of the log
+            sigma = config.latency_jitter_ms / config.latency_ms
+            delay = config.latency_ms * self.random.lognormvariate(0, sigma)
+        else:
+            delay = config.latency_ms
+        return max(0.0, delay) / 1000
+
+    def injected_error(self) -> Optional[JSONResponse]:
+        draw = self.random.random()
+        if draw < self.config.rate_limit_rate:
+            return JSONResponse(
+                {
+                    "error": {
+                        "message": "Rate limit reached (injected by stub)",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                },
+                status_code=429,
+                headers={"retry-after": str(self.config.retry_after_s)},
+            )
+        if draw < self.config.rate_limit_rate + self.config.error_rate:
+            return JSONResponse(
+                {
+                    "error": {
+                        "message": "Internal error (injected by stub)",
+                        "type": "server_error",
+                        "code": None,
+                    }
+                },
+                status_code=500,
+            )
+        return None
+
+    def reply(self, stage: str) -> str:
+        if stage == "extract":
+            return json.dumps(self.config.menu, ensure_ascii=False, separators=(",", ":"))
+        if stage == "question":
+            return self.config.question
+        return self.config.recommendations
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+
+def create_app(config: Optional[StubConfig] = None) -> FastAPI:
+    stub = StubModel(config or StubConfig())
+    app = FastAPI(title="OpenAI stub")
+    app.state.stub = stub
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model"}]}
+
+    @app.get("/stats")
+    def stats():
+        return stub.stats.summary()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        stage = classify(messages)
+        images = count_images(messages)
+        stream = bool(body.get("stream"))
+        model = body.get("model") or "stub"
+
+        error = stub.injected_error()
+        if error is not None:
+            stub.stats.record(stage, error.status_code, stream, images, 0)
+            return error
+
+        text = stub.reply(stage)
+        prompt_tokens = estimate_tokens(message_text(messages)) + IMAGE_TOKENS * images
+        pieces = _TOKEN.findall(text)
+        completion_tokens = len(pieces)
+        stub.stats.record(stage, 200, stream, images, completion_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        tps = stub.config.tokens_per_second
+        token_delay = 1 / tps if tps > 0 else 0.0
+        await asyncio.sleep(stub.first_token_delay())
+
+        if not stream:
+            await asyncio.sleep(completion_tokens * token_delay)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": _usage(prompt_tokens, completion_tokens),
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        def chunk(delta, finish_reason=None, usage=None):
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": []
+                if usage
+                else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if usage:
+                data["usage"] = usage
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            for piece in pieces:
+                yield chunk({"content": piece})
+                await asyncio.sleep(token_delay)
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk(None, usage=_usage(prompt_tokens, completion_tokens))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def non_negative(value: str) -> float:
+    number = float(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {value}")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=100.0)
+    parser.add_argument(
+        "--latency-distribution",
+        choices=["fixed", "uniform", "lognormal"],
+        default="lognormal",
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=non_negative,
+        default=60.0,
+        help="Streaming speed; 0 for no per-token delay",
+    )
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--menu", help="JSON file with the dish list returned for extractions"
+    )
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        latency_distribution=args.latency_distribution,
+        tokens_per_second=args.tokens_per_second,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    if args.menu:
+        with open(args.menu, encoding="utf-8") as file:
+            config.menu = json.load(file)
+
+    import uvicorn
+
+    uvicorn.run(create_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
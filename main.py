@@ -1,10 +1,7 @@
 import argparse
 import os
 import logging
-import uvicorn
 from dotenv import load_dotenv
-from api import app as fastapi_app
-from gradio_ui import build_ui
 
 # Configure logging
 logging.basicConfig(
@@ -16,10 +13,6 @@ logger = logging.getLogger("menu_analyzer")
 
 load_dotenv()
 
-if "OPENAI_API_KEY" not in os.environ:
-    logger.error("OPENAI_API_KEY environment variable not set")
-    raise EnvironmentError("OPENAI_API_KEY must be set as an environment variable")
-
 # Constants
 DEFAULT_HOST = "0.0.0.0"
 DEFAULT_PORT = 8000
@@ -27,8 +20,18 @@ MAX_QUESTIONS = 5
 MAX_MENU_ITEMS = 100
 
 
+def check_openai_key():
+    if "OPENAI_API_KEY" not in os.environ:
+        logger.error("OPENAI_API_KEY environment variable not set")
+        raise EnvironmentError("OPENAI_API_KEY must be set as an environment variable")
+
+
+# Each mode imports its own stack (Gradio, FastAPI/uvicorn, LangChain) when it
+# starts, so --help and the other modes don't pay for it
 def run_gradio(host=DEFAULT_HOST, port=DEFAULT_PORT, share=False):
     """Start the Gradio web interface"""
+    from gradio_ui import build_ui
+
     logger.info(f"Starting Gradio web interface on {host}:{port}")
     app = build_ui()  # Use build_ui from renamed gradio_ui.py
     app.launch(server_name=host, server_port=int(port), share=share)
@@ -36,19 +39,32 @@ def run_gradio(host=DEFAULT_HOST, port=DEFAULT_PORT, share=False):
 
 def run_api(host=DEFAULT_HOST, port=DEFAULT_PORT):
     """Start the FastAPI server"""
+    import uvicorn
+    from api import app as fastapi_app
+
     logger.info(f"Starting FastAPI server on {host}:{port}")
     uvicorn.run(fastapi_app, host=host, port=int(port))
 
 
+def run_batch_mode(input_dir, output, workers=None, resume=True):
+    """Extract menus for every restaurant folder under input_dir"""
+    if not input_dir or not os.path.isdir(input_dir):
+        raise SystemExit("--input must be a directory with one folder per restaurant")
+    from batch import run_batch
+
+    logger.info(f"Starting batch extraction of {input_dir} into {output}")
+    run_batch(input_dir, output, workers=workers, resume=resume)
+
+
 def main():
     parser = argparse.ArgumentParser(
-        description="Menu Analyzer AI - Run in Gradio or API mode"
+        description="Menu Analyzer AI - Run in Gradio, API or batch mode"
     )
     parser.add_argument(
         "--mode",
-        choices=["gradio", "api"],
+        choices=["gradio", "api", "batch"],
         default="gradio",
-        help="Run mode: 'gradio' for web interface or 'api' for API server",
+        help="Run mode: 'gradio' for web interface, 'api' for API server or 'batch' to extract a directory of menus",
     )
     parser.add_argument(
         "--host", default=DEFAULT_HOST, help=f"Host address (default: {DEFAULT_HOST})"
@@ -61,13 +77,48 @@ def main():
         action="store_true",
         help="Create a public URL for sharing the Gradio interface",
     )
+    parser.add_argument(
+        "--input",
+        help="Batch mode: directory with one folder of menu images per restaurant",
+    )
+    parser.add_argument(
+        "--output",
+        default="menus.jsonl",
+        help="Batch mode: JSONL file to write results to (default: menus.jsonl)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Batch mode: restaurants extracted concurrently (default: BATCH_WORKERS or 4)",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Batch mode: overwrite the output instead of skipping restaurants already in it",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Trace allocations with tracemalloc and log the fastest-growing sites every MEMORY_SNAPSHOT_INTERVAL seconds",
+    )
     args = parser.parse_args()
+    check_openai_key()
+
+    if args.trace_memory:
+        # Started before the mode's imports so their allocations are attributed
+        from memtrace import MEMORY_TRACKER
+
+        MEMORY_TRACKER.start()
 
     # Start the application in the selected mode
     if args.mode == "gradio":
         run_gradio(host=args.host, port=args.port, share=args.share)
-    else:  # args.mode == "api"
+    elif args.mode == "api":
         run_api(host=args.host, port=args.port)
+    else:  # args.mode == "batch"
+        run_batch_mode(
+            args.input, args.output, workers=args.workers, resume=not args.no_resume
+        )
 
 
 if __name__ == "__main__":
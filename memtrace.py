@@ -0,0 +1,252 @@
+import logging
+import os
+import threading
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("menu_analyzer")
+
+# Start tracemalloc with the worker (also enabled by main.py --trace-memory)
+MEMORY_TRACE = os.getenv("MEMORY_TRACE", "").lower() in ("1", "true", "yes")
+# Seconds between periodic snapshots; 0 keeps only on-demand snapshots
+MEMORY_SNAPSHOT_INTERVAL = float(os.getenv("MEMORY_SNAPSHOT_INTERVAL", "300"))
+# Frames kept per allocation; more frames attribute better but cost memory
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "5"))
+MEMORY_TOP_N = int(os.getenv("MEMORY_TOP_N", "20"))
+
+# Allocations made by the tracing machinery itself
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _site(frame: tracemalloc.Frame) -> str:
+    return f"{frame.filename}:{frame.lineno}"
+
+
+# SNAPSHOTS
+class MemoryTracker:
+    """tracemalloc snapshots of this worker, diffed to find what keeps growing.
+
+    The first snapshot is kept as a baseline. Each later snapshot is
+    compared with the one before it (recent growth) or with the baseline
+    (growth since start).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.previous: Optional[tracemalloc.Snapshot] = None
+        self.latest: Optional[tracemalloc.Snapshot] = None
+        self.snapshots = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(
+        self,
+        interval: float = MEMORY_SNAPSHOT_INTERVAL,
+        frames: int = MEMORY_TRACE_FRAMES,
+    ) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info(f"Tracing memory allocations ({frames} frames)")
+        with self._lock:
+            if self.baseline is None:
+                self.baseline = self.latest = self._snapshot()
+                self.snapshots = 1
+        if interval > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(interval,), name="memtrace", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        tracemalloc.stop()
+        self.clear()
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.snapshot()
+            self.log_top()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+    def snapshot(self) -> None:
+        """Take a snapshot; it becomes `latest` and the last one `previous`."""
+        snapshot = self._snapshot()
+        with self._lock:
+            if self.baseline is None:
+                self.baseline = snapshot
+            self.previous, self.latest = self.latest, snapshot
+            self.snapshots += 1
+
+    def top(
+        self,
+        limit: int = MEMORY_TOP_N,
+        against: str = "previous",
+        key_type: str = "lineno",
+    ) -> List[Dict[str, Any]]:
+        """Allocation sites whose size grew the most between two snapshots."""
+        with self._lock:
+            latest = self.latest
+            older = self.baseline if against == "baseline" else self.previous
+        if latest is None:
+            return []
+        if older is None or older is latest:
+            stats = [
+                (stat.traceback, stat.size, stat.size, stat.count, stat.count)
+                for stat in latest.statistics(key_type)
+            ]
+        else:
+            stats = [
+                (stat.traceback, stat.size_diff, stat.size, stat.count_diff, stat.count)
+                for stat in latest.compare_to(older, key_type)
+            ]
+        stats.sort(key=lambda stat: stat[1], reverse=True)
+        return [
+            {
+                "site": _site(traceback[0]),
+                "size_diff_bytes": size_diff,
+                "size_bytes": size,
+                "count_diff": count_diff,
+                "count": count,
+                "traceback": [_site(frame) for frame in traceback]
+                if key_type == "traceback"
+                else None,
+            }
+            for traceback, size_diff, size, count_diff, count in stats[:limit]
+        ]
+
+    def log_top(self, limit: int = 10) -> None:
+        for entry in self.top(limit):
+            if entry["size_diff_bytes"] <= 0:
+                break
+            logger.info(
+                f"Memory growth {entry['size_diff_bytes'] / 1024:+.1f} KiB ({entry['count_diff']:+d} blocks) at {entry['site']}"
+            )
+
+    def summary(self) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": self.tracing,
+            "traced_bytes": current,
+            "peak_traced_bytes": peak,
+            "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "snapshots": self.snapshots,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self.baseline = self.previous = self.latest = None
+            self.snapshots = 0
+
+
+MEMORY_TRACKER = MemoryTracker()
+
+
+# PER-ROUTE PEAKS
+class RouteAllocationStats:
+    """Peak and retained traced memory per API route.
+
+    tracemalloc has one process-wide peak, so the peak is reset only when a
+    request starts with no other request in flight. Requests that overlap
+    another one are counted as `overlapped` and may include its allocations.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def begin(self) -> Optional[int]:
+        if not tracemalloc.is_tracing():
+            return None
+        with self._lock:
+            if self._in_flight == 0:
+                tracemalloc.reset_peak()
+            self._in_flight += 1
+        return tracemalloc.get_traced_memory()[0]
+
+    def end(self, route: str, start: Optional[int], overlapped: bool) -> None:
+        if start is None:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._in_flight -= 1
+            stats = self._routes.setdefault(
+                route,
+                {
+                    "requests": 0,
+                    "overlapped": 0,
+                    "max_peak_bytes": 0,
+                    "total_peak_bytes": 0,
+                    "retained_bytes": 0,
+                },
+            )
+            stats["requests"] += 1
+            stats["overlapped"] += overlapped
+            stats["max_peak_bytes"] = max(stats["max_peak_bytes"], peak - start)
+            stats["total_peak_bytes"] += peak - start
+            stats["retained_bytes"] += current - start
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                route: {
+                    "requests": stats["requests"],
+                    "overlapped": stats["overlapped"],
+                    "max_peak_bytes": stats["max_peak_bytes"],
+                    "avg_peak_bytes": stats["total_peak_bytes"] // stats["requests"],
+                    # Net bytes still allocated after the requests ended
+                    "retained_bytes": stats["retained_bytes"],
+                }
+                for route, stats in self._routes.items()
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+
+ROUTE_ALLOCATIONS = RouteAllocationStats()
+
+
+class RouteAllocationMiddleware:
+    """Records traced allocations per route while tracemalloc is on."""
+
+    def __init__(self, app, routes=()):
+        self.app = app
+        self.routes = set(routes)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"] not in self.routes
+            or not tracemalloc.is_tracing()
+        ):
+            return await self.app(scope, receive, send)
+
+        overlapped = ROUTE_ALLOCATIONS.in_flight > 0
+        start = ROUTE_ALLOCATIONS.begin()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            overlapped = overlapped or ROUTE_ALLOCATIONS.in_flight > 1
+            ROUTE_ALLOCATIONS.end(scope["path"], start, overlapped)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+from tokens import count_text_tokens
+
+logger = logging.getLogger("menu_analyzer")
+
+# Number of compiled menus kept in memory (most recently used first to survive)
+MENU_CACHE_SIZE = int(os.getenv("MENU_CACHE_SIZE", "128"))
+
+
+# HELPER FUNCTIONS
+def _normalize_text(value: Any) -> str:
+    return " ".join(str(value or "").split())
+
+
+def _trim_words(text: str, max_words: Optional[int]) -> str:
+    if max_words is None:
+        return text
+    words = text.split()
+    if len(words) <= max_words:
+        return text
+    return " ".join(words[:max_words]) + "…" if max_words else ""
+
+
+def canonicalize_menu(
+    dishes: List[Dict[str, str]], description_words: Optional[int] = None
+) -> str:
+    lines = []
+    for dish in dishes:
+        name = _normalize_text(dish["name"])
+        description = _trim_words(
+            _normalize_text(dish.get("description", "")), description_words
+        )
+        lines.append(f"- {name}: {description}" if description else f"- {name}")
+    return "\n".join(lines)
+
+
+def menu_digest(dishes: List[Dict[str, str]]) -> str:
+    canonical = json.dumps(
+        [
+            [dish["name"], dish.get("description", ""), dish.get("price", "")]
+            for dish in dishes
+        ],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+# COMPILED MENU
+@dataclass(frozen=True)
+class CompiledMenu:
+    """A menu serialized once into everything the prompt builders need."""
+
+    digest: str
+    dishes: Tuple[Dict[str, str], ...]
+    prompt_fragment: str
+    prompt_tokens: int
+    dish_index: Dict[str, int]
+    _trimmed: Dict[int, Tuple[str, int]] = field(
+        default_factory=dict, compare=False, repr=False
+    )
+
+    def __len__(self) -> int:
+        return len(self.dishes)
+
+    def as_list(self) -> List[Dict[str, str]]:
+        return list(self.dishes)
+
+    def trimmed_fragment(self, description_words: int) -> Tuple[str, int]:
+        """Return the prompt fragment with descriptions cut to N words, and its tokens."""
+        if description_words not in self._trimmed:
+            fragment = f"Menu:\n{canonicalize_menu(self.dishes, description_words)}"
+            self._trimmed[description_words] = (fragment, count_text_tokens(fragment))
+        return self._trimmed[description_words]
+
+    def find(self, name: str) -> Optional[Dict[str, str]]:
+        position = self.dish_index.get(_normalize_text(name).casefold())
+        return None if position is None else self.dishes[position]
+
+
+class MenuCache:
+    """Bounded LRU table of compiled menus keyed by menu digest."""
+
+    def __init__(self, max_size: int = MENU_CACHE_SIZE):
+        self.max_size = max_size
+        self._menus: "OrderedDict[str, CompiledMenu]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._menus)
+
+    def get(self, digest: str) -> Optional[CompiledMenu]:
+        with self._lock:
+            menu = self._menus.get(digest)
+            if menu is not None:
+                self._menus.move_to_end(digest)
+            return menu
+
+    def put(self, menu: CompiledMenu) -> CompiledMenu:
+        with self._lock:
+            self._menus[menu.digest] = menu
+            self._menus.move_to_end(menu.digest)
+            while len(self._menus) > self.max_size:
+                self._menus.popitem(last=False)
+        return menu
+
+    def clear(self) -> None:
+        with self._lock:
+            self._menus.clear()
+
+
+MENU_CACHE = MenuCache()
+
+
+def compile_menu(dishes: List[Dict[str, str]]) -> CompiledMenu:
+    digest = menu_digest(dishes)
+    cached = MENU_CACHE.get(digest)
+    if cached is not None:
+        return cached
+
+    normalized = tuple(
+        {
+            "name": dish["name"],
+            "description": dish.get("description", ""),
+            "price": dish.get("price", ""),
+        }
+        for dish in dishes
+    )
+    prompt_fragment = f"Menu:\n{canonicalize_menu(normalized)}"
+    menu = CompiledMenu(
+        digest=digest,
+        dishes=normalized,
+        prompt_fragment=prompt_fragment,
+        prompt_tokens=count_text_tokens(prompt_fragment),
+        dish_index={
+            _normalize_text(dish["name"]).casefold(): position
+            for position, dish in reversed(list(enumerate(normalized)))
+        },
+    )
+    logger.info(
+        f"Compiled menu {digest} with {len(menu)} dishes (~{menu.prompt_tokens} tokens)"
+    )
+    return MENU_CACHE.put(menu)
+
+
+def get_compiled_menu(digest: str) -> Optional[CompiledMenu]:
+    return MENU_CACHE.get(digest)
+
+
+def as_compiled_menu(menu: Union[CompiledMenu, List[Dict[str, str]]]) -> CompiledMenu:
+    if isinstance(menu, CompiledMenu):
+        return menu
+    return compile_menu(menu)
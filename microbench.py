@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks for the per-request hot paths.
+
+Times image conversion, prompt building, reply parsing and request
+validation on synthetic menus (10/100/1000 dishes) and images (small and
+12 MP). Results are compared with stored baselines in
+benchmarks/baseline.json. Baselines are scaled by a pure-Python
+calibration loop, so a faster or slower machine does not count as a
+regression.
+
+    python microbench.py                    # run and compare with the baseline
+    python microbench.py --update-baseline  # store this run as the baseline
+    BENCH_REGRESSION=1 uv run -m pytest tests/test_benchmarks.py
+
+A benchmark regresses when it is slower than its baseline by more than
+BENCH_THRESHOLD (0.25 = 25% by default) and by more than BENCH_MIN_DELTA
+seconds.
+"""
+
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+from pydantic import BaseModel
+
+BENCH_THRESHOLD = float(os.getenv("BENCH_THRESHOLD", "0.25"))
+# Smaller slowdowns are timer noise on sub-microsecond calls, not regressions
+BENCH_MIN_DELTA = float(os.getenv("BENCH_MIN_DELTA", "2e-6"))
+BASELINE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baseline.json"
+)
+MENU_SIZES = (10, 100, 1000)
+# Each timing repeats the call until it takes at least this long, and the
+# fastest of REPEAT such timings is kept
+MIN_TIME = 0.05
+REPEAT = 5
+
+# name -> setup; the setup builds the inputs and returns the call to time
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+# SYNTHETIC INPUTS
+def synthetic_dishes(count: int) -> List[Dict[str, str]]:
+    return [
+        {
+            "name": f"Dish {i} alla casa",
+            "description": f"Slow-cooked with tomato, garlic, herbs and chili, serves {i % 3 + 1}",
+            "price": f"{8 + i % 20}.50 €",
+        }
+        for i in range(count)
+    ]
+
+
+@lru_cache(maxsize=None)
+def synthetic_photo(width: int, height: int):
+    from PIL import Image
+
+    # Noise compresses like a real photo rather than a flat image
+    return Image.effect_noise((width, height), 40).convert("RGB")
+
+
+@lru_cache(maxsize=None)
+def synthetic_jpeg(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    synthetic_photo(width, height).save(buffer, format="JPEG", quality=88)
+    return buffer.getvalue()
+
+
+def conversation(turns: int = 3) -> List[str]:
+    qa = []
+    for turn in range(turns):
+        qa += [f"Question {turn}: do you like spicy food?", "Yes, quite spicy please"]
+    return qa
+
+
+def request_body(size: int) -> str:
+    return json.dumps(
+        {"dishes": synthetic_dishes(size), "qa": conversation(), "language": "English"}
+    )
+
+
+class ModelDish(BaseModel):
+    name: str
+    description: str
+    price: str = ""
+
+
+class ModelRecommendRequest(BaseModel):
+    """The request model before dishes were validated as plain dicts."""
+
+    dishes: List[ModelDish] = []
+    qa: List[str]
+    language: str
+    menu_id: Optional[str] = None
+    preferences: Optional[Dict[str, Any]] = None
+
+
+# BENCHMARKS
+IMAGES = {"small": (800, 600), "12mp": (4000, 3000)}
+
+for _label, (_width, _height) in IMAGES.items():
+
+    @benchmark(f"convert_to_base64[{_label}]")
+    def _base64(width=_width, height=_height):
+        from ai import convert_to_base64
+        from images import MAX_ENCODE_SIDE
+
+        image = synthetic_photo(width, height)
+        return lambda: convert_to_base64(image, MAX_ENCODE_SIDE)
+
+    @benchmark(f"convert_to_pil_image[{_label}]")
+    def _pil(width=_width, height=_height):
+        from ai import convert_to_pil_image
+
+        gallery_item = (synthetic_photo(width, height), "caption")
+        return lambda: convert_to_pil_image(gallery_item)
+
+    @benchmark(f"prepare_image_bytes[{_label}]")
+    def _prepare(width=_width, height=_height):
+        from images import prepare_image_bytes
+
+        data = synthetic_jpeg(width, height)
+        return lambda: prepare_image_bytes(data)
+
+    @benchmark(f"prepare_image_bytes_resized[{_label}]")
+    def _resize(width=_width, height=_height):
+        from images import prepare_image_bytes
+
+        # A prompt budget smaller than the photo forces the decode path
+        data = synthetic_jpeg(width, height)
+        return lambda: prepare_image_bytes(data, max_side=512)
+
+
+for _size in MENU_SIZES:
+
+    @benchmark(f"question_prompt[{_size}]")
+    def _question(size=_size):
+        from ai import question_prompt
+
+        dishes, qa = synthetic_dishes(size), conversation()
+        return lambda: question_prompt(dishes, qa, "English")
+
+    @benchmark(f"recommend_prompt[{_size}]")
+    def _recommend(size=_size):
+        from ai import recommend_prompt
+
+        dishes, qa = synthetic_dishes(size), conversation()
+        return lambda: recommend_prompt(dishes, qa, "English")
+
+    @benchmark(f"parse_fallback[{_size}]")
+    def _fallback(size=_size):
+        from ai import parse_menu_reply
+
+        text = "\n".join(f"- {dish['name']}" for dish in synthetic_dishes(size))
+        return lambda: parse_menu_reply(text)
+
+    @benchmark(f"parse_json[{_size}]")
+    def _json(size=_size):
+        from ai import parse_menu_reply
+
+        text = json.dumps(synthetic_dishes(size), ensure_ascii=False)
+        return lambda: parse_menu_reply(text)
+
+    @benchmark(f"recommend_request[{_size}]")
+    def _request(size=_size):
+        from api import RecommendRequest
+
+        body = request_body(size)
+        # What /next_question and /recommend do with a request body; the
+        # dishes come out as the dicts compile_menu takes
+        return lambda: RecommendRequest.model_validate_json(body).dishes
+
+    @benchmark(f"recommend_request_models[{_size}]")
+    def _request_models(size=_size):
+        body = request_body(size)
+
+        def validate_and_dump():
+            # Reference: one model per dish, dumped back to dicts
+            payload = ModelRecommendRequest.model_validate_json(body)
+            return [dish.model_dump() for dish in payload.dishes]
+
+        return validate_and_dump
+
+    @benchmark(f"extract_response[{_size}]")
+    def _response(size=_size):
+        from responses import FastJSONResponse
+
+        content = {"dishes": synthetic_dishes(size), "menu_id": "0" * 32}
+        return lambda: FastJSONResponse(content).body
+
+    @benchmark(f"extract_response_stdlib[{_size}]")
+    def _response_stdlib(size=_size):
+        from fastapi.encoders import jsonable_encoder
+        from fastapi.responses import JSONResponse
+
+        content = {"dishes": synthetic_dishes(size), "menu_id": "0" * 32}
+        # Reference: FastAPI's default path for a returned dict
+        return lambda: JSONResponse(jsonable_encoder(content)).body
+
+
+@benchmark("catalog_latest[1000]")
+def _catalog():
+    import tempfile
+    from catalog import MenuCatalog
+
+    # 1000 restaurants with a 100-dish menu each, two versions apiece
+    directory = tempfile.TemporaryDirectory()
+    menu_catalog = MenuCatalog(os.path.join(directory.name, "catalog.sqlite3"))
+    dishes = synthetic_dishes(100)
+    for version in range(2):
+        for restaurant in range(1000):
+            menu_catalog.store(f"r{restaurant}", dishes[version:], [f"{version}"])
+    restaurants = itertools.cycle([f"r{i}" for i in range(0, 1000, 7)])
+
+    def lookup(directory=directory):
+        return menu_catalog.latest(next(restaurants))
+
+    return lookup
+
+
+# RUNNER
+def measure(call: Callable[[], Any], repeat: int = REPEAT) -> float:
+    """Seconds per call: the fastest of `repeat` timings of a batch of calls."""
+    call()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME:
+            break
+        number *= 10 if elapsed < MIN_TIME / 10 else 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def calibrate() -> float:
+    """Seconds for a fixed pure-Python workload, to compare machines."""
+
+    def workload():
+        total = 0
+        for i in range(20000):
+            total += len(str(i)) * (i % 7)
+        return total
+
+    return measure(workload, repeat=REPEAT * 2)
+
+
+def run(names: Optional[List[str]] = None, repeat: int = REPEAT) -> Dict[str, Any]:
+    import logging
+
+    # The code under test logs on every call (the fallback parser warns)
+    logging.getLogger("menu_analyzer").setLevel(logging.ERROR)
+    # Calibrating before and after the run and keeping the faster reading
+    # makes the machine factor less sensitive to a burst of background load
+    calibration = calibrate()
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = measure(BENCHMARKS[name](), repeat)
+    calibration = min(calibration, calibrate())
+    return {
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "calibration_s": calibration,
+        "results": results,
+    }
+
+
+def compare(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float = BENCH_THRESHOLD,
+) -> Dict[str, Dict[str, Any]]:
+    """Per benchmark: baseline scaled to this machine, current, ratio, regressed."""
+    scale = current["calibration_s"] / baseline["calibration_s"]
+    comparison = {}
+    for name, seconds in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        expected = baseline["results"][name] * scale
+        ratio = seconds / expected
+        comparison[name] = {
+            "baseline_s": expected,
+            "current_s": seconds,
+            "ratio": ratio,
+            "regressed": ratio > 1 + threshold and seconds - expected > BENCH_MIN_DELTA,
+        }
+    return comparison
+
+
+def load_baseline(path: str = BASELINE_FILE) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _format(seconds: float) -> str:
+    if seconds >= 0.1:
+        return f"{seconds * 1000:.0f} ms"
+    if seconds >= 1e-4:
+        return f"{seconds * 1000:.2f} ms"
+    return f"{seconds * 1e6:.1f} µs"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="Only run names containing this")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    current = run(names, args.repeat)
+    if args.update_baseline:
+        baseline = load_baseline(args.baseline) or {"results": {}}
+        # Results of benchmarks not run this time are kept, rescaled
+        scale = current["calibration_s"] / baseline.get(
+            "calibration_s", current["calibration_s"]
+        )
+        results = {
+            name: seconds * scale for name, seconds in baseline["results"].items()
+        }
+        results.update(current["results"])
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({**current, "results": results}, file, indent=2)
+            file.write("\n")
+        print(f"Stored {len(current['results'])} results in {args.baseline}")
+
+    baseline = load_baseline(args.baseline)
+    comparison = compare(current, baseline, args.threshold) if baseline else {}
+    print(f"{'benchmark':<36}{'time':>12}{'baseline':>12}{'change':>9}")
+    for name, seconds in current["results"].items():
+        row = comparison.get(name)
+        if row is None:
+            print(f"{name:<36}{_format(seconds):>12}")
+            continue
+        flag = "  REGRESSED" if row["regressed"] else ""
+        print(
+            f"{name:<36}{_format(seconds):>12}{_format(row['baseline_s']):>12}"
+            f"{100 * (row['ratio'] - 1):>+8.1f}%{flag}"
+        )
+    if any(row["regressed"] for row in comparison.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import logging
+import re
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("menu_analyzer")
+
+# Bounds that keep the rendered state small no matter how long the dialogue is
+RECENT_TURNS = 2
+MAX_OTHER_FACTS = 4
+MAX_QUESTION_CHARS = 120
+MAX_ANSWER_CHARS = 200
+COMPACT_FACT_CHARS = 80
+
+# Preference slots, matched by whole keywords (stems end in \w*) in the
+# question and answer; a newer answer on the same slot replaces the older
+# one, except on the accumulating slots below
+PREFERENCE_SLOTS: Tuple[Tuple[str, str], ...] = (
+    ("allergies", "allerg\\w*|intoleran\\w*|peanuts?|nuts?|shellfish"),
+    ("diet", "vegetarians?|vegans?|pescatarians?|halal|kosher|gluten\\w*|dairy|lactose|meats?|keto|diet\\w*"),
+    ("spice", "spic\\w*|chil(?:l)?i(?:e?s)?|hot|mild|peppers?|heat|scharf|picante|piccante|épicé"),
+    ("budget", "price\\w*|budget\\w*|cheap\\w*|expensive|costs?|afford\\w*|[\\d.,]*[€$]|[€$][\\d.,]*"),
+    ("appetite", "hungry|light(?:er)?|heavy|portions?|share|sharing|starters?|desserts?|main course"),
+    ("flavor", "sweet|sour|salty|savou?ry|creamy|rich|fresh|flavou?rs?|tastes?|tasty"),
+    ("protein", "chicken|beef|lamb|pork|fish|seafood|tofu|eggs?|proteins?"),
+    ("cuisine", "cuisines?|italian|persian|french|spanish|german|arabic|asian|traditional|local"),
+    ("drinks", "drinks?|wines?|beers?|juices?|coffee|teas?"),
+)
+_SLOT_PATTERNS = tuple(
+    (slot, re.compile(rf"(?<!\w)(?:{keywords})(?!\w)", re.IGNORECASE))
+    for slot, keywords in PREFERENCE_SLOTS
+)
+# Every answer on these slots matters ("Peanuts", then "No" to "any other
+# allergies?"), so their facts accumulate instead of replacing each other
+ACCUMULATING_SLOTS = ("allergies", "diet")
+MAX_SLOT_FACTS = 4
+FACT_SEPARATOR = "; "
+
+
+def _compact(text: str, limit: int) -> str:
+    text = " ".join(str(text or "").split())
+    return text if len(text) <= limit else text[: limit - 1].rstrip() + "…"
+
+
+def _compact_slot(slot: str, fact: str, limit: int) -> str:
+    if slot not in ACCUMULATING_SLOTS:
+        return _compact(fact, limit)
+    facts = fact.split(FACT_SEPARATOR)[-MAX_SLOT_FACTS:]
+    return FACT_SEPARATOR.join(_compact(part, limit) for part in facts)
+
+
+def classify_preference(question: str, answer: str) -> str:
+    text = f"{question} {answer}"
+    for slot, pattern in _SLOT_PATTERNS:
+        if pattern.search(text):
+            return slot
+    return "other"
+
+
+@dataclass(frozen=True)
+class PreferenceState:
+    """Compact, incrementally updated summary of the guest's answers."""
+
+    turns: int = 0
+    slots: Dict[str, str] = field(default_factory=dict)
+    other: Tuple[str, ...] = ()
+    recent: Tuple[Tuple[str, str], ...] = ()
+
+    def update(self, question: str, answer: str) -> "PreferenceState":
+        question = _compact(question, MAX_QUESTION_CHARS)
+        answer = _compact(answer, MAX_ANSWER_CHARS)
+        slot = classify_preference(question, answer)
+        # Keep the question with the answer so short replies ("No") stay meaningful
+        fact = f"{question} → {answer}"
+        slots, other = dict(self.slots), self.other
+        if slot == "other":
+            other = (other + (fact,))[-MAX_OTHER_FACTS:]
+        elif slot in ACCUMULATING_SLOTS and slot in slots:
+            facts = [f for f in slots[slot].split(FACT_SEPARATOR) if f != fact]
+            slots[slot] = FACT_SEPARATOR.join((facts + [fact])[-MAX_SLOT_FACTS:])
+        else:
+            slots[slot] = fact
+        return replace(
+            self,
+            turns=self.turns + 1,
+            slots=slots,
+            other=other,
+            recent=(self.recent + ((question, answer),))[-RECENT_TURNS:],
+        )
+
+    @classmethod
+    def from_history(
+        cls,
+        question_answer_history: List[str],
+        state: Optional["PreferenceState"] = None,
+    ) -> "PreferenceState":
+        """Fold the Q&A pairs the state has not seen yet into it."""
+        state = state or cls()
+        pairs = list(zip(question_answer_history[0::2], question_answer_history[1::2]))
+        if state.turns > len(pairs):
+            logger.warning("Preference state is ahead of the history, rebuilding it")
+            state = cls()
+        for question, answer in pairs[state.turns :]:
+            state = state.update(question, answer)
+        return state
+
+    def compacted(self) -> "PreferenceState":
+        return replace(
+            self,
+            slots={
+                slot: _compact_slot(slot, fact, COMPACT_FACT_CHARS)
+                for slot, fact in self.slots.items()
+            },
+            other=tuple(_compact(fact, COMPACT_FACT_CHARS) for fact in self.other),
+            recent=self.recent[-1:],
+        )
+
+    def render(self, include_questions: bool = True) -> str:
+        lines = [f"- {slot}: {fact}" for slot, fact in self.slots.items()]
+        lines += [f"- {fact}" for fact in self.other]
+        parts = [
+            "Guest preferences so far:\n" + "\n".join(lines)
+            if lines
+            else "No preferences known yet."
+        ]
+        if self.recent:
+            first_turn = self.turns - len(self.recent) + 1
+            exchange = "\n".join(
+                f"Q{first_turn + i}: {question}\nA{first_turn + i}: {answer}"
+                if include_questions
+                else f"A{first_turn + i}: {answer}"
+                for i, (question, answer) in enumerate(self.recent)
+            )
+            parts.append(f"Latest exchange:\n{exchange}")
+        if include_questions and self.slots:
+            parts.append(f"Topics already covered: {', '.join(self.slots)}")
+        return "\n\n".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "turns": self.turns,
+            "slots": dict(self.slots),
+            "other": list(self.other),
+            "recent": [list(pair) for pair in self.recent],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["PreferenceState"]:
+        if not data:
+            return None
+        # Client-supplied state is re-bounded so it cannot grow the prompt
+        known_slots = {slot for slot, _ in PREFERENCE_SLOTS}
+        return cls(
+            turns=int(data.get("turns", 0)),
+            slots={
+                slot: _compact_slot(slot, fact, MAX_QUESTION_CHARS + MAX_ANSWER_CHARS)
+                for slot, fact in dict(data.get("slots", {})).items()
+                if slot in known_slots
+            },
+            other=tuple(
+                _compact(fact, MAX_QUESTION_CHARS + MAX_ANSWER_CHARS)
+                for fact in data.get("other", ())
+            )[-MAX_OTHER_FACTS:],
+            recent=tuple(
+                (
+                    _compact(question, MAX_QUESTION_CHARS),
+                    _compact(answer, MAX_ANSWER_CHARS),
+                )
+                for question, answer in data.get("recent", ())
+            )[-RECENT_TURNS:],
+        )
@@ -0,0 +1,246 @@
+import collections
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from fastapi import Header, HTTPException
+
+logger = logging.getLogger("menu_analyzer")
+
+# Debug profiling is off unless a token is set; requests must send it as a Bearer token
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+# Seconds between samples; every sample walks the stack of each thread
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+MIN_PROFILE_INTERVAL = 0.001
+# Upper bounds on one profile, so a forgotten profile cannot run for long
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "100"))
+PROFILE_MAX_DEPTH = 128
+
+# Innermost frames of threads that are waiting rather than working
+IDLE_FUNCTIONS = frozenset({"wait", "select", "poll", "sleep", "accept", "_worker"})
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+def _thread_label(name: str) -> str:
+    # Pool threads differ only by their number; merge them into one root
+    return re.sub(r"[-_ ]?\d+$", "", name) or "thread"
+
+
+# SAMPLING PROFILER
+class SamplingProfiler:
+    """Samples the stacks of all other threads from a background thread.
+
+    Stacks are counted in collapsed form (root;...;leaf), the input format
+    of flamegraph.pl, speedscope and similar tools. When `gate` is given,
+    ticks where it returns False are skipped.
+    """
+
+    def __init__(
+        self,
+        interval: float = PROFILE_INTERVAL,
+        seconds: float = PROFILE_MAX_SECONDS,
+        idle: bool = False,
+        gate: Optional[Callable[[], bool]] = None,
+    ):
+        self.interval = max(interval, MIN_PROFILE_INTERVAL)
+        self.seconds = min(seconds, PROFILE_MAX_SECONDS)
+        self.idle = idle
+        self.gate = gate
+        self.stacks: "collections.Counter[str]" = collections.Counter()
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self.started = 0.0
+        self.stopped = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profiler", daemon=True
+        )
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not self.idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            stack.append(_thread_label(names.get(ident, "thread")))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        deadline = self.started + self.seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            if self.gate is not None and not self.gate():
+                continue
+            start = time.perf_counter()
+            self._sample()
+            self.sampling_seconds += time.perf_counter() - start
+        self.stopped = time.monotonic()
+
+    def start(self) -> "SamplingProfiler":
+        self.started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self, wait: bool = True) -> None:
+        self._stop.set()
+        if wait:
+            self._thread.join()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = (self.stopped or time.monotonic()) - self.started
+        return {
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "elapsed_s": round(elapsed, 3),
+            # Share of wall time the sampler thread held the GIL
+            "overhead": round(self.sampling_seconds / elapsed, 4) if elapsed else 0.0,
+        }
+
+    def headers(self) -> Dict[str, str]:
+        summary = self.summary()
+        return {
+            "X-Profile-Samples": str(summary["samples"]),
+            "X-Profile-Overhead": str(summary["overhead"]),
+        }
+
+
+# PER-REQUEST PROFILES
+class RequestProfile:
+    """Profiles the next `count` requests to one route.
+
+    Samples are only taken while at least one of those requests is in
+    flight; the profile ends when they have all finished or after
+    PROFILE_MAX_SECONDS.
+    """
+
+    def __init__(self, route: str, count: int, interval: float = PROFILE_INTERVAL):
+        self.route = route
+        self.count = min(count, PROFILE_MAX_REQUESTS)
+        self.claimed = 0
+        self.finished = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self.profiler = SamplingProfiler(
+            interval, gate=lambda: self.in_flight > 0
+        ).start()
+
+    def claim(self, path: str) -> bool:
+        if path != self.route:
+            return False
+        with self._lock:
+            if self.claimed >= self.count or not self.profiler.running:
+                return False
+            self.claimed += 1
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.finished += 1
+            if self.finished >= self.count:
+                # Do not wait for the sampler's tick inside a request
+                self.profiler.stop(wait=False)
+
+    @property
+    def done(self) -> bool:
+        return not self.profiler.running
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "route": self.route,
+            "count": self.count,
+            "finished": self.finished,
+            "in_flight": self.in_flight,
+            "done": self.done,
+            **self.profiler.summary(),
+        }
+
+
+class ProfileSlot:
+    """Allows one profile, of either kind, to run at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiler: Optional[SamplingProfiler] = None
+        self.request_profile: Optional[RequestProfile] = None
+
+    def _busy(self) -> bool:
+        return (self.profiler is not None and self.profiler.running) or (
+            self.request_profile is not None and not self.request_profile.done
+        )
+
+    def start(self, seconds: float, interval: float, idle: bool) -> SamplingProfiler:
+        with self._lock:
+            if self._busy():
+                raise ProfilerBusyError("A profile is already running")
+            self.profiler = SamplingProfiler(interval, seconds, idle).start()
+            return self.profiler
+
+    def arm(self, route: str, count: int, interval: float) -> RequestProfile:
+        with self._lock:
+            if self._busy():
+                raise ProfilerBusyError("A profile is already running")
+            self.request_profile = RequestProfile(route, count, interval)
+            return self.request_profile
+
+
+PROFILES = ProfileSlot()
+
+
+class ProfilingMiddleware:
+    """Marks requests that belong to an armed RequestProfile."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        profile = PROFILES.request_profile
+        if (
+            scope["type"] != "http"
+            or profile is None
+            or not profile.claim(scope["path"])
+        ):
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.release()
+
+
+def require_profiling_token(authorization: Optional[str] = Header(None)) -> None:
+    """FastAPI dependency guarding the debug profiling endpoints."""
+    if not PROFILING_TOKEN:
+        # Disabled endpoints look like missing ones
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), PROFILING_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=401, detail="Invalid profiling token")
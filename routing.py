@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
+from cassette import CASSETTE
+from metrics import LLM_FIRST_TOKEN_SECONDS, LLM_SECONDS
+from tracing import span
+
+logger = logging.getLogger("menu_analyzer")
+
+STAGES = ("extract", "question", "recommend")
+
+
+# MODEL CONFIGURATION
+def _stage_models(stage: str) -> List[Optional[str]]:
+    # OPENAI_API_MODEL_<STAGE> is a comma-separated cascade, smallest model first
+    configured = os.getenv(f"OPENAI_API_MODEL_{stage.upper()}", "")
+    models = [model.strip() for model in configured.split(",") if model.strip()]
+    return models or [os.getenv("OPENAI_API_MODEL")]
+
+
+STAGE_MODELS: Dict[str, List[Optional[str]]] = {
+    stage: _stage_models(stage) for stage in STAGES
+}
+
+
+# VALIDATION
+# Languages written in Arabic script; everything else we offer is Latin script
+ARABIC_SCRIPT_LANGUAGES = {"فارسی", "العربية", "persian", "farsi", "fa", "arabic", "ar"}
+LATIN_SCRIPT_LANGUAGES = {
+    "english",
+    "en",
+    "deutsch",
+    "german",
+    "de",
+    "español",
+    "spanish",
+    "es",
+    "français",
+    "french",
+    "fr",
+    "italiano",
+    "italian",
+    "it",
+}
+
+
+def _is_arabic_letter(char: str) -> bool:
+    return "؀" <= char <= "ۿ" or "ݐ" <= char <= "ݿ"
+
+
+def matches_language(text: str, language: str) -> bool:
+    letters = [char for char in text if char.isalpha()]
+    language = language.strip().casefold()
+    if not letters:
+        return False
+    arabic_share = sum(map(_is_arabic_letter, letters)) / len(letters)
+    if language in ARABIC_SCRIPT_LANGUAGES:
+        return arabic_share >= 0.5
+    if language in LATIN_SCRIPT_LANGUAGES:
+        return arabic_share < 0.5
+    # Unknown language names are not checked
+    return True
+
+
+def is_valid_menu_json(text: str) -> bool:
+    try:
+        items = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return False
+    return (
+        isinstance(items, list)
+        and bool(items)
+        and all(isinstance(item, dict) and item.get("name") for item in items)
+    )
+
+
+def reply_validator(language: str) -> Callable[[str], bool]:
+    return lambda text: bool(text.strip()) and matches_language(text, language)
+
+
+# CASCADE
+class RoutingStats:
+    """Per-stage call, escalation and latency counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def record(
+        self, stage: str, model: Optional[str], seconds: float, valid: bool
+    ) -> None:
+        LLM_SECONDS.observe(seconds, stage=stage, model=model or "default")
+        with self._lock:
+            stats = self._stages.setdefault(
+                stage, {"calls": 0, "escalations": 0, "models": {}}
+            )
+            model_stats = stats["models"].setdefault(
+                model or "default", {"calls": 0, "invalid": 0, "seconds": 0.0}
+            )
+            model_stats["calls"] += 1
+            model_stats["invalid"] += 0 if valid else 1
+            model_stats["seconds"] += seconds
+
+    def record_request(self, stage: str, escalations: int) -> None:
+        with self._lock:
+            stats = self._stages.setdefault(
+                stage, {"calls": 0, "escalations": 0, "models": {}}
+            )
+            stats["calls"] += 1
+            stats["escalations"] += escalations
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            summary = {}
+            for stage, stats in self._stages.items():
+                calls = stats["calls"]
+                summary[stage] = {
+                    "calls": calls,
+                    "escalations": stats["escalations"],
+                    "escalation_rate": stats["escalations"] / calls if calls else 0.0,
+                    "models": {
+                        model: {
+                            **model_stats,
+                            "avg_latency_ms": 1000
+                            * model_stats["seconds"]
+                            / model_stats["calls"],
+                        }
+                        for model, model_stats in stats["models"].items()
+                    },
+                }
+            return summary
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stages.clear()
+
+
+ROUTING_STATS = RoutingStats()
+
+
+def invoke_with_cascade(
+    stage: str,
+    messages: Sequence[Any],
+    temperature: float,
+    chat_model: Callable[..., Any],
+    validate: Optional[Callable[[str], bool]] = None,
+) -> Any:
+    """Invoke the stage's models in order until one returns a valid reply.
+
+    The last model's reply is returned even if it fails validation, so the
+    callers keep their own fallbacks; errors from the last model propagate.
+    """
+    chat_model = CASSETTE.wrap(chat_model, stage)
+    models = STAGE_MODELS[stage]
+    escalations = 0
+    try:
+        for position, model in enumerate(models):
+            is_last = position == len(models) - 1
+            start = time.perf_counter()
+            with span("llm_call", stage=stage, model=model or "default") as call:
+                try:
+                    response = chat_model(
+                        model=model, temperature=temperature
+                    ).invoke(messages)
+                except Exception as e:
+                    ROUTING_STATS.record(
+                        stage, model, time.perf_counter() - start, False
+                    )
+                    if is_last:
+                        raise
+                    logger.warning(f"{stage} model {model} failed ({e}), escalating")
+                    call.set(failed=str(e)[:200])
+                    escalations += 1
+                    continue
+
+                valid = validate is None or validate(response.content)
+                ROUTING_STATS.record(stage, model, time.perf_counter() - start, valid)
+                call.set(valid=valid)
+            if valid or is_last:
+                return response
+            logger.info(f"{stage} reply from {model} failed validation, escalating")
+            escalations += 1
+    finally:
+        ROUTING_STATS.record_request(stage, escalations)
+
+
+async def astream_with_cascade(
+    stage: str,
+    messages: Sequence[Any],
+    temperature: float,
+    chat_model: Callable[..., Any],
+    validate: Optional[Callable[[str], bool]] = None,
+) -> AsyncIterator[Any]:
+    """Stream the stage's models in order until one returns a valid reply.
+
+    Yields the reply accumulated so far after every chunk. When a model's
+    reply fails validation or its stream errors, the next model starts again
+    from an empty reply, so consumers should render each yield as a whole.
+    Like invoke_with_cascade, the last model's reply is kept even if invalid.
+    """
+    chat_model = CASSETTE.wrap(chat_model, stage)
+    models = STAGE_MODELS[stage]
+    escalations = 0
+    try:
+        for position, model in enumerate(models):
+            is_last = position == len(models) - 1
+            start = time.perf_counter()
+            response = None
+            try:
+                llm = chat_model(
+                    model=model, temperature=temperature, stream_usage=True
+                )
+                async for chunk in llm.astream(messages):
+                    if response is None:
+                        LLM_FIRST_TOKEN_SECONDS.observe(
+                            time.perf_counter() - start, stage=stage
+                        )
+                    response = chunk if response is None else response + chunk
+                    yield response
+            except Exception as e:
+                ROUTING_STATS.record(stage, model, time.perf_counter() - start, False)
+                if is_last:
+                    raise
+                logger.warning(f"{stage} model {model} failed ({e}), escalating")
+                escalations += 1
+                continue
+
+            valid = response is not None and (
+                validate is None or validate(response.content)
+            )
+            ROUTING_STATS.record(stage, model, time.perf_counter() - start, valid)
+            if valid or is_last:
+                return
+            logger.info(f"{stage} reply from {model} failed validation, escalating")
+            escalations += 1
+    finally:
+        ROUTING_STATS.record_request(stage, escalations)
+
+
+def get_routing_stats() -> Dict[str, Dict[str, Any]]:
+    return ROUTING_STATS.summary()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Prompt Budget Benchmark
+
+Builds question and recommendation prompts for representative synthetic menus
+and conversation lengths, and reports the estimated token counts before and
+after budget enforcement together with the time spent enforcing the budget.
+
+Usage: python scripts/bench_prompt_budget.py [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from menu import compile_menu  # noqa: E402
+from tokens import STAGE_BUDGETS, fit_conversation_prompt  # noqa: E402
+
+MENU_SHAPES = [
+    ("small cafe", 10, 8),
+    ("bistro", 40, 20),
+    ("large menu", 100, 20),
+    ("verbose menu", 100, 60),
+]
+HISTORY_PAIRS = [0, 4, 20]
+
+
+def build_menu(dish_count, description_words):
+    description = " ".join(f"ingredient{i}" for i in range(description_words))
+    return [
+        {"name": f"Dish {i}", "description": description, "price": "12.50 €"}
+        for i in range(dish_count)
+    ]
+
+
+def build_history(pairs):
+    history = []
+    for i in range(pairs):
+        history.append(f"Question {i + 1}: do you prefer something spicy or mild?")
+        history.append("I like it quite spicy, but no peanuts please. " * 3)
+    return history
+
+
+def build_task(history):
+    return "\n".join(history)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"Budgets: {STAGE_BUDGETS}")
+    print(
+        f"{'menu':<14}{'pairs':>6}{'estimated':>11}{'final':>8}{'µs/call':>10}  actions"
+    )
+    for label, dish_count, description_words in MENU_SHAPES:
+        menu = compile_menu(build_menu(dish_count, description_words))
+        for pairs in HISTORY_PAIRS:
+            history = build_history(pairs)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                _, _, decision = fit_conversation_prompt(
+                    "question", menu, history, build_task
+                )
+            elapsed = (time.perf_counter() - start) / args.repeat * 1e6
+            print(
+                f"{label:<14}{pairs:>6}{decision.estimated_tokens:>11}"
+                f"{decision.final_tokens:>8}{elapsed:>10.1f}  "
+                f"{', '.join(decision.actions) or '-'}"
+            )
+
+
+if __name__ == "__main__":
+    main()
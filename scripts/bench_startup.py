@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Startup Import-Time Benchmark
+
+Imports what each main.py mode loads before it can serve, in a fresh
+interpreter run with `-X importtime`, and reports the total import time
+per mode and the slowest top-level packages. Each mode is run --repeat
+times and the median is reported, since the first run also warms the OS
+file cache.
+
+The wrapper/wrapper-old modes compare gradio_wrapper.py with its former
+sys.path scan and second execution of the Gradio package; exec_module time
+is not attributed to an import, so compare their process times.
+
+Usage: python scripts/bench_startup.py [--modes api,gradio,...] [--repeat N] [--top N]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# What gradio_wrapper.py used to do on import: scan sys.path for Gradio and
+# execute the package a second time next to the normal import
+LEGACY_GRADIO_WRAPPER = """
+import importlib.util, sys
+import ai, gradio
+spec = importlib.util.find_spec("gradio", None)
+for path in sys.path:
+    try:
+        spec = importlib.util.find_spec("gradio", [path])
+        if spec:
+            break
+    except (ImportError, AttributeError):
+        continue
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+"""
+
+# The imports each mode performs up to the point where it is ready
+MODES = {
+    "help": "import main",
+    "api": "import main, uvicorn, api",
+    "gradio": "import main, gradio_ui",
+    "batch": "import main, batch",
+    # What the first LLM call adds on top of api mode
+    "langchain": "import ai; ai.load_langchain()",
+    "wrapper": "import gradio, gradio_wrapper",
+    "wrapper-old": LEGACY_GRADIO_WRAPPER,
+}
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(stderr):
+    """Return {module: cumulative µs} for the top-level imports in the output."""
+    modules = {}
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            modules[match.group(4)] = int(match.group(2))
+    return modules
+
+
+def run_mode(code):
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "x")}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':<12}{'imports ms':>12}{'process ms':>12}  slowest top-level imports"
+    )
+    for mode in args.modes.split(","):
+        runs = [run_mode(MODES[mode]) for _ in range(args.repeat)]
+        wall = statistics.median(seconds for seconds, _ in runs)
+        _, modules = sorted(runs, key=lambda run: sum(run[1].values()))[len(runs) // 2]
+        slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)
+        print(
+            f"{mode:<12}{sum(modules.values()) / 1000:>12.0f}{wall * 1000:>12.0f}  "
+            + ", ".join(f"{name} {us / 1000:.0f}" for name, us in slowest[: args.top])
+        )
+
+
+if __name__ == "__main__":
+    main()
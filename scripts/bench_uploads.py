@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Upload Preprocessing Benchmark
+
+Compares the legacy upload path (decode with PIL, convert to RGB, re-encode
+as PNG, base64) with the byte-level pipeline in images.py, reporting CPU
+time and payload size per image. It also compares a full-resolution decode
+and resize against the draft-mode (DCT-scaled) decode used when an image
+has to be downscaled to --max-side.
+
+Point --images at a directory of real phone photos; without it, synthetic
+12 MP JPEG photos are generated.
+
+Usage: python scripts/bench_uploads.py [--images DIR] [--repeat N] [--max-side PX]
+"""
+
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+from images import prepare_image_bytes  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def synthetic_photo(width=4000, height=3000, seed=0):
+    """Draw a noisy, text-like 12 MP photo that compresses like a real one."""
+    image = Image.effect_noise((width, height), 40 + seed).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for row in range(60, height, 90):
+        draw.text((120, row), f"Dish {row // 90}  ........  {row % 37}.50 €", fill="black")
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=88)
+    return buffer.getvalue()
+
+
+def load_samples(directory):
+    if not directory:
+        return [(f"synthetic-{i}.jpg", synthetic_photo(seed=i)) for i in range(3)]
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), "rb") as file:
+                samples.append((name, file.read()))
+    return samples
+
+
+def legacy_path(data):
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def new_path(data):
+    return prepare_image_bytes(data).to_data_url()
+
+
+def full_decode_resize(data, max_side):
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def draft_decode_resize(data, max_side):
+    return prepare_image_bytes(data, max_side).data
+
+
+def measure(function, data, repeat, *args):
+    start = time.process_time()
+    for _ in range(repeat):
+        payload = function(data, *args)
+    return (time.process_time() - start) / repeat * 1000, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", help="Directory of phone photos")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-side", type=int, default=1024)
+    args = parser.parse_args()
+
+    print(
+        f"{'image':<24}{'upload KB':>10}{'legacy ms':>11}{'legacy KB':>11}"
+        f"{'new ms':>9}{'new KB':>9}{'full resize ms':>16}{'draft resize ms':>17}"
+    )
+    for name, data in load_samples(args.images):
+        legacy_ms, legacy_bytes = measure(legacy_path, data, args.repeat)
+        new_ms, new_bytes = measure(new_path, data, args.repeat)
+        full_ms, _ = measure(full_decode_resize, data, args.repeat, args.max_side)
+        draft_ms, _ = measure(draft_decode_resize, data, args.repeat, args.max_side)
+        print(
+            f"{name[:23]:<24}{len(data) / 1024:>10.0f}{legacy_ms:>11.1f}"
+            f"{legacy_bytes / 1024:>11.0f}{new_ms:>9.2f}{new_bytes / 1024:>9.0f}"
+            f"{full_ms:>16.1f}{draft_ms:>17.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
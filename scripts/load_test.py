@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""
+API Load Test
+
+Drives full conversations against a running API server: /extract_menu with
+menu photos, --questions rounds of /next_question with canned answers, and
+then /recommend. Each conversation sends one X-Session-ID, so it can be
+found in traces.
+
+Conversations start either as soon as a slot frees up (closed loop, up to
+--concurrency at once) or at --rate conversations per second with Poisson
+arrivals (open loop). In open loop, a conversation's latency includes any
+wait for a free slot.
+
+The report gives throughput, p50/p95/p99 and error rates per endpoint, and
+the server's event-loop lag during the run: the average from the /health
+totals before and after, and p95/max from polling /health every
+--lag-interval seconds. Each run is tagged with the git commit and its
+settings. Pass --compare with an earlier JSON report to print the change
+in throughput and latency.
+
+For an offline run, start llm_stub.py and point the server at it with
+OPENAI_BASE_URL.
+
+Usage: python scripts/load_test.py [--url URL] [--conversations N] [--concurrency N]
+       [--rate R] [--questions N] [--images DIR] [--lag-interval S]
+       [--output report.json] [--compare old.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+from PIL import Image, ImageDraw
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ENDPOINTS = ("/extract_menu", "/next_question", "/recommend")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+ANSWERS = (
+    "Something spicy, please.",
+    "No meat today.",
+    "I'm quite hungry.",
+    "I don't like mushrooms.",
+    "Something light and fresh.",
+)
+
+
+def synthetic_menu(width=1600, height=2000, dishes=30):
+    """A plain text menu photo as JPEG bytes."""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(dishes):
+        draw.text(
+            (80, 60 + row * 60),
+            f"Dish {row + 1} - house special  {row % 17}.50 €",
+            fill="black",
+        )
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def load_images(directory):
+    if not directory:
+        return [("menu.jpg", synthetic_menu())]
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), "rb") as file:
+                images.append((name, file.read()))
+    return images
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile; 0 for no values."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadRecorder:
+    """Per-endpoint latencies and statuses, plus whole-conversation outcomes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.conversations = []
+        self.failed = 0
+
+    def request(self, endpoint, seconds, status):
+        with self._lock:
+            self.statuses[endpoint][str(status)] += 1
+            if status == 200:
+                self.latencies[endpoint].append(seconds)
+
+    def conversation(self, seconds, ok):
+        with self._lock:
+            if ok:
+                self.conversations.append(seconds)
+            else:
+                self.failed += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            statuses = dict(self.statuses.get(endpoint, {}))
+            total = sum(statuses.values())
+            errors = total - statuses.get("200", 0)
+            latencies = self.latencies.get(endpoint, [])
+            endpoints[endpoint] = {
+                "requests": total,
+                "errors": errors,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "statuses": statuses,
+                "per_second": round(total / elapsed, 3) if elapsed else 0.0,
+                **{
+                    f"p{int(q * 100)}_ms": round(1000 * percentile(latencies, q), 1)
+                    for q in (0.5, 0.95, 0.99)
+                },
+                "max_ms": round(1000 * max(latencies), 1) if latencies else 0.0,
+            }
+        completed = len(self.conversations)
+        return {
+            "conversations": {
+                "completed": completed,
+                "failed": self.failed,
+                "per_second": round(completed / elapsed, 3) if elapsed else 0.0,
+                **{
+                    f"p{int(q * 100)}_s": round(percentile(self.conversations, q), 3)
+                    for q in (0.5, 0.95, 0.99)
+                },
+            },
+            "endpoints": endpoints,
+        }
+
+
+_local = threading.local()
+
+
+def http():
+    # One connection pool per worker thread
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def timed_post(recorder, url, endpoint, timeout, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = http().post(f"{url}{endpoint}", timeout=timeout, **kwargs)
+        status = response.status_code
+    except requests.RequestException:
+        response, status = None, "error"
+    recorder.request(endpoint, time.perf_counter() - start, status)
+    return response if status == 200 else None
+
+
+def run_conversation(recorder, args, images, scheduled, rng):
+    """One diner: extract, answer --questions questions, get recommendations."""
+    headers = {"X-Session-ID": uuid.uuid4().hex}
+    ok = False
+    try:
+        files = [("files", (name, data, "image/jpeg")) for name, data in images]
+        response = timed_post(
+            recorder,
+            args.url,
+            "/extract_menu",
+            args.timeout,
+            files=files,
+            headers=headers,
+        )
+        if response is None:
+            return
+        menu = response.json()
+        payload = {
+            "dishes": [] if menu.get("menu_id") else menu["dishes"],
+            "menu_id": menu.get("menu_id"),
+            "qa": [],
+            "language": args.language,
+        }
+        for _ in range(args.questions):
+            response = timed_post(
+                recorder,
+                args.url,
+                "/next_question",
+                args.timeout,
+                json=payload,
+                headers=headers,
+            )
+            if response is None:
+                return
+            reply = response.json()
+            payload["qa"] = [*payload["qa"], reply["question"], rng.choice(ANSWERS)]
+            payload["preferences"] = reply.get("preferences")
+        response = timed_post(
+            recorder,
+            args.url,
+            "/recommend",
+            args.timeout,
+            json=payload,
+            headers=headers,
+        )
+        ok = response is not None
+    finally:
+        recorder.conversation(time.perf_counter() - scheduled, ok)
+
+
+def health(url):
+    try:
+        return requests.get(f"{url}/health", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        return {}
+
+
+class LagPoller:
+    """Polls /health during the run for the server's latest event-loop lag."""
+
+    def __init__(self, url, interval):
+        self.url = url
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            lag = health(self.url).get("event_loop_lag")
+            if lag:
+                self.samples.append(lag["last_ms"])
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def lag_during_run(before, after, polled):
+    """Event-loop lag over the run window only, not since the server started."""
+    before, after = before or {}, after or {}
+    samples = after.get("samples", 0) - before.get("samples", 0)
+    total_ms = after.get("total_ms", 0.0) - before.get("total_ms", 0.0)
+    return {
+        "samples": samples,
+        "avg_ms": round(total_ms / samples, 2) if samples > 0 else None,
+        # Polled once per --lag-interval, so short spikes can be missed
+        "polled": len(polled),
+        "p95_ms": round(percentile(polled, 0.95), 2) if polled else None,
+        "max_ms": round(max(polled), 2) if polled else None,
+    }
+
+
+def run(args):
+    images = load_images(args.images)
+    recorder = LoadRecorder()
+    rng = random.Random(args.seed)
+    before = health(args.url)
+    start = time.perf_counter()
+    with (
+        LagPoller(args.url, args.lag_interval) as poller,
+        ThreadPoolExecutor(max_workers=args.concurrency) as pool,
+    ):
+        futures = []
+        next_start = time.perf_counter()
+        for _ in range(args.conversations):
+            if args.rate > 0:
+                next_start += rng.expovariate(args.rate)
+                time.sleep(max(0.0, next_start - time.perf_counter()))
+                scheduled = next_start
+            else:
+                scheduled = None
+            futures.append(
+                pool.submit(
+                    lambda s: run_conversation(
+                        recorder, args, images, s or time.perf_counter(), rng
+                    ),
+                    scheduled,
+                )
+            )
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    after = health(args.url)
+
+    return {
+        "run": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "url": args.url,
+            "conversations": args.conversations,
+            "concurrency": args.concurrency,
+            "rate": args.rate or None,
+            "questions": args.questions,
+            "images": len(images),
+            "elapsed_s": round(elapsed, 2),
+        },
+        **recorder.summary(elapsed),
+        "event_loop_lag_ms": lag_during_run(
+            before.get("event_loop_lag"), after.get("event_loop_lag"), poller.samples
+        ),
+        "routing": after.get("routing"),
+    }
+
+
+def print_summary(report, baseline=None):
+    run_info, conversations = report["run"], report["conversations"]
+    print(
+        f"commit {run_info['commit']}: {conversations['completed']} conversations in {run_info['elapsed_s']}s "
+        f"({conversations['per_second']}/s, {conversations['failed']} failed), "
+        f"p50 {conversations['p50_s']}s p95 {conversations['p95_s']}s p99 {conversations['p99_s']}s"
+    )
+    print(
+        f"{'endpoint':<16}{'req':>6}{'err %':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+    for endpoint, stats in report["endpoints"].items():
+        line = (
+            f"{endpoint:<16}{stats['requests']:>6}{100 * stats['error_rate']:>7.1f}{stats['per_second']:>8.2f}"
+            f"{stats['p50_ms']:>9.0f}{stats['p95_ms']:>9.0f}{stats['p99_ms']:>9.0f}"
+        )
+        if baseline and endpoint in baseline["endpoints"]:
+            old = baseline["endpoints"][endpoint]
+            if old["p95_ms"]:
+                line += f"   p95 {100 * (stats['p95_ms'] / old['p95_ms'] - 1):+.1f}%"
+        print(line)
+    lag = report["event_loop_lag_ms"]
+    if lag["avg_ms"] is not None:
+        line = f"event loop lag during run: avg {lag['avg_ms']:.1f} ms"
+        if lag["max_ms"] is not None:
+            line += f", p95 {lag['p95_ms']:.1f} ms, max {lag['max_ms']:.1f} ms (polled)"
+        if baseline and (baseline.get("event_loop_lag_ms") or {}).get("avg_ms"):
+            old = baseline["event_loop_lag_ms"]["avg_ms"]
+            line += f"   avg {100 * (lag['avg_ms'] / old - 1):+.1f}%"
+        print(line)
+    if baseline:
+        old = baseline["conversations"]["per_second"]
+        if old:
+            print(
+                f"throughput vs {baseline['run']['commit']}: "
+                f"{100 * (conversations['per_second'] / old - 1):+.1f}%"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.0,
+        help="Conversations/s (Poisson); 0 for closed loop",
+    )
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--language", default="English")
+    parser.add_argument(
+        "--images", help="Directory of menu photos sent with every extraction"
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--lag-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between /health polls for event-loop lag",
+    )
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    print_summary(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+LLM Cassette Replay
+
+Replays a cassette recorded with LLM_CASSETTE_MODE=record through the ai.py
+wrappers, answering every LLM call from the cassette. Question and
+recommendation calls are rebuilt from their recorded inputs with the
+current prompt builders, and their prompt-token estimates are compared
+with the recorded prompts. Extraction replies are parsed again with the
+current parser. Calls are matched per stage in recorded order, so
+changed prompts still replay.
+
+Use --latency-scale 1 to keep the recorded LLM latencies, or 0 to measure
+only the app's own work.
+
+Usage: python scripts/replay_cassette.py [--cassette PATH] [--latency-scale X] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import ai  # noqa: E402
+from cassette import CASSETTE, LLM_CASSETTE, is_complete  # noqa: E402
+from preferences import PreferenceState  # noqa: E402
+from tokens import count_message_tokens  # noqa: E402
+
+CONVERSATION_STAGES = {
+    "question": (ai.question_prompt, ai.generate_next_question),
+    "recommend": (ai.recommend_prompt, ai.recommend_dishes),
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def replay(records):
+    """Replay each record and collect per-stage latency, token and parse figures."""
+    stages = {}
+    for record in records:
+        stage = record["stage"]
+        stats = stages.setdefault(
+            stage,
+            {
+                "calls": 0,
+                "seconds": [],
+                "recorded_seconds": [],
+                "recorded_prompt_tokens": 0,
+                "current_prompt_tokens": 0,
+                "recorded_usage_tokens": 0,
+                "dishes_recorded": 0,
+                "dishes_parsed": 0,
+            },
+        )
+        inputs = record.get("inputs") or {}
+        usage = record.get("usage") or {}
+        start = time.perf_counter()
+        if stage in CONVERSATION_STAGES and "dishes" in inputs:
+            build_prompt, call = CONVERSATION_STAGES[stage]
+            preferences = PreferenceState.from_dict(inputs["preferences"])
+            args = (inputs["dishes"], inputs["qa"], inputs["language"])
+            stats["recorded_prompt_tokens"] += count_message_tokens(
+                [message["content"] for message in record["prompt"]]
+            )
+            stats["current_prompt_tokens"] += count_message_tokens(
+                build_prompt(*args, PreferenceState.from_dict(inputs["preferences"]))
+            )
+            call(*args, preferences)
+        elif stage == "extract":
+            CASSETTE.find(stage, record["key"])
+            time.sleep(record["latency_s"] * CASSETTE.latency_scale)
+            parsed = ai.parse_menu_reply(record["response"])
+            stats["dishes_parsed"] += len(parsed)
+            try:
+                stats["dishes_recorded"] += len(json.loads(record["response"]))
+            except json.JSONDecodeError:
+                pass
+        else:
+            # Streamed calls have no recorded inputs; only their latency replays
+            CASSETTE.find(stage, record["key"])
+            time.sleep(record["latency_s"] * CASSETTE.latency_scale)
+        stats["seconds"].append(time.perf_counter() - start)
+        stats["recorded_seconds"].append(record["latency_s"])
+        stats["recorded_usage_tokens"] += usage.get("input_tokens", 0)
+        stats["calls"] += 1
+    return stages
+
+
+def summarize(stages):
+    summary = {}
+    for stage, stats in stages.items():
+        recorded, current = (
+            stats["recorded_prompt_tokens"],
+            stats["current_prompt_tokens"],
+        )
+        summary[stage] = {
+            "calls": stats["calls"],
+            "replay_p50_ms": round(1000 * statistics.median(stats["seconds"]), 2),
+            "replay_p95_ms": round(1000 * percentile(stats["seconds"], 0.95), 2),
+            "recorded_p50_ms": round(
+                1000 * statistics.median(stats["recorded_seconds"]), 2
+            ),
+            "recorded_usage_tokens": stats["recorded_usage_tokens"],
+            "recorded_prompt_tokens_est": recorded,
+            "current_prompt_tokens_est": current,
+            "prompt_tokens_change": round((current - recorded) / recorded, 4)
+            if recorded
+            else None,
+        }
+        if stage == "extract":
+            summary[stage]["dishes_recorded"] = stats["dishes_recorded"]
+            summary[stage]["dishes_parsed"] = stats["dishes_parsed"]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cassette", default=LLM_CASSETTE)
+    parser.add_argument("--latency-scale", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    with open(args.cassette, encoding="utf-8") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    # Truncated streams are not replayable, as in the cassette itself
+    records = [record for record in records if is_complete(record)]
+    CASSETTE.path = args.cassette
+    CASSETTE.mode = "replay"
+    CASSETTE.match = "stage"
+    CASSETTE.latency_scale = args.latency_scale
+    # Keep the one-off LangChain import out of the first call's timing
+    ai.load_langchain()
+
+    summary = summarize(replay(records))
+    report = {"cassette": args.cassette, "stages": summary, **CASSETTE.summary()}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(
+        f"{len(records)} calls from {args.cassette}, "
+        f"{report['prompt_changed']} with changed prompts, {report['misses']} misses"
+    )
+    print(
+        f"{'stage':<10}{'calls':>6}{'replay p50':>12}{'p95':>9}{'recorded p50':>14}{'prompt tokens':>22}"
+    )
+    for stage, stats in summary.items():
+        change = stats["prompt_tokens_change"]
+        tokens = (
+            f"{stats['recorded_prompt_tokens_est']}->{stats['current_prompt_tokens_est']}"
+            if change is not None
+            else "-"
+        )
+        print(
+            f"{stage:<10}{stats['calls']:>6}{stats['replay_p50_ms']:>12.1f}{stats['replay_p95_ms']:>9.1f}{stats['recorded_p50_ms']:>14.1f}{tokens:>22}"
+        )
+
+
+if __name__ == "__main__":
+    main()
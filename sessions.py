@@ -0,0 +1,141 @@
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from menu import CompiledMenu
+from preferences import PreferenceState
+
+logger = logging.getLogger("menu_analyzer")
+
+# Conversations idle for longer than this are dropped
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+# At most this many conversations are kept; the least recently used go first
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+
+
+@dataclass
+class Session:
+    """One browser session's conversation.
+
+    The menu is the shared CompiledMenu instance, so sessions on the same
+    menu hold one copy of it between them.
+    """
+
+    stage: str = "await"
+    lang: str = "English"
+    menu: Optional[CompiledMenu] = None
+    qa: List[str] = field(default_factory=list)
+    preferences: Optional[PreferenceState] = None
+    last_seen: float = field(default_factory=time.monotonic)
+
+    def size_bytes(self) -> int:
+        """Approximate bytes held by this session alone, shared menu excluded."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.qa)
+        size += sum(sys.getsizeof(text) for text in self.qa)
+        if self.preferences is not None:
+            size += sum(
+                sys.getsizeof(value)
+                for value in (
+                    *self.preferences.slots.values(),
+                    *self.preferences.other,
+                    *(text for pair in self.preferences.recent for text in pair),
+                )
+            )
+        return size
+
+
+def menu_size_bytes(menu: CompiledMenu) -> int:
+    """Approximate bytes held by a compiled menu."""
+    size = sys.getsizeof(menu.prompt_fragment)
+    for dish in menu.dishes:
+        size += sys.getsizeof(dish) + sum(sys.getsizeof(v) for v in dish.values())
+    return size
+
+
+class SessionStore:
+    """Thread-safe session map with TTL and LRU eviction."""
+
+    def __init__(
+        self,
+        max_sessions: int = MAX_SESSIONS,
+        ttl_seconds: float = SESSION_TTL_SECONDS,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self, now: float) -> None:
+        # Sessions are kept in last-seen order, so expired ones are at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def session(self, session_id: Optional[str] = None) -> Tuple[str, Session]:
+        """Return the live session for an id, or a new one if it is gone."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session_id = uuid.uuid4().hex
+                session = self._sessions[session_id] = Session()
+            session.last_seen = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return session_id, session
+
+    def discard(self, session_id: Optional[str]) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._evict(time.monotonic())
+            sessions = list(self._sessions.values())
+            expired, evicted = self.expired, self.evicted
+        session_bytes = sum(session.size_bytes() for session in sessions)
+        menus = {s.menu.digest: s.menu for s in sessions if s.menu is not None}
+        menu_bytes = sum(menu_size_bytes(menu) for menu in menus.values())
+        return {
+            "sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "menus": len(menus),
+            "session_bytes": session_bytes,
+            "menu_bytes": menu_bytes,
+            "bytes_per_session": (session_bytes + menu_bytes) // len(sessions)
+            if sessions
+            else 0,
+            "expired": expired,
+            "evicted": evicted,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+            self.expired = self.evicted = 0
+
+
+SESSION_STORE = SessionStore()
+
+
+def get_session_stats() -> Dict[str, Any]:
+    """Live and expired session counts, and the approximate memory they hold."""
+    return SESSION_STORE.stats()
@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+import pytest
+from langchain_core.messages import AIMessage
+from PIL import Image
+import batch
+
+
+@pytest.fixture
+def menu_tree(tmp_path):
+    """Three restaurant folders, one with a nested page and one without images."""
+    root = tmp_path / "city"
+    for name, pages in (("bistro", 2), ("cafe", 1), ("diner", 1)):
+        folder = root / name
+        folder.mkdir(parents=True)
+        for page in range(pages):
+            Image.new("RGB", (32, 32), "white").save(folder / f"page{page}.jpg")
+    (root / "diner" / "back").mkdir()
+    Image.new("RGB", (32, 32)).save(root / "diner" / "back" / "drinks.png")
+    (root / "empty").mkdir()
+    (root / "empty" / "notes.txt").write_text("closed")
+    return root
+
+
+def fake_extract(pages):
+    return [{"name": f"Dish {i}", "description": ""} for i in range(pages)]
+
+
+@contextmanager
+def chat_model(reply=fake_extract):
+    """Patch the chat model; `reply` gets the page count and returns the dishes."""
+
+    def invoke(messages):
+        pages = sum(part.get("type") == "image_url" for part in messages[-1].content)
+        return AIMessage(content=json.dumps(reply(pages)))
+
+    with patch("ai.ChatOpenAI") as mock_chat:
+        mock_chat.return_value.invoke.side_effect = invoke
+        yield mock_chat.return_value.invoke
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_find_restaurants(menu_tree):
+    """Test that each folder with images is one restaurant, nested pages included."""
+    restaurants = batch.find_restaurants(str(menu_tree))
+    assert list(restaurants) == ["bistro", "cafe", "diner"]
+    assert len(restaurants["bistro"]) == 2
+    assert restaurants["diner"][0].endswith("drinks.png")
+
+
+def test_run_batch_writes_jsonl_with_timing(menu_tree, tmp_path):
+    """Test that every restaurant gets a record with its dishes and timings."""
+    output = tmp_path / "menus.jsonl"
+    with chat_model():
+        stats = batch.run_batch(str(menu_tree), str(output), workers=2)
+
+    records = {record["restaurant"]: record for record in read_records(output)}
+    assert set(records) == {"bistro", "cafe", "diner"}
+    assert len(records["bistro"]["dishes"]) == 2
+    assert records["bistro"]["menu_id"]
+    assert all(
+        record["total_ms"] >= record["extract_ms"] for record in records.values()
+    )
+    assert stats["completed"] == 3 and stats["failed"] == 0 and stats["dishes"] == 5
+
+
+def test_run_batch_resumes_and_retries_failures(menu_tree, tmp_path):
+    """Test that a rerun skips finished restaurants and retries failed ones."""
+    output = tmp_path / "menus.jsonl"
+
+    def flaky_extract(pages):
+        if pages == 1:
+            raise RuntimeError("rate limited")
+        return fake_extract(pages)
+
+    with chat_model(flaky_extract):
+        first = batch.run_batch(str(menu_tree), str(output))
+    assert first["failed"] == 1
+    assert {record["status"] for record in read_records(output)} == {"ok", "error"}
+    # A run killed mid-write leaves a truncated line behind
+    with open(output, "a") as file:
+        file.write('{"restaurant": "ca')
+
+    with chat_model() as mock_invoke:
+        second = batch.run_batch(str(menu_tree), str(output))
+
+    assert mock_invoke.call_count == 1
+    assert second["skipped"] == 2 and second["completed"] == 1
+    assert batch.completed_restaurants(str(output)) == {"bistro", "cafe", "diner"}
+
+
+def test_run_batch_caps_concurrency(menu_tree, tmp_path):
+    """Test that no more than the requested number of extractions run at once."""
+    running = peak = 0
+    lock = threading.Lock()
+
+    def slow_extract(pages):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return fake_extract(pages)
+
+    with chat_model(slow_extract):
+        batch.run_batch(str(menu_tree), str(tmp_path / "out.jsonl"), workers=2)
+    assert peak == 2
+
+
+def test_empty_extraction_is_retried(menu_tree, tmp_path):
+    """Test that a restaurant with no dishes extracted is not recorded as done."""
+    output = tmp_path / "menus.jsonl"
+    with chat_model(lambda pages: []):
+        stats = batch.run_batch(str(menu_tree), str(output))
+
+    assert stats["failed"] == 3
+    assert batch.completed_restaurants(str(output)) == set()
+
+
+def test_pages_over_limit_are_dropped_with_warning(menu_tree, tmp_path, caplog):
+    """Test that pages beyond MAX_MENU_PAGES are not sent, and the drop is logged."""
+    with patch("ai.MAX_MENU_PAGES", 1), chat_model() as mock_invoke:
+        batch.run_batch(str(menu_tree), str(tmp_path / "out.jsonl"), workers=1)
+
+    assert all(
+        sum(part.get("type") == "image_url" for part in call.args[0][-1].content) == 1
+        for call in mock_invoke.call_args_list
+    )
+    assert "first 1 of 2 menu pages" in caplog.text
@@ -0,0 +1,39 @@
+import os
+import pytest
+import microbench
+
+# The 12 MP image benchmarks take seconds each; the smoke test skips them
+QUICK = [name for name in microbench.BENCHMARKS if "12mp" not in name]
+
+
+@pytest.mark.parametrize("name", QUICK)
+def test_benchmark_runs(name):
+    """Test that each benchmark's setup and call still work."""
+    microbench.BENCHMARKS[name]()()
+
+
+def test_compare_scales_baseline_by_calibration():
+    """Test that a uniformly slower machine is not reported as a regression."""
+    baseline = {"calibration_s": 1.0, "results": {"a": 1.0, "b": 1.0}}
+    current = {"calibration_s": 2.0, "results": {"a": 2.2, "b": 3.0, "new": 1.0}}
+    comparison = microbench.compare(current, baseline, threshold=0.25)
+    assert not comparison["a"]["regressed"]
+    assert comparison["b"]["regressed"]
+    assert "new" not in comparison
+
+
+@pytest.mark.skipif(
+    not os.getenv("BENCH_REGRESSION"),
+    reason="Set BENCH_REGRESSION=1 to compare benchmarks with the stored baseline",
+)
+def test_no_benchmark_regressions():
+    """Test that no benchmark is slower than its baseline beyond BENCH_THRESHOLD."""
+    baseline = microbench.load_baseline()
+    assert baseline, f"No baseline at {microbench.BASELINE_FILE}"
+    comparison = microbench.compare(microbench.run(), baseline)
+    regressed = {
+        name: f"{100 * (row['ratio'] - 1):+.0f}%"
+        for name, row in comparison.items()
+        if row["regressed"]
+    }
+    assert not regressed, f"Slower than baseline: {regressed}"
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import threading
+from unittest.mock import patch
+import pytest
+from langchain.schema import AIMessage
+from langchain_core.messages import AIMessageChunk
+from PIL import Image
+import ai
+import cassette
+import routing
+
+DISHES = [
+    {"name": "Pizza", "description": "Cheese"},
+    {"name": "Soup", "description": ""},
+]
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_record_then_replay_through_ai(mock_openai, tmp_path):
+    """Test that recorded calls replay through ai.py without the model."""
+    path = str(tmp_path / "calls.jsonl")
+    mock_openai.return_value.invoke.side_effect = [
+        AIMessage(
+            content='[{"name": "Pizza", "description": "Cheese"}]',
+            usage_metadata={
+                "input_tokens": 900,
+                "output_tokens": 9,
+                "total_tokens": 909,
+            },
+        ),
+        AIMessage(content="Anything spicy?"),
+    ]
+    recorder = cassette.Cassette(path, mode="record")
+    with patch.object(routing, "CASSETTE", recorder):
+        dishes = ai.extract_menu_items([Image.new("RGB", (32, 32))])
+        question = ai.generate_next_question(DISHES, [], "English")
+
+    recorder.flush()
+    extract, asked = read_records(path)
+    (image,) = [
+        part for part in extract["prompt"][1]["content"] if part["type"] == "image"
+    ]
+    assert len(image["sha256"]) == 64 and image["mime_type"] == "image/png"
+    assert extract["usage"]["input_tokens"] == 900
+    assert extract["inputs"] == {"images": 1}
+    assert asked["inputs"]["dishes"] == DISHES and asked["inputs"]["qa"] == []
+    assert asked["latency_s"] >= 0
+
+    mock_openai.reset_mock()
+    replay = cassette.Cassette(path, mode="replay", latency_scale=0)
+    with patch.object(routing, "CASSETTE", replay):
+        assert ai.extract_menu_items([Image.new("RGB", (32, 32))]) == dishes
+        assert ai.generate_next_question(DISHES, [], "English") == question
+    mock_openai.assert_not_called()
+    assert replay.summary()["replayed"] == 2
+
+
+def test_replay_matching(mock_openai, tmp_path):
+    """Test that changed prompts miss by prompt but replay by stage."""
+    path = str(tmp_path / "calls.jsonl")
+    mock_openai.return_value.invoke.return_value = AIMessage(content="Anything spicy?")
+    recorder = cassette.Cassette(path, mode="record")
+    with patch.object(routing, "CASSETTE", recorder):
+        ai.generate_next_question(DISHES, [], "English")
+    recorder.flush()
+
+    with patch.object(routing, "CASSETTE", cassette.Cassette(path, mode="replay")):
+        with pytest.raises(cassette.CassetteMissError):
+            ai.generate_next_question(DISHES[:1], [], "English")
+
+    by_stage = cassette.Cassette(path, mode="replay", match="stage", latency_scale=0)
+    with patch.object(routing, "CASSETTE", by_stage):
+        assert ai.generate_next_question(DISHES[:1], [], "English") == "Anything spicy?"
+    assert by_stage.summary()["prompt_changed"] == 1
+
+
+def test_streamed_calls_record_and_replay(tmp_path):
+    """Test that streamed calls keep their first-token time and usage."""
+    path = str(tmp_path / "calls.jsonl")
+    usage = {"input_tokens": 50, "output_tokens": 2, "total_tokens": 52}
+
+    class StreamingModel:
+        def __init__(self, **kwargs):
+            pass
+
+        async def astream(self, messages):
+            yield AIMessageChunk(content="Anything ")
+            yield AIMessageChunk(content="spicy?", usage_metadata=usage)
+
+    async def question():
+        replies = [
+            reply async for reply in ai.astream_next_question(DISHES, [], "English")
+        ]
+        return replies[-1]
+
+    recorder = cassette.Cassette(path, mode="record")
+    with (
+        patch.object(ai, "ChatOpenAI", StreamingModel),
+        patch.object(routing, "CASSETTE", recorder),
+    ):
+        assert asyncio.run(question()) == "Anything spicy?"
+    recorder.flush()
+    (record,) = read_records(path)
+    assert record["usage"] == usage and record["first_token_s"] is not None
+    assert record["complete"]
+
+    with (
+        patch.object(ai, "ChatOpenAI", None),
+        patch.object(
+            routing, "CASSETTE", cassette.Cassette(path, "replay", latency_scale=0)
+        ),
+    ):
+        assert asyncio.run(question()) == "Anything spicy?"
+
+
+def test_stream_closed_early_is_recorded_off_the_event_loop(tmp_path):
+    """Test that a stream its consumer stops is still recorded, by the writer thread."""
+    path = str(tmp_path / "calls.jsonl")
+    recorder = cassette.Cassette(path, mode="record")
+    writers = []
+    append = recorder._append
+
+    def record_writer(record):
+        writers.append(threading.current_thread().name)
+        append(record)
+
+    class StreamingModel:
+        async def astream(self, messages):
+            yield AIMessageChunk(content="Anything ")
+            yield AIMessageChunk(content="spicy?")
+
+    async def first_chunk():
+        model = recorder.wrap(lambda **kwargs: StreamingModel(), "question")()
+        stream = model.astream(["Ask something"])
+        async for chunk in stream:
+            await stream.aclose()
+            return chunk.content
+
+    with patch.object(recorder, "_append", record_writer):
+        assert asyncio.run(first_chunk()) == "Anything "
+        recorder.flush()
+
+    (record,) = read_records(path)
+    assert record["response"] == "Anything " and not record["complete"]
+    assert writers == ["cassette-writer"]
+    assert recorder.summary()["recorded"] == 1
+
+
+def test_incomplete_streams_are_not_replayed(tmp_path):
+    """Test that a stream closed early is kept in the file but never replayed."""
+    path = str(tmp_path / "calls.jsonl")
+    recorder = cassette.Cassette(path, mode="record")
+
+    class StreamingModel:
+        async def astream(self, messages):
+            yield AIMessageChunk(content="Anything ")
+            yield AIMessageChunk(content="spicy?")
+
+    async def stream(close_early):
+        model = recorder.wrap(lambda **kwargs: StreamingModel(), "question")()
+        stream = model.astream(["Ask something"])
+        async for _ in stream:
+            if close_early:
+                await stream.aclose()
+
+    asyncio.run(stream(close_early=True))
+    recorder.flush()
+
+    replay = cassette.Cassette(path, mode="replay", match="stage", latency_scale=0)
+    with pytest.raises(cassette.CassetteMissError):
+        replay.find("question", "any")
+
+    asyncio.run(stream(close_early=False))
+    recorder.flush()
+    replay = cassette.Cassette(path, mode="replay", match="stage", latency_scale=0)
+    assert [replay.find("question", "any")["response"] for _ in range(3)] == [
+        "Anything spicy?"
+    ] * 3
+    assert len(read_records(path)) == 2
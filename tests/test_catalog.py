@@ -0,0 +1,183 @@
+import io
+import time
+from unittest.mock import patch
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+import api
+import catalog
+
+DISHES = [
+    {"name": "Pasta Carbonara", "description": "Eggs and pancetta", "price": "$12"},
+    {"name": "Caesar Salad", "description": "Romaine lettuce", "price": "$8"},
+]
+
+
+def photo(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def menu_catalog(tmp_path):
+    menu_catalog = catalog.MenuCatalog(str(tmp_path / "catalog.sqlite3"))
+    with patch("api.CATALOG", menu_catalog):
+        yield menu_catalog
+    menu_catalog.close()
+
+
+def extract(client, color="white", restaurant_id="trattoria"):
+    return client.post(
+        "/extract_menu",
+        params={"restaurant_id": restaurant_id},
+        files=[("files", ("menu.jpg", photo(color), "image/jpeg"))],
+    )
+
+
+def test_store_versions_menus_by_restaurant_and_images(menu_catalog):
+    """Test that changed menus get a new version and unchanged ones are confirmed."""
+    first = menu_catalog.store("trattoria", DISHES, ["a", "b"])
+    confirmed = menu_catalog.store("trattoria", DISHES, ["a", "b"])
+    changed = menu_catalog.store("trattoria", DISHES[:1], ["c"])
+
+    assert (first.version, confirmed.version, changed.version) == (1, 1, 2)
+    assert confirmed.created_at == first.created_at
+    assert confirmed.refreshed_at >= first.refreshed_at
+    assert menu_catalog.latest("trattoria").dishes == DISHES[:1]
+    assert menu_catalog.find_by_images("trattoria", ["a", "b"]).version == 1
+    assert menu_catalog.find_by_images("trattoria", ["b", "a"]) is None
+    assert menu_catalog.latest("bistro") is None
+
+
+def test_late_refresh_of_old_photos_keeps_the_newer_menu(menu_catalog):
+    """Test that re-extracting superseded photos does not replace the latest version."""
+    menu_catalog.store("trattoria", DISHES, ["a"])
+    menu_catalog.store("trattoria", DISHES[:1], ["b"])
+
+    for dishes in (DISHES, DISHES[1:]):
+        late = menu_catalog.store("trattoria", dishes, ["a"])
+        assert late.version == 1 and late.dishes == DISHES
+
+    latest = menu_catalog.latest("trattoria")
+    assert (latest.version, latest.dishes) == (2, DISHES[:1])
+    assert menu_catalog.summary()["stored"] == 2
+    # The current photos still get a new version when their menu changes
+    assert menu_catalog.store("trattoria", DISHES[1:], ["b"]).version == 3
+
+
+def test_lookups_use_indexes(menu_catalog):
+    """Test that menu lookups search an index rather than scanning the table."""
+    menu_catalog.store("trattoria", DISHES, ["a"])
+    connection = menu_catalog._connection
+    for sql, parameters in (
+        ("SELECT * FROM menus WHERE restaurant_id = ? ORDER BY version DESC", ("t",)),
+        (
+            "SELECT * FROM menus WHERE restaurant_id = ? AND images_key = ?",
+            ("t", "k"),
+        ),
+    ):
+        plan = " ".join(
+            row[-1]
+            for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)
+        )
+        assert "SEARCH" in plan and "SCAN" not in plan, plan
+
+
+def test_catalog_serves_known_photos_and_restaurant_conversations(menu_catalog):
+    """Test that stored menus skip extraction and start conversations without photos."""
+    client = TestClient(api.app)
+    with patch("api.extract_menu_items", return_value=DISHES) as mock_extract:
+        first = extract(client)
+        second = extract(client)
+
+    assert first.status_code == second.status_code == 200
+    assert mock_extract.call_count == 1
+    assert second.json()["dishes"] == DISHES
+    assert second.json()["catalog"]["version"] == 1
+
+    response = client.get("/restaurants/trattoria/menu")
+    assert response.status_code == 200
+    assert response.json()["menu_id"] == first.json()["menu_id"]
+
+    with patch("api.generate_next_question", return_value="Spicy?") as mock_question:
+        response = client.post(
+            "/next_question",
+            json={"restaurant_id": "trattoria", "qa": [], "language": "English"},
+        )
+    assert response.status_code == 200
+    assert mock_question.call_args.args[0].as_list() == DISHES
+
+    assert client.get("/restaurants/bistro/menu").status_code == 404
+
+
+def test_stale_menu_is_served_and_refreshed_in_background(menu_catalog, monkeypatch):
+    """Test that a stale menu is returned at once while a refresh stores a new version."""
+    with TestClient(api.app) as client:
+        with patch("api.extract_menu_items", return_value=DISHES):
+            extract(client)
+        monkeypatch.setattr(catalog, "MENU_STALE_SECONDS", 0.0)
+        time.sleep(0.01)
+
+        with patch("api.extract_menu_items", return_value=DISHES[:1]) as mock_extract:
+            response = extract(client)
+            assert response.json()["dishes"] == DISHES
+            assert response.json()["catalog"]["stale"]
+            deadline = time.monotonic() + 5
+            while menu_catalog.latest("trattoria").version < 2:
+                assert time.monotonic() < deadline, "Menu was not refreshed"
+                time.sleep(0.01)
+
+    assert mock_extract.call_count == 1
+    assert menu_catalog.latest("trattoria").dishes == DISHES[:1]
+
+
+def test_failed_refresh_is_counted_and_backed_off(menu_catalog, monkeypatch):
+    """Test that an empty refresh counts as failed and is not retried at once."""
+    monkeypatch.setattr(catalog, "MENU_REFRESHER", catalog.MenuRefresher())
+    monkeypatch.setattr(api, "MENU_REFRESHER", catalog.MENU_REFRESHER)
+    with TestClient(api.app) as client:
+        with patch("api.extract_menu_items", return_value=DISHES):
+            extract(client)
+        monkeypatch.setattr(catalog, "MENU_STALE_SECONDS", 0.0)
+        time.sleep(0.01)
+
+        with patch("api.extract_menu_items", return_value=[]) as mock_extract:
+            extract(client)
+            deadline = time.monotonic() + 5
+            while catalog.MENU_REFRESHER.failed < 1:
+                assert time.monotonic() < deadline, "Refresh did not finish"
+                time.sleep(0.01)
+            response = extract(client)
+
+    assert response.json()["dishes"] == DISHES
+    assert mock_extract.call_count == 1
+    assert catalog.MENU_REFRESHER.summary() == {
+        "pending": 0,
+        "backing_off": 1,
+        "refreshed": 0,
+        "failed": 1,
+    }
+    assert menu_catalog.latest("trattoria").version == 1
+
+
+def test_catalog_writes_need_the_write_token(menu_catalog, monkeypatch):
+    """Test that a configured write token guards storing menus by restaurant."""
+    monkeypatch.setattr(catalog, "CATALOG_WRITE_TOKEN", "secret")
+    client = TestClient(api.app)
+    with patch("api.extract_menu_items", return_value=DISHES):
+        denied = extract(client)
+        allowed = client.post(
+            "/extract_menu",
+            params={"restaurant_id": "trattoria"},
+            headers={"Authorization": "Bearer secret"},
+            files=[("files", ("menu.jpg", photo("white"), "image/jpeg"))],
+        )
+        anonymous = client.post(
+            "/extract_menu",
+            files=[("files", ("menu.jpg", photo("white"), "image/jpeg"))],
+        )
+
+    assert denied.status_code == 401
+    assert allowed.status_code == anonymous.status_code == 200
+    assert menu_catalog.latest("trattoria").version == 1
@@ -1,7 +1,12 @@
 import os
+import subprocess
+import sys
 from unittest.mock import patch
+import pytest
 import main
 
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
 
 def test_env_variables():
     """Test that the required environment variables are checked."""
@@ -32,3 +37,57 @@ def test_logger_initialized():
     assert hasattr(main.logger, "warning")
     assert hasattr(main.logger, "info")
     assert hasattr(main.logger, "error")
+
+
+def test_help_does_not_need_key_or_heavy_imports():
+    """Test that --help runs without OPENAI_API_KEY and without loading any mode."""
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    code = (
+        "import sys, runpy; sys.argv = ['main.py', '--help']\n"
+        "try:\n    runpy.run_path('main.py', run_name='__main__')\n"
+        "except SystemExit:\n    pass\n"
+        "print(sorted({'api', 'gradio', 'langchain_openai'} & set(sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip().endswith("[]")
+
+
+def test_api_import_defers_langchain():
+    """Test that importing the API does not import LangChain until it is needed."""
+    code = "import sys, api; print('langchain_openai' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_extraction_prompt_builds_before_langchain_is_loaded():
+    """Test that the extraction prompt loads the message classes it uses."""
+    code = (
+        "import ai\n"
+        "from PIL import Image\n"
+        "print(len(ai.extraction_prompt([Image.new('RGB', (8, 8))])))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True
+    )
+    assert result.stdout.strip() == "2", result.stderr
+
+
+def test_main_requires_key_for_modes():
+    """Test that running a mode without OPENAI_API_KEY fails early."""
+    with (
+        patch.dict(os.environ, {}, clear=True),
+        patch("sys.argv", ["main.py", "--mode", "api"]),
+        patch("main.run_api") as mock_run_api,
+    ):
+        with pytest.raises(EnvironmentError):
+            main.main()
+    mock_run_api.assert_not_called()
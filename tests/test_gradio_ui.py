@@ -0,0 +1,263 @@
+import asyncio
+import time
+from unittest.mock import patch
+import pytest
+from langchain_core.messages import AIMessageChunk
+from PIL import Image
+import gradio_ui
+from sessions import SESSION_STORE
+
+MENU = [{"name": "Pizza", "description": "Cheese"}]
+
+
+def handler(demo, name):
+    return next(fn.fn for fn in demo.fns.values() if fn.fn and fn.fn.__name__ == name)
+
+
+async def collect(generator):
+    return [output async for output in generator]
+
+
+def asking_session():
+    session_id, session = SESSION_STORE.session()
+    session.stage, session.menu = "asking", gradio_ui.compile_menu(MENU)
+    session.qa = ["Spicy?"]
+    return session_id, session
+
+
+def session_of(outputs):
+    return SESSION_STORE.session(outputs[-1][1])[1]
+
+
+def fake_stream(*replies):
+    async def stream(*args):
+        for reply in replies:
+            yield reply
+
+    return stream
+
+
+@pytest.fixture
+def demo():
+    return gradio_ui.build_ui()
+
+
+@pytest.fixture
+def photos(tmp_path):
+    """Two menu photos as the filepath Gallery hands them over."""
+    paths = []
+    for page in range(2):
+        path = tmp_path / f"page{page}.jpg"
+        Image.new("RGB", (64, 48), "white").save(path)
+        paths.append((str(path), None))
+    return paths
+
+
+def test_queue_and_concurrency_limits(demo):
+    """Test that the app is queued and extraction has its own concurrency limit."""
+    assert demo._queue.max_size == gradio_ui.GRADIO_QUEUE_SIZE
+    limits = {
+        fn.fn.__name__: (fn.concurrency_id, fn.concurrency_limit)
+        for fn in demo.fns.values()
+        if fn.fn and fn.fn.__name__ not in ("<lambda>", "get_session_stats")
+    }
+    assert limits == {
+        "initialize_conversation": ("extract", gradio_ui.GRADIO_EXTRACT_CONCURRENCY),
+        "process_conversation": ("conversation", gradio_ui.GRADIO_CONCURRENCY),
+    }
+
+
+def test_session_stats_are_served_outside_the_queue(demo):
+    """Test that operators can read session counts and memory from the app."""
+    (endpoint,) = [
+        fn for fn in demo.fns.values() if fn.api_name == "session_stats"
+    ]
+    session_id, _ = asking_session()
+    try:
+        stats = endpoint.fn()
+    finally:
+        SESSION_STORE.discard(session_id)
+
+    assert not endpoint.queue
+    assert stats["sessions"] >= 1 and stats["menus"] >= 1
+    assert stats["bytes_per_session"] > 0
+
+
+def test_dish_table_and_first_question_are_streamed(demo, photos):
+    """Test that Start fills the dish table page by page, then streams the question."""
+    pizza, pasta = MENU[0], {"name": "Pasta", "description": "", "price": "9 €"}
+    extraction = fake_stream((1, 2, [pizza]), (2, 2, [pizza]), (2, 2, [pizza, pasta]))
+    with (
+        patch("gradio_ui.astream_menu_items", extraction),
+        patch("gradio_ui.astream_next_question", fake_stream("Do", "Do you like")),
+    ):
+        outputs = asyncio.run(
+            collect(handler(demo, "initialize_conversation")("English", photos, None))
+        )
+
+    tables = [table["value"] for _, _, table, _ in outputs]
+    assert tables[0] == [["Pizza", "Cheese", ""]]
+    assert tables[-1] == [["Pizza", "Cheese", ""], ["Pasta", "", "9 €"]]
+    assert [status for *_, status in outputs[:3]] == [
+        "Reading page 1/2 · 1 dishes found",
+        "Reading page 2/2 · 1 dishes found",
+        "Reading page 2/2 · 2 dishes found",
+    ]
+    assert [chat["value"] for chat, *_ in outputs[3:]] == [
+        [[None, "Do"]],
+        [[None, "Do you like"]],
+        [[None, "Do you like"]],
+    ]
+    session = session_of(outputs)
+    assert session.stage == "asking"
+    assert session.qa == ["Do you like"]
+
+
+def test_answer_streams_next_question_and_ignores_input_meanwhile(demo):
+    """Test that a reply streams in and answers sent meanwhile are ignored."""
+    process = handler(demo, "process_conversation")
+    session_id, session = asking_session()
+
+    async def run():
+        generator = process("Yes", session_id)
+        outputs = [await generator.__anext__() for _ in range(2)]
+        ignored = await collect(process("Also cheese", session_id))
+        outputs.extend(await collect(generator))
+        return outputs, ignored
+
+    with patch("gradio_ui.astream_next_question", fake_stream("Any", "Any allergies?")):
+        outputs, ignored = asyncio.run(run())
+
+    assert outputs[1][1]["value"] == [[None, "Spicy?"], ["Yes", "Any"]]
+    assert outputs[-1][1]["value"] == [[None, "Spicy?"], ["Yes", "Any allergies?"]]
+    assert ignored == [(session_id, {"__type__": "update"})]
+    assert session.qa == ["Spicy?", "Yes", "Any allergies?"]
+    assert session.stage == "asking"
+
+
+def test_failed_reply_lets_the_answer_be_resent(demo):
+    """Test that a failing stream restores the conversation instead of hanging it."""
+
+    async def failing(*args):
+        yield "Any"
+        raise RuntimeError("connection reset")
+
+    session_id, session = asking_session()
+    with (
+        patch("gradio_ui.astream_next_question", failing),
+        patch("gradio_ui.gr.Warning"),
+    ):
+        asyncio.run(collect(handler(demo, "process_conversation")("Yes", session_id)))
+
+    assert session.stage == "asking"
+    assert session.qa == ["Spicy?"]
+
+
+def test_resent_answer_replaces_the_failed_one(demo):
+    """Test that an answer resent after a failed reply is the one the prompt sees."""
+
+    async def failing(*args):
+        raise RuntimeError("connection reset")
+        yield
+
+    seen = []
+
+    async def answering(menu, qa, language, preferences):
+        seen.append(preferences.render())
+        yield "Spicy?"
+
+    process = handler(demo, "process_conversation")
+    session_id, session = asking_session()
+    session.qa = ["Any allergies?"]
+    with patch("gradio_ui.gr.Warning"):
+        with patch("gradio_ui.astream_next_question", failing):
+            asyncio.run(collect(process("Peanuts", session_id)))
+        with patch("gradio_ui.astream_next_question", answering):
+            asyncio.run(collect(process("Shellfish", session_id)))
+
+    assert "Any allergies? → Shellfish" in seen[0]
+    assert "Peanuts" not in seen[0]
+    assert session.preferences.turns == 1
+
+
+def test_extraction_does_not_block_other_sessions(demo, photos):
+    """Test that a slow extraction leaves the event loop free for other sessions."""
+
+    def slow_prompt(images):
+        time.sleep(0.2)
+        return []
+
+    async def astream(messages):
+        yield AIMessageChunk(content='[{"name": "Pizza"}]')
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await collect(
+            handler(demo, "initialize_conversation")("English", photos[:1], None)
+        )
+        task.cancel()
+        return ticks
+
+    with (
+        patch("ai.extraction_prompt", side_effect=slow_prompt),
+        patch("ai.ChatOpenAI") as mock_chat,
+        patch("gradio_ui.astream_next_question", fake_stream("Hi?")),
+    ):
+        mock_chat.return_value.astream = astream
+        assert asyncio.run(run()) >= 10
+
+
+def test_gallery_photos_are_not_decoded(demo, photos):
+    """Test that gallery files reach extraction as their original bytes."""
+    captured = []
+
+    async def extraction(images):
+        captured.extend(images)
+        yield 1, 1, []
+
+    with (
+        patch("gradio_ui.astream_menu_items", extraction),
+        patch("gradio_ui.gr.Warning"),
+        patch("PIL.Image.open", side_effect=AssertionError("decoded")),
+    ):
+        asyncio.run(
+            collect(handler(demo, "initialize_conversation")("English", photos, None))
+        )
+
+    assert [image.passthrough for image in captured] == [True, True]
+    with open(photos[0][0], "rb") as file:
+        assert captured[0].data == file.read()
+
+
+def test_unreadable_photo_is_reported(demo, tmp_path):
+    """Test that a file that is not an image warns instead of failing the session."""
+    path = tmp_path / "notes.txt"
+    path.write_text("not a menu")
+    with patch("gradio_ui.gr.Warning") as mock_warning:
+        outputs = asyncio.run(
+            collect(
+                handler(demo, "initialize_conversation")(
+                    "English", [(str(path), None)], None
+                )
+            )
+        )
+    mock_warning.assert_called_once()
+    assert session_of(outputs).stage == "await"
+
+
+def test_expired_session_asks_to_start_again(demo):
+    """Test that an answer for an evicted session is not processed."""
+    with patch("gradio_ui.gr.Warning") as mock_warning:
+        outputs = asyncio.run(
+            collect(handler(demo, "process_conversation")("Yes", "gone"))
+        )
+    mock_warning.assert_called_once()
+    assert outputs[0][0] != "gone"
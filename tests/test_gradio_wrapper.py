@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CHECK_SINGLE_INSTANCE = """
+import gc, sys, types
+import gradio_wrapper
+import gradio
+modules = [
+    o for o in gc.get_objects()
+    if isinstance(o, types.ModuleType) and o.__name__ == "gradio"
+]
+print(len(modules))
+print(gradio_wrapper.gr is gradio is sys.modules["gradio"])
+print(gradio_wrapper.resolve_gradio() is gradio_wrapper.gr)
+"""
+
+
+def test_gradio_is_loaded_once():
+    """Test that the wrapper reuses the single, normally imported Gradio module."""
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_SINGLE_INSTANCE],
+        cwd=ROOT,
+        env={**os.environ, "OPENAI_API_KEY": "x"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split() == ["1", "True", "True"]
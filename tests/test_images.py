@@ -0,0 +1,155 @@
+import asyncio
+import base64
+import io
+from unittest.mock import patch
+import pytest
+from fastapi.testclient import TestClient
+from langchain.schema import AIMessage
+from PIL import Image
+from PIL.JpegImagePlugin import JpegImageFile
+import ai
+import api
+import images
+
+
+def encode(image, format, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **params)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    "format,mime_type,params",
+    [
+        ("JPEG", "image/jpeg", {}),
+        ("JPEG", "image/jpeg", {"progressive": True}),
+        ("PNG", "image/png", {}),
+        ("WEBP", "image/webp", {}),
+        ("WEBP", "image/webp", {"lossless": True}),
+    ],
+)
+def test_sniff_image(format, mime_type, params):
+    """Test that the header sniff finds the type and size without decoding."""
+    data = encode(Image.new("RGB", (321, 123), "red"), format, **params)
+    assert images.sniff_image(data) == (mime_type, 321, 123)
+
+
+def test_sniff_image_rejects_unknown_formats():
+    """Test that formats we do not pass through are not sniffed."""
+    assert images.sniff_image(encode(Image.new("RGB", (5, 5)), "GIF")) is None
+    assert images.sniff_image(b"not an image") is None
+
+
+def test_acceptable_upload_is_passed_through():
+    """Test that an acceptable JPEG keeps its original bytes."""
+    data = encode(Image.new("RGB", (800, 600), "blue"), "JPEG")
+    encoded = images.prepare_image_bytes(data)
+
+    assert encoded.passthrough
+    assert encoded.data is data
+    assert encoded.to_data_url() == (
+        "data:image/jpeg;base64," + base64.b64encode(data).decode()
+    )
+
+
+def test_oversized_upload_is_downscaled():
+    """Test that uploads over the pixel limit are decoded and downscaled."""
+    data = encode(Image.new("RGB", (3000, 1000), "green"), "PNG")
+    with patch.object(images, "MAX_PASSTHROUGH_PIXELS", 1_000_000):
+        encoded = images.prepare_image_bytes(data)
+
+    assert not encoded.passthrough
+    assert encoded.mime_type == "image/jpeg"
+    assert encoded.size == (images.MAX_ENCODE_SIDE, 683)
+
+
+def test_other_formats_are_converted():
+    """Test that formats outside the pass-through list are re-encoded."""
+    encoded = images.prepare_image_bytes(encode(Image.new("P", (40, 30)), "GIF"))
+    assert not encoded.passthrough
+    assert encoded.size == (40, 30)
+
+
+def test_extract_sends_original_bytes(mock_openai):
+    """Test that extraction puts pass-through bytes straight into the data URL."""
+    mock_openai.return_value.invoke.return_value = AIMessage(content="[]")
+    data = encode(Image.new("RGB", (64, 64)), "WEBP")
+
+    ai.extract_menu_items([images.prepare_image_bytes(data)])
+
+    human_message = mock_openai.return_value.invoke.call_args.args[0][1]
+    assert human_message.content[0]["image_url"]["url"].startswith(
+        "data:image/webp;base64," + base64.b64encode(data).decode()[:20]
+    )
+
+
+def test_api_extract_menu_skips_decoding():
+    """Test that /extract_menu forwards acceptable uploads without decoding them."""
+    data = encode(Image.new("RGB", (64, 48)), "JPEG")
+    client = TestClient(api.app)
+
+    with (
+        patch("api.extract_menu_items", return_value=[]) as mock_extract,
+        patch("PIL.Image.open", side_effect=AssertionError("decoded")),
+    ):
+        response = client.post(
+            "/extract_menu", files=[("files", ("menu.jpg", data, "image/jpeg"))]
+        )
+
+    assert response.status_code == 200
+    (encoded,) = mock_extract.call_args.args[0]
+    assert encoded.data == data
+    assert encoded.size == (64, 48)
+
+
+def test_api_extract_menu_rejects_non_images():
+    """Test that a non-image upload is a client error."""
+    client = TestClient(api.app)
+    response = client.post(
+        "/extract_menu", files=[("files", ("menu.txt", b"hello", "text/plain"))]
+    )
+    assert response.status_code == 400
+
+
+def test_jpeg_is_decoded_in_draft_mode():
+    """Test that large JPEGs are decoded at a reduced DCT scale."""
+    data = encode(Image.new("RGB", (4000, 3000), "white"), "JPEG")
+    original_draft = JpegImageFile.draft
+
+    with patch.object(
+        JpegImageFile, "draft", autospec=True, side_effect=original_draft
+    ) as mock_draft:
+        encoded = images.prepare_image_bytes(data, max_side=1000)
+
+    mock_draft.assert_called_once()
+    assert mock_draft.call_args.args[1:] == ("RGB", (1000, 750))
+    assert encoded.size == (1000, 750)
+
+
+def test_decoding_does_not_block_the_event_loop():
+    """Test that async preparation keeps the event loop responsive."""
+    data = encode(Image.new("RGB", (3000, 3000), "white"), "PNG")
+    images.DECODE_STATS.clear()
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        with patch.object(images, "MAX_PASSTHROUGH_PIXELS", 1):
+            encoded = await images.prepare_image_bytes_async(data)
+        task.cancel()
+        return encoded, ticks
+
+    encoded, ticks = asyncio.run(run())
+
+    assert encoded.size == (2048, 2048)
+    assert ticks > 0
+    stats = images.DECODE_STATS.summary()
+    assert stats["decoded"] == 1
+    assert stats["max_decode_ms"] > 0
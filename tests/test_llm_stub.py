@@ -0,0 +1,116 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+from PIL import Image
+import ai
+import llm_stub
+import routing
+from preferences import PreferenceState
+
+FAST = dict(latency_ms=0, latency_distribution="fixed", tokens_per_second=10_000)
+
+
+def test_stub_replies_per_stage():
+    """Test that the stub answers extraction prompts with menu JSON and usage."""
+    client = TestClient(llm_stub.create_app(llm_stub.StubConfig(**FAST)))
+    response = client.post(
+        "/v1/chat/completions",
+        json={
+            "model": "gpt-4.1-nano",
+            "messages": [
+                {"role": "system", "content": "You are an advanced menu parser."},
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"url": "data:..."}},
+                        {"type": "text", "text": "Extract now."},
+                    ],
+                },
+            ],
+        },
+    )
+    body = response.json()
+    dishes = json.loads(body["choices"][0]["message"]["content"])
+    assert [dish["name"] for dish in dishes] == [
+        dish["name"] for dish in llm_stub.DEFAULT_MENU
+    ]
+    assert body["usage"]["prompt_tokens"] > llm_stub.IMAGE_TOKENS
+    assert client.get("/stats").json()["images"] == 1
+
+
+def test_stub_injects_rate_limits():
+    """Test that injected 429s carry an OpenAI error body and Retry-After."""
+    config = llm_stub.StubConfig(rate_limit_rate=1.0, **FAST)
+    client = TestClient(llm_stub.create_app(config))
+    response = client.post(
+        "/v1/chat/completions", json={"messages": [{"role": "user", "content": "hi"}]}
+    )
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1.0"
+    assert response.json()["error"]["code"] == "rate_limit_exceeded"
+    assert client.get("/stats").json()["statuses"] == {"429": 1}
+
+
+def test_zero_tokens_per_second_streams_without_delay():
+    """Test that --tokens-per-second 0 means no per-token delay, not an error."""
+    config = llm_stub.StubConfig(**{**FAST, "tokens_per_second": 0})
+    client = TestClient(llm_stub.create_app(config))
+    response = client.post(
+        "/v1/chat/completions",
+        json={"messages": [{"role": "user", "content": "hi"}], "stream": True},
+    )
+    assert response.status_code == 200
+    assert response.text.rstrip().endswith("data: [DONE]")
+    with pytest.raises(llm_stub.argparse.ArgumentTypeError):
+        llm_stub.non_negative("-1")
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    """Serve the stub on a free local port and point ChatOpenAI at it."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    app = llm_stub.create_app(llm_stub.StubConfig(**FAST))
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    monkeypatch.setenv("OPENAI_API_BASE", f"http://127.0.0.1:{port}/v1")
+    for stage in routing.STAGES:
+        monkeypatch.setitem(routing.STAGE_MODELS, stage, ["gpt-4.1-nano"])
+    yield app
+    server.should_exit = True
+    thread.join()
+
+
+def test_app_talks_to_stub_over_http(stub_server):
+    """Test the real OpenAI client against the stub, plain and streamed."""
+    dishes = ai.extract_menu_items([Image.new("RGB", (64, 48))])
+    assert len(dishes) == len(llm_stub.DEFAULT_MENU)
+
+    async def stream_question():
+        replies = [
+            reply
+            async for reply in ai.astream_next_question(
+                dishes, [], "English", PreferenceState()
+            )
+        ]
+        return replies
+
+    replies = asyncio.run(stream_question())
+    assert len(replies) > 1
+    assert replies[-1] == llm_stub.DEFAULT_QUESTION
+    stats = stub_server.state.stub.stats.summary()
+    assert stats["requests"] == {"extract": 1, "question": 1}
+    assert stats["streamed"] == 1
+    assert ai.get_prompt_usage_stats()["question"]["calls"] >= 1
@@ -1,5 +1,8 @@
+import asyncio
 import json
 import pytest
+from langchain_core.messages import AIMessageChunk
+from PIL import Image
 from langchain.schema import AIMessage
 import ai
 
@@ -167,3 +170,145 @@ def test_recommend_dishes_exception(mock_openai):
     # Call the function with expected failure
     with pytest.raises(Exception):
         result = ai.recommend_dishes(dishes, qa_history, language)
+
+
+def test_conversation_prompt_prefix_is_stable(mock_openai):
+    """Test that every turn of a conversation shares a byte-identical prompt prefix."""
+    dishes = [
+        {"name": "Pasta  Carbonara", "description": "Eggs,\ncheese and pancetta"},
+        {"name": "Caesar Salad", "description": "Romaine lettuce"},
+    ]
+    mock_instance = mock_openai.return_value
+    mock_instance.invoke.return_value = AIMessage(
+        content="Do you like cheese?",
+        usage_metadata={
+            "input_tokens": 1200,
+            "output_tokens": 8,
+            "total_tokens": 1208,
+            "input_token_details": {"cache_read": 1024},
+        },
+    )
+    ai.PROMPT_USAGE_STATS.clear()
+
+    # Five questions in alternating languages, followed by the recommendation
+    qa_history = []
+    for turn in range(5):
+        language = "English" if turn % 2 == 0 else "Deutsch"
+        qa_history += [ai.generate_next_question(dishes, qa_history, language), "Yes"]
+    ai.recommend_dishes(dishes, qa_history, "English")
+
+    prompts = [call.args[0] for call in mock_instance.invoke.call_args_list]
+    assert len(prompts) == 6
+    prefixes = {(prompt[0].content, prompt[1].content) for prompt in prompts}
+    assert len(prefixes) == 1
+    assert "- Pasta Carbonara: Eggs, cheese and pancetta" in prompts[0][1].content
+    assert "Deutsch" in prompts[1][2].content
+
+    stats = ai.get_prompt_usage_stats()
+    assert stats["question"]["calls"] == 5
+    assert stats["question"]["prompt_tokens"] == 6000
+    assert stats["question"]["cached_tokens"] == 5120
+    assert stats["question"]["uncached_tokens"] == 880
+    assert stats["recommend"]["cache_hit_ratio"] == 1024 / 1200
+
+
+def test_astream_next_question_accumulates_chunks(mock_openai):
+    """Test that the question streams as it grows and its usage is recorded."""
+
+    async def astream(messages):
+        yield AIMessageChunk(content="Do you ")
+        yield AIMessageChunk(
+            content="like spicy food?",
+            usage_metadata={
+                "input_tokens": 900,
+                "output_tokens": 6,
+                "total_tokens": 906,
+                "input_token_details": {"cache_read": 768},
+            },
+        )
+
+    mock_openai.return_value.astream = astream
+    ai.PROMPT_USAGE_STATS.clear()
+    dishes = [{"name": "Pizza", "description": "Cheese"}]
+
+    async def run():
+        return [text async for text in ai.astream_next_question(dishes, [], "English")]
+
+    assert asyncio.run(run()) == ["Do you", "Do you like spicy food?"]
+    assert mock_openai.call_args.kwargs["stream_usage"] is True
+    assert ai.PROMPT_USAGE_STATS["question"] == {
+        "calls": 1,
+        "prompt_tokens": 900,
+        "cached_tokens": 768,
+    }
+
+
+def test_menu_stream_parser_yields_complete_dishes():
+    """Test that only complete dish objects are picked out of a growing reply."""
+    parser = ai.MenuStreamParser()
+    reply = '[{"name": "Pizza", "price": "9 €"}, {"name": "Pa'
+    assert parser.feed(reply[:10]) == []
+    assert parser.feed(reply) == [{"name": "Pizza", "price": "9 €"}]
+    assert [d["name"] for d in parser.feed(reply + 'sta"}, {"name"')] == [
+        "Pizza",
+        "Pasta",
+    ]
+    # An escalated reply starts over
+    assert parser.feed('[{"name": "Soup"}') == [{"name": "Soup"}]
+
+
+def test_astream_menu_items_reports_pages_and_skips_repeats(mock_openai):
+    """Test that dishes stream in page by page without repeating dishes."""
+    pages = iter(
+        [
+            ['[{"name": "Pizza"},', ' {"name": "Pasta"}]'],
+            ['[{"name": "pizza "},', ' {"name": "Tiramisu"}]'],
+        ]
+    )
+
+    async def astream(messages):
+        for chunk in next(pages):
+            yield AIMessageChunk(content=chunk)
+
+    mock_openai.return_value.astream = astream
+    images = [Image.new("RGB", (10, 10))] * 2
+
+    async def run():
+        return [
+            (page, total, [dish["name"] for dish in dishes])
+            async for page, total, dishes in ai.astream_menu_items(images)
+        ]
+
+    assert asyncio.run(run()) == [
+        (1, 2, ["Pizza"]),
+        (1, 2, ["Pizza", "Pasta"]),
+        (1, 2, ["Pizza", "Pasta"]),
+        (2, 2, ["Pizza", "Pasta"]),
+        (2, 2, ["Pizza", "Pasta", "Tiramisu"]),
+        (2, 2, ["Pizza", "Pasta", "Tiramisu"]),
+    ]
+
+
+def test_prompt_usage_is_counted_across_threads_and_reported():
+    """Test that concurrent usage records are all counted and shown in /health."""
+    from concurrent.futures import ThreadPoolExecutor
+    from fastapi.testclient import TestClient
+    import api
+
+    response = AIMessage(
+        content="",
+        usage_metadata={
+            "input_tokens": 10,
+            "output_tokens": 1,
+            "total_tokens": 11,
+            "input_token_details": {"cache_read": 4},
+        },
+    )
+    ai.PROMPT_USAGE_STATS.clear()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: ai.record_prompt_usage("question", response), range(2000)))
+
+    usage = TestClient(api.app).get("/health").json()["prompt_usage"]
+    assert usage["question"]["calls"] == 2000
+    assert usage["question"]["prompt_tokens"] == 20000
+    assert usage["question"]["cache_hit_ratio"] == 0.4
@@ -0,0 +1,63 @@
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from langchain.schema import AIMessage
+import api
+import memtrace
+import profiling
+
+AUTH = {"Authorization": "Bearer secret"}
+retained = []
+
+
+def leak(blocks):
+    retained.extend(bytearray(10_000) for _ in range(blocks))
+
+
+def test_snapshot_diff_finds_growing_site():
+    """Test that the site allocating between snapshots tops the diff."""
+    tracker = memtrace.MemoryTracker()
+    tracker.start(interval=0)
+    try:
+        leak(50)
+        tracker.snapshot()
+        (top,) = tracker.top(limit=1)
+        (since_start,) = tracker.top(limit=1, against="baseline")
+    finally:
+        tracker.stop()
+        retained.clear()
+
+    assert "test_memtrace.py" in top["site"]
+    assert top["size_diff_bytes"] >= 50 * 10_000
+    assert top["count_diff"] >= 50
+    assert since_start["site"] == top["site"]
+
+
+def test_memory_endpoint_reports_route_peaks(mock_openai):
+    """Test /debug/memory with per-route peaks, and that it needs tracing on."""
+    mock_openai.return_value.invoke.return_value = AIMessage(content="Anything spicy?")
+    client = TestClient(api.app)
+    payload = {
+        "dishes": [{"name": "Pizza", "description": "Cheese"}],
+        "qa": [],
+        "language": "English",
+    }
+    with patch.object(profiling, "PROFILING_TOKEN", "secret"):
+        assert client.get("/debug/memory", headers=AUTH).status_code == 409
+
+        memtrace.MEMORY_TRACKER.start(interval=0)
+        try:
+            assert client.post("/next_question", json=payload).status_code == 200
+            response = client.get(
+                "/debug/memory?limit=3&group_by=filename", headers=AUTH
+            )
+        finally:
+            memtrace.MEMORY_TRACKER.stop()
+            memtrace.ROUTE_ALLOCATIONS.clear()
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["tracing"] and report["snapshots"] == 2
+    assert len(report["top"]) == 3
+    route = report["routes"]["/next_question"]
+    assert route["requests"] == 1 and route["overlapped"] == 0
+    assert route["max_peak_bytes"] > 0
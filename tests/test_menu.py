@@ -0,0 +1,71 @@
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import menu
+import api
+
+
+SAMPLE_DISHES = [
+    {"name": "Pasta Carbonara", "description": "Eggs and pancetta", "price": "$12"},
+    {"name": "Caesar Salad", "description": "Romaine lettuce", "price": "$8"},
+]
+
+
+def test_menu_digest_is_stable():
+    """Test that equal menus share a digest and different menus do not."""
+    copy = [dict(dish) for dish in SAMPLE_DISHES]
+    assert menu.menu_digest(SAMPLE_DISHES) == menu.menu_digest(copy)
+    assert menu.menu_digest(SAMPLE_DISHES) != menu.menu_digest(SAMPLE_DISHES[:1])
+
+
+def test_compile_menu_is_memoized():
+    """Test that compiling the same menu twice returns the cached object."""
+    menu.MENU_CACHE.clear()
+    compiled = menu.compile_menu(SAMPLE_DISHES)
+
+    assert menu.compile_menu([dict(dish) for dish in SAMPLE_DISHES]) is compiled
+    assert menu.get_compiled_menu(compiled.digest) is compiled
+    assert compiled.prompt_fragment.startswith("Menu:\n- Pasta Carbonara")
+    assert compiled.prompt_tokens > 0
+    assert compiled.find("caesar  salad")["price"] == "$8"
+    assert compiled.find("Pizza") is None
+
+
+def test_menu_cache_evicts_least_recently_used():
+    """Test that the memo table stays bounded and keeps recently used menus."""
+    cache = menu.MenuCache(max_size=2)
+    first, second, third = (
+        menu.CompiledMenu(str(i), (), "", 0, {}) for i in range(3)
+    )
+    cache.put(first)
+    cache.put(second)
+    cache.get("0")
+    cache.put(third)
+
+    assert len(cache) == 2
+    assert cache.get("0") is first
+    assert cache.get("1") is None
+
+
+def test_api_accepts_menu_id_without_dishes():
+    """Test that /next_question serves a compiled menu by its digest."""
+    compiled = menu.compile_menu(SAMPLE_DISHES)
+    client = TestClient(api.app)
+
+    with patch("api.generate_next_question", return_value="Spicy?") as mock_question:
+        response = client.post(
+            "/next_question",
+            json={"menu_id": compiled.digest, "qa": [], "language": "English"},
+        )
+
+    assert response.status_code == 200
+    assert response.json()["question"] == "Spicy?"
+    assert mock_question.call_args.args[0] is compiled
+
+
+def test_api_rejects_unknown_menu_id_without_dishes():
+    """Test that an unknown menu_id without dishes is a client error."""
+    client = TestClient(api.app)
+    response = client.post(
+        "/recommend", json={"menu_id": "missing", "qa": ["Q", "A"], "language": "en"}
+    )
+    assert response.status_code == 400
@@ -0,0 +1,94 @@
+import io
+import time
+from fastapi.testclient import TestClient
+from langchain.schema import AIMessage
+from PIL import Image
+import ai
+import api
+import metrics
+
+
+def sample(text, line_start):
+    """Return the value of the first exposition line starting with line_start."""
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_start} not in metrics")
+
+
+def test_histogram_and_counter_exposition():
+    """Test the Prometheus text format of histograms and counters."""
+    registry = metrics.Registry()
+    histogram = registry.histogram("demo_seconds", "Demo.", ("stage",), (0.1, 1.0))
+    counter = registry.counter("demo_total", "Demo.", ("kind",))
+    histogram.observe(0.05, stage="parse")
+    histogram.observe(0.5, stage="parse")
+    histogram.observe(5, stage="parse")
+    counter.inc(3, kind='say "hi"')
+
+    lines = registry.render().splitlines()
+    assert "# TYPE demo_seconds histogram" in lines
+    assert 'demo_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{stage="parse",le="1"} 2' in lines
+    assert 'demo_seconds_bucket{stage="parse",le="+Inf"} 3' in lines
+    assert 'demo_seconds_sum{stage="parse"} 5.55' in lines
+    assert 'demo_seconds_count{stage="parse"} 3' in lines
+    assert 'demo_total{kind="say \\"hi\\""} 3' in lines
+
+
+def test_metrics_endpoint_covers_the_extraction_stages(mock_openai):
+    """Test that an extraction shows up per stage on /metrics."""
+    mock_openai.return_value.invoke.return_value = AIMessage(
+        content='[{"name": "Pizza"}]',
+        usage_metadata={"input_tokens": 1200, "output_tokens": 8, "total_tokens": 1208},
+    )
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48)).save(buffer, format="GIF")
+    client = TestClient(api.app)
+    before = client.get("/metrics").text
+
+    response = client.post(
+        "/extract_menu", files=[("files", ("menu.gif", buffer.getvalue(), "image/gif"))]
+    )
+    assert response.status_code == 200
+    response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    for stage in ("image_decode", "image_encode", "parse"):
+        assert (
+            sample(text, f'menu_analyzer_stage_seconds_count{{stage="{stage}"}}') >= 1
+        )
+    assert sample(text, 'menu_analyzer_llm_call_seconds_count{stage="extract"') >= 1
+    tokens = 'menu_analyzer_llm_tokens_total{stage="extract",kind="completion"}'
+    assert (
+        sample(text, tokens) - (sample(before, tokens) if tokens in before else 0) == 8
+    )
+    assert sample(text, 'menu_analyzer_llm_tokens_total{stage="extract",kind="image"}')
+    assert sample(text, 'menu_analyzer_payload_bytes_total{kind="upload"}') >= len(
+        buffer.getvalue()
+    )
+    assert sample(
+        text,
+        'menu_analyzer_http_request_seconds_count{endpoint="/extract_menu",status="200"}',
+    )
+    assert sample(text, 'menu_analyzer_images_total{path="decoded"}') >= 1
+
+
+def test_parse_fallback_is_counted(mock_openai):
+    """Test that a non-JSON extraction reply increments the fallback counter."""
+    mock_openai.return_value.invoke.return_value = AIMessage(content="- Pizza\n- Pasta")
+    before = metrics.PARSE_FALLBACKS.value()
+    ai.extract_menu_items([Image.new("RGB", (10, 10))])
+    assert metrics.PARSE_FALLBACKS.value() == before + 1
+
+
+def test_recording_overhead_is_small():
+    """Test that recording a sample costs microseconds, not milliseconds."""
+    histogram = metrics.Histogram("overhead_seconds", "Overhead.", ("stage",))
+    start = time.perf_counter()
+    for _ in range(100_000):
+        histogram.observe(0.02, stage="llm")
+    per_call = (time.perf_counter() - start) / 100_000
+    assert per_call < 20e-6
+    assert histogram.count(stage="llm") == 100_000
@@ -0,0 +1,138 @@
+from langchain.schema import AIMessage
+import ai
+from preferences import MAX_ANSWER_CHARS, PreferenceState, classify_preference
+
+# Conversations recorded from the Gradio app (questions and answers as sent)
+RECORDED_CONVERSATIONS = {
+    "vegetarian_peanut_allergy": [
+        "Do you have any food allergies I should know about?",
+        "Yes, I'm allergic to peanuts.",
+        "Are you following any particular diet, like vegetarian or vegan?",
+        "I'm vegetarian.",
+        "How do you feel about spicy food?",
+        "Only mild please.",
+        "Would you like something light or a hearty main course?",
+        "Something hearty, I'm really hungry.",
+        "Actually, thinking about it again: can you handle some heat?",
+        "Yes, make it spicy after all!",
+    ],
+    "long_free_text": [
+        "What kind of cuisine are you in the mood for tonight?",
+        "Honestly I grew up eating my grandmother's Persian cooking and " * 12,
+        "Do you prefer fish, chicken or beef?",
+        "Fish, ideally grilled.",
+        "Is there a budget you'd like to stay within?",
+        "Under 25 euros per main.",
+    ],
+}
+
+
+def render_question_prompt(history):
+    return PreferenceState.from_history(history).render()
+
+
+def test_recorded_conversation_keeps_every_preference():
+    """Test that the compact state keeps every preference the guest stated."""
+    prompt = render_question_prompt(RECORDED_CONVERSATIONS["vegetarian_peanut_allergy"])
+
+    assert "allergic to peanuts" in prompt
+    assert "I'm vegetarian" in prompt
+    assert "Something hearty" in prompt
+    # The later answer on spice replaces the earlier one
+    assert "make it spicy after all" in prompt
+    assert "Only mild" not in prompt
+    assert "Topics already covered: allergies, diet, spice, appetite" in prompt
+
+
+def test_later_answers_do_not_erase_allergies_or_diet():
+    """Test that a follow-up "No" keeps the allergy and diet facts given before it."""
+    state = PreferenceState.from_history(
+        [
+            "Any allergies?",
+            "Peanuts",
+            "Any other allergies?",
+            "No",
+            "Any dietary restrictions?",
+            "Vegetarian",
+            "Any other diet we should respect?",
+            "No, that's all",
+        ]
+    )
+    prompt = state.render()
+    compact_prompt = state.compacted().render()
+
+    for text in (prompt, compact_prompt):
+        assert "Any allergies? → Peanuts" in text
+        assert "Any other allergies? → No" in text
+        assert "Any dietary restrictions? → Vegetarian" in text
+    assert PreferenceState.from_dict(state.to_dict()) == state
+
+
+def test_keywords_match_whole_words():
+    """Test that keywords inside longer words do not pick the slot."""
+    assert classify_preference("Do you care about nutrition?", "Not really") == "other"
+    assert classify_preference("Are you staying at a hotel nearby?", "Yes") == "other"
+    assert classify_preference("Any nut allergies?", "Tree nuts") == "allergies"
+    assert classify_preference("Something under $20?", "Sure") == "budget"
+    assert classify_preference("Prices are fine?", "10€ max") == "budget"
+    assert classify_preference("Spiciness?", "Very hot") == "spice"
+
+
+def test_long_answers_are_bounded():
+    """Test that long free-text answers are cut but their topic survives."""
+    state = PreferenceState.from_history(RECORDED_CONVERSATIONS["long_free_text"])
+
+    assert len(state.slots["cuisine"]) < 2 * MAX_ANSWER_CHARS
+    assert "Persian cooking" in state.slots["cuisine"]
+    assert "Fish, ideally grilled." in state.slots["protein"]
+    assert "Under 25 euros" in state.slots["budget"]
+
+
+def test_prompt_size_is_bounded_by_turns():
+    """Test that the rendered state stops growing as turns are added."""
+    recorded = RECORDED_CONVERSATIONS["vegetarian_peanut_allergy"]
+    sizes = [
+        len(render_question_prompt(recorded * repeats)) for repeats in (1, 10, 100)
+    ]
+    assert sizes[1] <= sizes[0] * 1.1
+    # Only the turn numbers in the latest exchange get longer
+    assert sizes[2] <= sizes[1] + 10
+
+
+def test_incremental_updates_match_full_rebuild():
+    """Test that folding turn by turn equals rebuilding from the transcript."""
+    history = RECORDED_CONVERSATIONS["vegetarian_peanut_allergy"]
+    state = None
+    for turn in range(0, len(history), 2):
+        state = PreferenceState.from_history(history[: turn + 2], state)
+        # Round trip through the API representation on every turn
+        state = PreferenceState.from_dict(state.to_dict())
+
+    assert state == PreferenceState.from_history(history)
+
+
+def test_client_state_is_rebounded():
+    """Test that oversized client-supplied state cannot grow the prompt."""
+    state = PreferenceState.from_dict(
+        {
+            "turns": 1,
+            "slots": {"diet": "x" * 10_000, "unknown": "ignored"},
+            "other": ["y" * 10_000] * 50,
+            "recent": [["q", "z" * 10_000]] * 50,
+        }
+    )
+    assert len(state.render()) < 3_000
+
+
+def test_question_prompt_uses_preference_state(mock_openai):
+    """Test that the question prompt carries the summary, not the transcript."""
+    mock_openai.return_value.invoke.return_value = AIMessage(content="Dessert?")
+    history = RECORDED_CONVERSATIONS["vegetarian_peanut_allergy"] * 5
+
+    ai.generate_next_question([{"name": "Salad", "description": ""}], history, "English")
+
+    task_text = mock_openai.return_value.invoke.call_args.args[0][-1].content
+    assert "Guest preferences so far" in task_text
+    assert "Q25:" in task_text
+    assert "Q1:" not in task_text
+    assert task_text.count("allergic to peanuts") == 1
@@ -0,0 +1,88 @@
+import threading
+import time
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import api
+import profiling
+
+AUTH = {"Authorization": "Bearer secret"}
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_samples_busy_threads():
+    """Test that a busy thread shows up in the collapsed stacks."""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy_3")
+    worker.start()
+    try:
+        profiler = profiling.SamplingProfiler(interval=0.002).start()
+        time.sleep(0.2)
+        profiler.stop()
+    finally:
+        stop.set()
+        worker.join()
+
+    lines = profiler.collapsed().splitlines()
+    busy = [line for line in lines if "busy_loop (test_profiling.py:" in line]
+    assert busy and all(line.startswith("busy;") for line in busy)
+    assert profiler.summary()["samples"] > 10
+    assert profiler.summary()["overhead"] < 0.5
+
+
+def test_profiling_endpoints_are_disabled_without_token():
+    """Test that the debug endpoints are hidden by default and need the token."""
+    client = TestClient(api.app)
+    with patch.object(profiling, "PROFILING_TOKEN", ""):
+        assert client.get("/debug/profile", headers=AUTH).status_code == 404
+    with patch.object(profiling, "PROFILING_TOKEN", "secret"):
+        response = client.get(
+            "/debug/profile", headers={"Authorization": "Bearer wrong"}
+        )
+        assert response.status_code == 401
+        assert client.get("/debug/profile?seconds=600", headers=AUTH).status_code == 422
+
+
+def test_on_demand_profile_returns_collapsed_stacks():
+    """Test that /debug/profile returns a flamegraph-ready profile."""
+    client = TestClient(api.app)
+    with patch.object(profiling, "PROFILING_TOKEN", "secret"):
+        response = client.get(
+            "/debug/profile?seconds=0.2&interval=0.005&idle=true", headers=AUTH
+        )
+
+    assert response.status_code == 200
+    assert int(response.headers["x-profile-samples"]) > 0
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+
+
+def test_profile_next_requests_to_a_route():
+    """Test that an armed profile counts only its route and then completes."""
+    client = TestClient(api.app)
+    with patch.object(profiling, "PROFILING_TOKEN", "secret"):
+        response = client.post(
+            "/debug/profile/requests?route=/health&count=2", headers=AUTH
+        )
+        assert response.status_code == 202
+        assert client.post(
+            "/debug/profile/requests?route=/health&count=2", headers=AUTH
+        ).status_code == 409
+
+        client.get("/metrics")
+        client.get("/health")
+        status = client.get("/debug/profile/requests", headers=AUTH)
+        assert status.status_code == 202
+        assert status.json()["finished"] == 1
+
+        client.get("/health")
+        profiling.PROFILES.request_profile.profiler.stop()
+        response = client.get("/debug/profile/requests", headers=AUTH)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert profiling.PROFILES.request_profile.finished == 2
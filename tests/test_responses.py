@@ -0,0 +1,46 @@
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import api
+import responses
+
+
+def test_dumps_matches_standard_encoder():
+    """Test that orjson and the fallback encoder produce the same JSON."""
+    content = {"dishes": [{"name": "Crème brûlée", "price": "6 €"}], "count": 1}
+    with patch("responses.orjson", None):
+        fallback = responses.dumps(content)
+
+    assert responses.dumps(content) == fallback
+    assert (
+        fallback.decode("utf-8")
+        == '{"dishes":[{"name":"Crème brûlée","price":"6 €"}],"count":1}'
+    )
+
+
+def test_api_passes_dishes_as_plain_dicts():
+    """Test that request dishes reach the menu as dicts, with defaults and extras dropped."""
+    client = TestClient(api.app)
+    with patch("api.recommend_dishes", return_value="Try the soup") as mock_recommend:
+        response = client.post(
+            "/recommend",
+            json={
+                "dishes": [{"name": "Soup", "description": "Hot", "calories": 90}],
+                "qa": ["Q", "A"],
+                "language": "English",
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {"recommendations": "Try the soup"}
+    menu = mock_recommend.call_args.args[0]
+    assert menu.as_list() == [{"name": "Soup", "description": "Hot", "price": ""}]
+
+
+def test_api_rejects_dish_without_name():
+    """Test that dishes are still validated without per-dish models."""
+    client = TestClient(api.app)
+    response = client.post(
+        "/recommend",
+        json={"dishes": [{"description": "Hot"}], "qa": [], "language": "English"},
+    )
+    assert response.status_code == 422
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+from unittest.mock import MagicMock, patch
+import pytest
+from langchain.schema import AIMessage
+from langchain_core.messages import AIMessageChunk
+from PIL import Image
+import ai
+import routing
+
+
+def make_chat_model(replies):
+    """Return a ChatOpenAI stand-in whose reply depends on the model name."""
+    chat_model = MagicMock()
+
+    def build(model, temperature):
+        instance = MagicMock()
+        reply = replies[model]
+        if isinstance(reply, Exception):
+            instance.invoke.side_effect = reply
+        else:
+            instance.invoke.return_value = AIMessage(content=reply)
+        return instance
+
+    chat_model.side_effect = build
+    return chat_model
+
+
+def test_stage_models_from_environment():
+    """Test that per-stage models fall back to OPENAI_API_MODEL."""
+    env = {
+        "OPENAI_API_MODEL": "big-model",
+        "OPENAI_API_MODEL_QUESTION": "small-model, big-model",
+    }
+    with patch.dict(os.environ, env, clear=True):
+        assert routing._stage_models("question") == ["small-model", "big-model"]
+        assert routing._stage_models("extract") == ["big-model"]
+
+
+def test_language_validation():
+    """Test the script-based language check used to trigger escalation."""
+    assert routing.matches_language("Do you like spicy food?", "English")
+    assert not routing.matches_language("آیا غذای تند دوست دارید؟", "English")
+    assert routing.matches_language("آیا غذای تند دوست دارید؟", "فارسی")
+    assert routing.matches_language("anything", "Klingon")
+
+
+def test_cascade_escalates_on_invalid_menu_json():
+    """Test that extraction escalates when the small model returns bad JSON."""
+    dishes = [{"name": "Pasta", "description": "", "price": "$9"}]
+    chat_model = make_chat_model({"small": "Pasta $9", "big": json.dumps(dishes)})
+    routing.ROUTING_STATS.clear()
+
+    with (
+        patch.dict(routing.STAGE_MODELS, {"extract": ["small", "big"]}),
+        patch("ai.ChatOpenAI", chat_model),
+        patch("ai.convert_to_base64", return_value="b64"),
+    ):
+        result = ai.extract_menu_items([Image.new("RGB", (10, 10))])
+
+    assert result == dishes
+    stats = routing.get_routing_stats()["extract"]
+    assert stats["escalations"] == 1
+    assert stats["escalation_rate"] == 1.0
+    assert stats["models"]["small"]["invalid"] == 1
+    assert stats["models"]["big"]["invalid"] == 0
+
+
+def test_cascade_keeps_valid_small_model_reply():
+    """Test that a valid reply from the small model is not escalated."""
+    chat_model = make_chat_model({"small": "Spicy?", "big": "Too late"})
+    routing.ROUTING_STATS.clear()
+
+    with patch.dict(routing.STAGE_MODELS, {"question": ["small", "big"]}):
+        reply = routing.invoke_with_cascade(
+            "question", [], 0.6, chat_model, routing.reply_validator("English")
+        )
+
+    assert reply.content == "Spicy?"
+    assert chat_model.call_count == 1
+    assert routing.get_routing_stats()["question"]["escalation_rate"] == 0.0
+
+
+def test_cascade_escalates_on_wrong_language_and_errors():
+    """Test escalation on a wrong-language reply and on a model error."""
+    chat_model = make_chat_model(
+        {"small": "Do you like it spicy?", "medium": Exception("timeout"), "big": "تند؟"}
+    )
+    with patch.dict(routing.STAGE_MODELS, {"question": ["small", "medium", "big"]}):
+        reply = routing.invoke_with_cascade(
+            "question", [], 0.6, chat_model, routing.reply_validator("فارسی")
+        )
+    assert reply.content == "تند؟"
+
+
+def test_cascade_propagates_last_model_error():
+    """Test that an error from the last model in the cascade is raised."""
+    chat_model = make_chat_model({"small": "", "big": Exception("down")})
+    with patch.dict(routing.STAGE_MODELS, {"recommend": ["small", "big"]}):
+        with pytest.raises(Exception, match="down"):
+            routing.invoke_with_cascade(
+                "recommend", [], 0.4, chat_model, routing.reply_validator("English")
+            )
+
+
+def make_streaming_model(replies):
+    """A chat model whose astream yields each reply word by word."""
+
+    def chat_model(model, temperature, **kwargs):
+        llm = MagicMock()
+
+        async def astream(messages):
+            reply = replies[model]
+            if isinstance(reply, Exception):
+                raise reply
+            for word in reply.split(" "):
+                yield AIMessageChunk(content=word + " ")
+
+        llm.astream = astream
+        return llm
+
+    return chat_model
+
+
+def test_streaming_cascade_restarts_on_escalation():
+    """Test that an invalid streamed reply is replaced by the next model's stream."""
+    chat_model = make_streaming_model(
+        {"small": "Scharf oder mild?", "big": "Spicy or mild?"}
+    )
+    routing.ROUTING_STATS.clear()
+
+    async def run():
+        return [
+            reply.content
+            async for reply in routing.astream_with_cascade(
+                "question", [], 0.6, chat_model, lambda text: "Spicy" in text
+            )
+        ]
+
+    with patch.dict(routing.STAGE_MODELS, {"question": ["small", "big"]}):
+        partials = asyncio.run(run())
+
+    assert partials[0] == "Scharf "
+    assert partials[3] == "Spicy "
+    assert partials[-1] == "Spicy or mild? "
+    assert routing.get_routing_stats()["question"]["escalations"] == 1
@@ -0,0 +1,70 @@
+from unittest.mock import patch
+from menu import compile_menu
+from preferences import PreferenceState
+from sessions import SessionStore
+
+MENU = [{"name": f"Dish {i}", "description": "x" * 200} for i in range(50)]
+
+
+def test_new_and_returning_sessions():
+    """Test that a known id returns its session and an unknown one starts fresh."""
+    store = SessionStore(max_sessions=10, ttl_seconds=60)
+    session_id, session = store.session()
+    session.stage = "asking"
+
+    assert store.session(session_id) == (session_id, session)
+    other_id, other = store.session("unknown")
+    assert other_id not in (session_id, "unknown")
+    assert other.stage == "await"
+
+
+def test_idle_sessions_expire():
+    """Test that sessions idle for longer than the TTL are dropped."""
+    store = SessionStore(max_sessions=10, ttl_seconds=60)
+    with patch("sessions.time.monotonic", return_value=1000.0):
+        old_id, _ = store.session()
+    with patch("sessions.time.monotonic", return_value=1030.0):
+        active_id, _ = store.session()
+    with patch("sessions.time.monotonic", return_value=1070.0):
+        assert store.session(active_id)[0] == active_id
+        assert store.session(old_id)[0] != old_id
+        assert store.stats()["expired"] == 1
+
+
+def test_least_recently_used_sessions_are_evicted():
+    """Test that the store never holds more than max_sessions."""
+    store = SessionStore(max_sessions=3, ttl_seconds=60)
+    ids = [store.session()[0] for _ in range(3)]
+    store.session(ids[0])
+    store.session()
+
+    assert len(store) == 3
+    assert store.session(ids[0])[0] == ids[0]
+    assert store.session(ids[1])[0] != ids[1]
+    assert store.stats()["evicted"] >= 1
+
+
+def test_sessions_share_one_menu_copy():
+    """Test that sessions on the same menu share it and it is counted once."""
+    store = SessionStore(max_sessions=100, ttl_seconds=60)
+    for _ in range(20):
+        _, session = store.session()
+        session.menu = compile_menu([dict(dish) for dish in MENU])
+        session.qa = ["Spicy?", "Yes please"]
+        session.preferences = PreferenceState.from_history(session.qa + ["More?"])
+
+    stats = store.stats()
+    assert stats["sessions"] == 20
+    assert stats["menus"] == 1
+    # The menu dominates and is paid for once, not 20 times
+    assert stats["menu_bytes"] > stats["session_bytes"] / 20
+    assert stats["bytes_per_session"] < stats["menu_bytes"]
+
+
+def test_discard():
+    """Test that a closed browser session is removed from the store."""
+    store = SessionStore()
+    session_id, _ = store.session()
+    store.discard(session_id)
+    store.discard(None)
+    assert len(store) == 0
@@ -0,0 +1,127 @@
+from unittest.mock import patch
+from langchain.schema import AIMessage
+from PIL import Image
+import ai
+import menu
+import tokens
+
+
+def make_dishes(count, description_words=40):
+    description = " ".join(f"ingredient{i}" for i in range(description_words))
+    return [
+        {"name": f"Dish {i}", "description": description, "price": "$10"}
+        for i in range(count)
+    ]
+
+
+def test_count_image_tokens():
+    """Test the image token estimate against the provider's tiling rules."""
+    assert tokens.count_image_tokens(512, 512) == 85 + 170
+    # A 12 MP phone photo is scaled to 768x1024, i.e. 2x2 tiles
+    assert tokens.count_image_tokens(3000, 4000) == 85 + 170 * 4
+    assert tokens.count_image_tokens(3000, 4000, detail="low") == 85
+
+
+def test_small_prompt_is_untouched():
+    """Test that prompts within budget are sent unchanged."""
+    compiled = menu.compile_menu(make_dishes(5, description_words=5))
+    fragment, task_text, decision = tokens.fit_conversation_prompt(
+        "question", compiled, ["Q1", "A1"], lambda history: " ".join(history)
+    )
+    assert fragment == compiled.prompt_fragment
+    assert task_text == "Q1 A1"
+    assert decision.actions == []
+    assert decision.within_budget
+
+
+def test_large_menu_trims_descriptions_first():
+    """Test that descriptions are trimmed before any Q&A is touched."""
+    compiled = menu.compile_menu(make_dishes(100))
+    history = ["Question?", "Answer"] * 6
+
+    with patch.dict(tokens.STAGE_BUDGETS, {"question": 3000}):
+        fragment, task_text, decision = tokens.fit_conversation_prompt(
+            "question", compiled, history, lambda h: " ".join(h)
+        )
+
+    assert decision.estimated_tokens > 3000
+    assert decision.within_budget
+    assert decision.actions[0] == "descriptions<=24 words"
+    assert "Q&A" not in " ".join(decision.actions)
+    assert len(fragment) < len(compiled.prompt_fragment)
+    assert task_text == " ".join(history)
+
+
+def test_long_history_is_compacted_after_descriptions():
+    """Test that older Q&A is compacted and dropped while recent pairs survive."""
+    compiled = menu.compile_menu(make_dishes(3, description_words=2))
+    history = [f"Question {i} " + "x" * 400 for i in range(20)]
+
+    with patch.dict(tokens.STAGE_BUDGETS, {"recommend": 500}):
+        _, task_text, decision = tokens.fit_conversation_prompt(
+            "recommend", compiled, history, lambda h: "\n".join(h)
+        )
+
+    assert decision.actions[-2:] == ["compacted older Q&A", "dropped older Q&A"]
+    assert task_text == "\n".join(history[-4:])
+
+
+def test_extract_downscales_images_over_budget(mock_openai):
+    """Test that extraction downscales photos when they exceed the budget."""
+    mock_openai.return_value.invoke.return_value = AIMessage(content="[]")
+    images = [Image.new("RGB", (1200, 1600)) for _ in range(3)]
+
+    with (
+        patch.dict(tokens.STAGE_BUDGETS, {"extract": 1500}),
+        patch("ai.convert_to_base64", return_value="b64") as mock_base64,
+    ):
+        ai.extract_menu_items(images)
+
+    # 682px is the largest size at which the 768px short side drops to one tile
+    assert {call.args[1] for call in mock_base64.call_args_list} == {682}
+
+
+def test_image_steps_each_remove_tiles(caplog):
+    """Test that photos are only downscaled to sizes that lower the token count."""
+    photos = [(3000, 4000)] * 2
+    with patch.dict(tokens.STAGE_BUDGETS, {"extract": 1000}):
+        max_side, decision = tokens.fit_images_to_budget(photos)
+    assert max_side == 682
+    assert decision.actions == ["images<=682px"]
+    assert decision.final_tokens == 2 * 425
+
+    with patch.dict(tokens.STAGE_BUDGETS, {"extract": 300}):
+        max_side, decision = tokens.fit_images_to_budget(photos)
+    assert max_side == tokens.MIN_IMAGE_SIDE
+    assert not decision.within_budget
+    assert "still over budget" in caplog.text
+
+
+def test_conversation_wrapper_enforces_budget(mock_openai):
+    """Test that the wrappers send the trimmed prompt."""
+    mock_openai.return_value.invoke.return_value = AIMessage(content="Spicy?")
+    dishes = make_dishes(100)
+
+    with patch.dict(tokens.STAGE_BUDGETS, {"question": 2000}):
+        ai.generate_next_question(dishes, [], "English")
+
+    prompt = mock_openai.return_value.invoke.call_args.args[0]
+    assert tokens.count_message_tokens(prompt) <= 2000
+
+
+def test_offline_falls_back_without_downloading(tmp_path, monkeypatch):
+    """Test that offline, a missing vocabulary means heuristic counts and no download."""
+    import tiktoken.load
+
+    monkeypatch.setattr(tokens, "TOKEN_OFFLINE", True)
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    # Restored afterwards, as offline mode replaces the downloader
+    monkeypatch.setattr(tiktoken.load, "read_file", tiktoken.load.read_file)
+    tokens._load_encoding.cache_clear()
+    try:
+        with patch("requests.get") as mock_get:
+            assert tokens.load_encoding() is None
+            assert tokens.count_text_tokens("x" * 40) == 10
+        mock_get.assert_not_called()
+    finally:
+        tokens._load_encoding.cache_clear()
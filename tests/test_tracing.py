@@ -0,0 +1,152 @@
+import io
+import json
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from langchain.schema import AIMessage
+from PIL import Image
+import api
+import tracing
+
+
+def read_spans(sink):
+    sink.flush()
+    with open(sink.path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_nested_spans_share_the_trace(tmp_path):
+    """Test that spans record their parent and are written when the trace ends."""
+    sink = tracing.JsonlSink(str(tmp_path / "traces.jsonl"))
+    with patch.object(tracing, "SINK", sink):
+        with tracing.trace("request", request_id="abc", sampled=True):
+            assert tracing.current_request_id() == "abc"
+            with tracing.span("outer"):
+                with tracing.span("inner", step=1):
+                    pass
+        assert tracing.current_request_id() is None
+
+    spans = {span["name"]: span for span in read_spans(sink)}
+    assert {span["request_id"] for span in spans.values()} == {"abc"}
+    assert len({span["trace_id"] for span in spans.values()}) == 1
+    assert spans["request"]["parent_id"] is None
+    assert spans["outer"]["parent_id"] == spans["request"]["span_id"]
+    assert spans["inner"]["parent_id"] == spans["outer"]["span_id"]
+    assert spans["inner"]["attributes"] == {"step": 1}
+
+
+def test_unsampled_traces_are_not_written(tmp_path):
+    """Test that an unsampled trace keeps its request id but writes nothing."""
+    sink = tracing.JsonlSink(str(tmp_path / "traces.jsonl"))
+    with patch.object(tracing, "SINK", sink):
+        with tracing.trace("request", sampled=False):
+            assert tracing.current_request_id()
+            with tracing.span("work") as span:
+                assert span is tracing.NOOP_SPAN
+
+    sink.flush()
+    assert not (tmp_path / "traces.jsonl").exists()
+
+
+def test_otlp_format_and_errors(tmp_path):
+    """Test the OTLP/JSON layout and that a failing span records its error."""
+    sink = tracing.JsonlSink(str(tmp_path / "traces.jsonl"), format="otlp")
+    with patch.object(tracing, "SINK", sink):
+        try:
+            with tracing.trace("request", sampled=True, retries=2):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+
+    (request,) = read_spans(sink)
+    (span,) = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(span["traceId"]) == 32 and len(span["spanId"]) == 16
+    assert span["status"] == {"code": 2, "message": "ValueError: boom"}
+    assert {"key": "retries", "value": {"intValue": "2"}} in span["attributes"]
+
+
+def test_extraction_request_waterfall(mock_openai, tmp_path):
+    """Test that an /extract_menu request is traced from HTTP to parsing."""
+    mock_openai.return_value.invoke.return_value = AIMessage(
+        content='[{"name": "Pizza", "description": ""}]'
+    )
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48)).save(buffer, format="GIF")
+    sink = tracing.JsonlSink(str(tmp_path / "traces.jsonl"))
+    client = TestClient(api.app)
+
+    with (
+        patch.object(tracing, "SINK", sink),
+        patch.object(tracing, "TRACE_SAMPLE_RATE", 0.01),
+    ):
+        response = client.post(
+            "/extract_menu",
+            files=[("files", ("menu.gif", buffer.getvalue(), "image/gif"))],
+            headers={
+                "X-Request-ID": "req-1",
+                "X-Session-ID": "conversation-7",
+                "traceparent": "00-" + "a" * 32 + "-" + "b" * 16 + "-01",
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.headers["x-request-id"] == "req-1"
+    spans = read_spans(sink)
+    by_id = {span["span_id"]: span for span in spans}
+
+    def path(span):
+        names = [span["name"]]
+        while span["parent_id"]:
+            span = by_id[span["parent_id"]]
+            names.append(span["name"])
+        return list(reversed(names))
+
+    paths = [path(span) for span in spans]
+    root = "POST /extract_menu"
+    assert [root, "preprocess", "image_prepare", "image_decode"] in paths
+    assert [root, "build_prompt"] in paths
+    assert [root, "llm_call"] in paths
+    assert [root, "parse"] in paths
+    assert {span["trace_id"] for span in spans} == {"a" * 32}
+    (request,) = [span for span in spans if span["name"] == root]
+    assert request["attributes"]["session_id"] == "conversation-7"
+    assert request["attributes"]["http.status"] == 200
+    assert request["attributes"]["menu_id"] == response.json()["menu_id"]
+
+
+def test_request_id_is_generated_when_missing_or_malformed():
+    """Test that every response gets a usable request id."""
+    client = TestClient(api.app)
+    generated = client.get("/health").headers["x-request-id"]
+    replaced = client.get(
+        "/health", headers={"X-Request-ID": "bad id\n"}
+    ).headers["x-request-id"]
+    assert len(generated) == 32 and len(replaced) == 32
+    assert generated != replaced
+
+
+def test_remote_sampling_needs_local_sampling(tmp_path):
+    """Test that a sampled traceparent writes nothing while TRACE_SAMPLE_RATE is 0."""
+    sink = tracing.JsonlSink(str(tmp_path / "traces.jsonl"))
+    client = TestClient(api.app)
+    with (
+        patch.object(tracing, "SINK", sink),
+        patch.object(tracing, "TRACE_SAMPLE_RATE", 0.0),
+    ):
+        response = client.get(
+            "/health",
+            headers={"traceparent": "00-" + "a" * 32 + "-" + "b" * 16 + "-01"},
+        )
+
+    assert response.status_code == 200
+    sink.flush()
+    assert not (tmp_path / "traces.jsonl").exists()
+
+
+def test_full_trace_queue_drops_instead_of_blocking(tmp_path):
+    """Test that ending a trace never waits on a backed-up writer."""
+    sink = tracing.JsonlSink(str(tmp_path / "traces.jsonl"), queue_size=1)
+    with patch.object(sink, "_start"):
+        for _ in range(3):
+            sink.write(tracing.Trace("r", "t" * 32, sampled=True))
+
+    assert sink.dropped == 2
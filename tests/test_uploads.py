@@ -0,0 +1,141 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+import api
+import uploads
+
+
+def photo(width, height, seed=0):
+    """Return a noisy JPEG that does not compress to nothing."""
+    image = Image.effect_noise((width, height), 30 + seed).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client():
+    with patch("api.extract_menu_items", return_value=[]):
+        yield TestClient(api.app)
+
+
+def post_images(client, payloads):
+    files = [
+        ("files", (f"page{i}.jpg", data, "image/jpeg"))
+        for i, data in enumerate(payloads)
+    ]
+    return client.post("/extract_menu", files=files)
+
+
+def test_request_over_byte_limit_is_rejected(client):
+    """Test that bodies over MAX_REQUEST_BYTES are rejected with 413."""
+    with patch.object(uploads, "MAX_REQUEST_BYTES", 50_000):
+        response = post_images(client, [photo(400, 400)] * 2)
+    assert response.status_code == 413
+
+
+def test_streamed_body_over_byte_limit_is_rejected():
+    """Test that the limit also applies when no Content-Length is sent."""
+    received = []
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            received.append(message)
+            if not message.get("more_body"):
+                break
+
+    async def receive():
+        return {"type": "http.request", "body": b"x" * 600, "more_body": True}
+
+    middleware = uploads.RequestSizeLimitMiddleware(app)
+    scope = {"type": "http", "path": "/extract_menu", "headers": []}
+    with patch.object(uploads, "MAX_REQUEST_BYTES", 1000):
+        with pytest.raises(api.HTTPException) as error:
+            asyncio.run(middleware(scope, receive, None))
+    assert error.value.status_code == 413
+    assert len(received) == 1
+
+
+def test_malformed_content_length_is_rejected():
+    """Test that a Content-Length that is not a byte count gets 400, not 500."""
+    called = []
+    sent = []
+
+    async def app(scope, receive, send):
+        called.append(scope)
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = uploads.RequestSizeLimitMiddleware(app)
+    for value in (b"abc", b"-5", b"1e3", b""):
+        scope = {
+            "type": "http",
+            "path": "/extract_menu",
+            "headers": [(b"content-length", value)],
+        }
+        sent.clear()
+        asyncio.run(middleware(scope, None, send))
+        assert sent[0]["status"] == 400, value
+    assert not called
+
+
+def test_request_over_pixel_budget_is_rejected(client):
+    """Test that the summed pixels of all uploads are limited per request."""
+    with patch.object(uploads, "MAX_REQUEST_PIXELS", 500_000):
+        response = post_images(client, [photo(600, 600, seed) for seed in range(2)])
+    assert response.status_code == 413
+    assert "pixels per request" in response.json()["detail"]
+
+
+def test_decompression_bomb_is_rejected_before_decoding(client):
+    """Test that a tiny file declaring a huge image is never decoded."""
+    buffer = io.BytesIO()
+    Image.new("1", (20_000, 20_000)).save(buffer, format="PNG")
+    assert len(buffer.getvalue()) < 100_000
+
+    with patch("images.encode_image", side_effect=AssertionError("decoded")):
+        response = client.post(
+            "/extract_menu",
+            files=[("files", ("bomb.png", buffer.getvalue(), "image/png"))],
+        )
+    assert response.status_code == 413
+
+
+def test_concurrent_large_uploads_stay_bounded(client):
+    """Stress test: concurrent multi-photo uploads keep per-request memory bounded."""
+    pages = [photo(1600, 1200, seed) for seed in range(3)]
+    uploads.UPLOAD_STATS.clear()
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        responses = list(pool.map(lambda _: post_images(client, pages), range(12)))
+
+    assert [response.status_code for response in responses] == [200] * 12
+    stats = uploads.UPLOAD_STATS.summary()
+    assert stats["requests"] == 12
+    # One request never holds more than its own encoded payload
+    assert stats["max_peak_bytes"] <= sum(len(page) for page in pages)
+    assert stats["max_peak_bytes"] <= uploads.MAX_REQUEST_BYTES
+
+
+def test_rss_fallback_scales_by_platform():
+    """Test that without /proc the peak RSS is read in the platform's unit."""
+
+    class Usage:
+        ru_maxrss = 1000
+
+    with (
+        patch("builtins.open", side_effect=OSError),
+        patch("uploads.resource.getrusage", return_value=Usage()),
+    ):
+        with patch("uploads._MAXRSS_UNIT", 1):
+            assert uploads.current_rss_bytes() == 1000
+        with patch("uploads._MAXRSS_UNIT", 1024):
+            assert uploads.current_rss_bytes() == 1024 * 1000
+        with patch("uploads.resource", None):
+            assert uploads.current_rss_bytes() == 0
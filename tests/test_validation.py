@@ -83,6 +83,30 @@ def test_extract_menu_items_json_fallback():
             assert "description" in result[0]
 
 
+def test_extracted_items_without_a_name_are_dropped(mock_openai):
+    """Test that unusable extracted items do not reach the menu endpoint's reply."""
+    from fastapi.testclient import TestClient
+    import api
+
+    reply = [
+        {"name": "Soup", "description": "Tomato"},
+        {"description": "No name"},
+        {"name": "  "},
+        {"name": 7},
+        "Bread",
+    ]
+    mock_openai.return_value.invoke.return_value = AIMessage(content=json.dumps(reply))
+    files = [("files", ("menu.png", b"", "image/png"))]
+    image = Image.new("RGB", (10, 10))
+
+    with patch("api.prepare_uploads", return_value=[image]):
+        response = TestClient(api.app).post("/extract_menu", files=files)
+
+    assert response.status_code == 200
+    assert response.json()["dishes"] == [reply[0]]
+    assert response.json()["menu_id"]
+
+
 def test_convert_to_pil_image_validations():
     """Test edge cases for the convert_to_pil_image function."""
     from PIL import Image
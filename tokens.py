@@ -0,0 +1,254 @@
+import logging
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("menu_analyzer")
+
+# Prompt token budgets per LLM stage (text + images, excluding the completion)
+STAGE_BUDGETS = {
+    "extract": int(os.getenv("PROMPT_BUDGET_EXTRACT", "8000")),
+    "question": int(os.getenv("PROMPT_BUDGET_QUESTION", "6000")),
+    "recommend": int(os.getenv("PROMPT_BUDGET_RECOMMEND", "6000")),
+}
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+# tiktoken downloads its vocabulary once into TIKTOKEN_CACHE_DIR (default: a
+# temp dir); offline, only a cached vocabulary is used, else the heuristic
+TOKEN_OFFLINE = os.getenv("TOKEN_OFFLINE", "").lower() in ("1", "true", "yes")
+
+# Per-message framing tokens added by the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+# Budget enforcement steps, tried in this order until the prompt fits
+DESCRIPTION_WORD_LIMITS = (24, 12, 6, 0)
+RECENT_QA_PAIRS = 2
+COMPACT_QUESTION_CHARS = 60
+COMPACT_ANSWER_CHARS = 80
+# Photos are never downscaled below this long side (one tile wide)
+MIN_IMAGE_SIDE = 512
+IMAGE_TILE_SIDE = 512
+
+
+# TOKEN COUNTING
+_ENCODING_LOCK = threading.Lock()
+
+
+def _offline_read_file(blobpath: str) -> bytes:
+    raise OSError(f"{blobpath} is not in the tiktoken cache and TOKEN_OFFLINE is set")
+
+
+@lru_cache(maxsize=1)
+def _load_encoding():
+    try:
+        import tiktoken
+        import tiktoken.load
+
+        if TOKEN_OFFLINE:
+            # Cache hits are read as usual; only the download is refused
+            tiktoken.load.read_file = _offline_read_file
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        # tiktoken is optional and fetches its vocabulary on first use
+        logger.info(f"tiktoken unavailable ({e}), using heuristic token counts")
+        return None
+
+
+def load_encoding():
+    """The tiktoken encoding, or None for heuristic counts; loaded once.
+
+    Called at startup so a vocabulary download does not delay the first request.
+    """
+    with _ENCODING_LOCK:
+        return _load_encoding()
+
+
+def count_text_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = load_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Roughly four characters per token for the menu languages we support
+    return (len(text) + 3) // 4
+
+
+def count_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    if detail == "low":
+        return 85
+    # Mirror the provider's scaling: fit in 2048x2048, then shortest side <= 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def count_message_tokens(messages: Sequence[Any]) -> int:
+    total = 0
+    for message in messages:
+        content = getattr(message, "content", message)
+        total += MESSAGE_OVERHEAD_TOKENS
+        if isinstance(content, str):
+            total += count_text_tokens(content)
+            continue
+        for part in content:
+            # Image parts are accounted for separately by fit_images_to_budget
+            if part.get("type") == "text":
+                total += count_text_tokens(part["text"])
+    return total
+
+
+def scaled_size(width: int, height: int, max_side: Optional[int]) -> Tuple[int, int]:
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+# BUDGET ENFORCEMENT
+@dataclass
+class BudgetDecision:
+    stage: str
+    budget: int
+    estimated_tokens: int
+    final_tokens: int = 0
+    actions: List[str] = field(default_factory=list)
+
+    @property
+    def within_budget(self) -> bool:
+        return self.final_tokens <= self.budget
+
+    def log(self) -> None:
+        summary = (
+            f"{self.stage} prompt budget {self.budget}: estimated {self.estimated_tokens}, "
+            f"final {self.final_tokens} tokens, actions: {', '.join(self.actions) or 'none'}"
+        )
+        if self.within_budget:
+            logger.info(summary)
+        else:
+            logger.warning(f"{summary} (still over budget)")
+
+
+def compact_qa_history(
+    question_answer_history: List[str], recent_pairs: int = RECENT_QA_PAIRS
+) -> List[str]:
+    keep_from = max(0, len(question_answer_history) - 2 * recent_pairs)
+    keep_from -= keep_from % 2
+    compacted = [
+        text[:COMPACT_QUESTION_CHARS] if i % 2 == 0 else text[:COMPACT_ANSWER_CHARS]
+        for i, text in enumerate(question_answer_history[:keep_from])
+    ]
+    return compacted + question_answer_history[keep_from:]
+
+
+def drop_older_qa(
+    question_answer_history: List[str], recent_pairs: int = RECENT_QA_PAIRS
+) -> List[str]:
+    keep_from = max(0, len(question_answer_history) - 2 * recent_pairs)
+    return question_answer_history[keep_from - keep_from % 2 :]
+
+
+QA_COMPACTIONS = (
+    (compact_qa_history, "compacted older Q&A"),
+    (drop_older_qa, "dropped older Q&A"),
+)
+
+
+def fit_conversation_prompt(
+    stage: str,
+    menu: Any,
+    history: Any,
+    build_task: Callable[[Any], str],
+    fixed_tokens: int = 0,
+    compactions: Sequence[Tuple[Callable[[Any], Any], str]] = QA_COMPACTIONS,
+) -> Tuple[str, str, BudgetDecision]:
+    """Return the menu fragment and task text that fit the stage's budget.
+
+    Descriptions are trimmed first, then the conversation history is passed
+    through the compaction steps in order (by default older Q&A pairs are
+    shortened and then dropped, keeping the most recent exchanges verbatim).
+    """
+    budget = STAGE_BUDGETS[stage]
+    fixed_tokens += 3 * MESSAGE_OVERHEAD_TOKENS
+    fragment, fragment_tokens = menu.prompt_fragment, menu.prompt_tokens
+    task_text = build_task(history)
+    task_tokens = count_text_tokens(task_text)
+    decision = BudgetDecision(
+        stage, budget, fixed_tokens + fragment_tokens + task_tokens
+    )
+
+    def total() -> int:
+        return fixed_tokens + fragment_tokens + task_tokens
+
+    for words in DESCRIPTION_WORD_LIMITS:
+        if total() <= budget:
+            break
+        trimmed, trimmed_tokens = menu.trimmed_fragment(words)
+        if trimmed_tokens < fragment_tokens:
+            fragment, fragment_tokens = trimmed, trimmed_tokens
+            decision.actions.append(f"descriptions<={words} words")
+
+    for compact, action in compactions:
+        if total() <= budget:
+            break
+        compacted = compact(history)
+        if compacted == history:
+            continue
+        history = compacted
+        task_text = build_task(history)
+        task_tokens = count_text_tokens(task_text)
+        decision.actions.append(action)
+
+    decision.final_tokens = total()
+    decision.log()
+    return fragment, task_text, decision
+
+
+def image_max_sides(image_sizes: List[Tuple[int, int]]) -> List[int]:
+    """Max sides, largest first, at which a photo's long or short side meets a tile edge.
+
+    The provider already scales the short side to 768, so sizes in between
+    only re-encode the photo for the same token count.
+    """
+    sides = set()
+    for width, height in image_sizes:
+        long_side, short_side = max(width, height), min(width, height)
+        candidates = [IMAGE_TILE_SIDE * tiles for tiles in range(1, 5)]
+        # The long side at which the short side shrinks to one tile
+        candidates.append(IMAGE_TILE_SIDE * long_side // max(1, short_side))
+        sides.update(
+            side for side in candidates if MIN_IMAGE_SIDE <= side < long_side
+        )
+    return sorted(sides, reverse=True)
+
+
+def fit_images_to_budget(
+    image_sizes: List[Tuple[int, int]], fixed_tokens: int = 0, stage: str = "extract"
+) -> Tuple[Optional[int], BudgetDecision]:
+    """Return the largest max side (None for unchanged) that fits the budget.
+
+    Only sizes that remove tiles are tried. When even the smallest one is over
+    budget, the returned decision says so and the overrun is logged.
+    """
+    budget = STAGE_BUDGETS[stage]
+
+    def total(max_side: Optional[int]) -> int:
+        return fixed_tokens + sum(
+            count_image_tokens(*scaled_size(width, height, max_side))
+            for width, height in image_sizes
+        )
+
+    decision = BudgetDecision(stage, budget, total(None))
+    chosen = None
+    for max_side in image_max_sides(image_sizes):
+        if total(chosen) <= budget:
+            break
+        if total(max_side) < total(chosen):
+            chosen = max_side
+            decision.actions.append(f"images<={max_side}px")
+
+    decision.final_tokens = total(chosen)
+    decision.log()
+    return chosen, decision
@@ -0,0 +1,332 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("menu_analyzer")
+
+# Share of requests whose spans are written; request ids are always assigned
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# "jsonl": one flat span per line; "otlp": one OTLP/JSON ExportTraceServiceRequest per trace
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "jsonl")
+# Finished traces waiting for the writer thread; more are dropped
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+SERVICE_NAME = "menu-analyzer"
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_record(self, request_id: str) -> Dict[str, Any]:
+        return {
+            "request_id": request_id,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+@dataclass
+class Trace:
+    request_id: str
+    trace_id: str
+    sampled: bool
+    spans: List[Span] = field(default_factory=list)
+
+
+class NoopSpan:
+    """Stands in for a span when the request is not sampled."""
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "trace", default=None
+)
+_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "span", default=None
+)
+
+
+# SINK
+class JsonlSink:
+    """Appends finished traces to a local file, one JSON document per line.
+
+    Traces are written by a background thread, so ending a trace never
+    waits for the disk.
+    """
+
+    def __init__(
+        self,
+        path: str = TRACE_FILE,
+        format: str = TRACE_FORMAT,
+        queue_size: int = TRACE_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.format = format
+        self._queue: "queue.Queue[Trace]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    def lines(self, trace: Trace) -> List[str]:
+        if self.format == "otlp":
+            request = {
+                "resourceSpans": [
+                    {
+                        "resource": {
+                            "attributes": [
+                                _otlp_attribute("service.name", SERVICE_NAME)
+                            ]
+                        },
+                        "scopeSpans": [
+                            {
+                                "scope": {"name": "menu_analyzer"},
+                                "spans": [span.to_otlp() for span in trace.spans],
+                            }
+                        ],
+                    }
+                ]
+            }
+            return [json.dumps(request, ensure_ascii=False)]
+        return [
+            json.dumps(span.to_record(trace.request_id), ensure_ascii=False)
+            for span in trace.spans
+        ]
+
+    def write(self, trace: Trace) -> None:
+        """Queue a finished trace for the writer thread."""
+        if self._writer is None:
+            self._start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Trace queue full, dropped trace {trace.request_id}")
+
+    def flush(self) -> None:
+        """Wait until every queued trace is written."""
+        self._queue.join()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._run, name="trace-writer", daemon=True
+                )
+                self._writer.start()
+
+    def _run(self) -> None:
+        while True:
+            trace = self._queue.get()
+            try:
+                self._append(trace)
+            finally:
+                self._queue.task_done()
+
+    def _append(self, trace: Trace) -> None:
+        text = "".join(line + "\n" for line in self.lines(trace))
+        try:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(text)
+        except OSError as e:
+            logger.warning(f"Could not write trace {trace.request_id}: {str(e)}")
+
+
+SINK = JsonlSink()
+
+
+# SPANS
+def current_request_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.request_id if trace else None
+
+
+def annotate(**attributes: Any) -> None:
+    """Set attributes on the innermost open span, if the request is sampled."""
+    span = _span.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Record a nested span; a no-op outside a sampled trace."""
+    trace = _trace.get()
+    if trace is None or not trace.sampled:
+        yield NOOP_SPAN
+        return
+    parent = _span.get()
+    current = Span(
+        name=name,
+        trace_id=trace.trace_id,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent else None,
+        start_ns=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _span.reset(token)
+        # Spans from worker threads land here too; list.append is atomic
+        trace.spans.append(current)
+
+
+@contextmanager
+def trace(
+    name: str,
+    request_id: Optional[str] = None,
+    trace_id: Optional[str] = None,
+    sampled: Optional[bool] = None,
+    **attributes: Any,
+) -> Iterator[Any]:
+    """Open a trace with a root span; its spans are written when it ends."""
+    if sampled is None:
+        sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    current = Trace(
+        request_id=request_id or uuid.uuid4().hex,
+        trace_id=trace_id or uuid.uuid4().hex,
+        sampled=sampled,
+    )
+    trace_token = _trace.set(current)
+    span_token = _span.set(None)
+    try:
+        with span(name, request_id=current.request_id, **attributes) as root:
+            yield root
+    finally:
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        if current.sampled:
+            SINK.write(current)
+
+
+def parse_traceparent(header: Optional[str]) -> Tuple[Optional[str], Optional[bool]]:
+    """Trace id and sampled flag from a W3C traceparent header, if valid."""
+    match = _TRACEPARENT.match(header or "")
+    if not match:
+        return None, None
+    return match.group(1), bool(int(match.group(3), 16) & 1)
+
+
+class TracingMiddleware:
+    """Assigns each HTTP request a request id and traces it.
+
+    An incoming X-Request-ID is kept when well formed, and an incoming
+    traceparent decides the trace id. Its sampled flag is only followed
+    when local sampling is on (TRACE_SAMPLE_RATE > 0), so clients cannot
+    turn on span writing for a server that has it off. X-Session-ID is recorded
+    so all calls of one conversation can be found together. The request id
+    is echoed back in the X-Request-ID response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope.get("headers") or []
+        }
+        request_id = headers.get("x-request-id", "")
+        if not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        trace_id, sampled = parse_traceparent(headers.get("traceparent"))
+        if TRACE_SAMPLE_RATE <= 0:
+            sampled = False
+        attributes = {"http.method": scope["method"], "http.path": scope["path"]}
+        if headers.get("x-session-id"):
+            attributes["session_id"] = headers["x-session-id"][:64]
+
+        with trace(
+            f"{scope['method']} {scope['path']}",
+            request_id=request_id,
+            trace_id=trace_id,
+            sampled=sampled,
+            **attributes,
+        ) as root:
+
+            async def send_with_request_id(message):
+                if message["type"] == "http.response.start":
+                    root.set(**{"http.status": message["status"]})
+                    message.setdefault("headers", [])
+                    message["headers"] = [
+                        *message["headers"],
+                        (b"x-request-id", request_id.encode()),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_request_id)
+
+
+def run_in_context(function, *args):
+    """Bind a callable to the current context, for executors that do not copy it."""
+    context = contextvars.copy_context()
+    return lambda: context.run(function, *args)
@@ -0,0 +1,180 @@
+import logging
+import os
+import sys
+import threading
+from typing import Any, Dict, List
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from PIL import UnidentifiedImageError
+from starlette.formparsers import MultiPartParser
+from metrics import PAYLOAD_BYTES
+from tracing import span
+from images import (
+    MAX_IMAGE_PIXELS,
+    EncodedImage,
+    ImageTooLargeError,
+    image_pixels,
+    prepare_image_bytes_async,
+)
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logger = logging.getLogger("menu_analyzer")
+
+# Per-request upload limits for /extract_menu
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(40 * 1024 * 1024)))
+MAX_REQUEST_PIXELS = int(os.getenv("MAX_REQUEST_PIXELS", "100000000"))
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux and the BSDs
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        if resource is None:
+            return 0
+        # Peak rather than current RSS, but the best portable figure
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+# REQUEST SIZE LIMIT
+class RequestSizeLimitMiddleware:
+    """Rejects request bodies over MAX_REQUEST_BYTES while they stream in."""
+
+    def __init__(self, app, paths=("/extract_menu",)):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        limit = MAX_REQUEST_BYTES
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and not content_length.isdigit():
+            response = JSONResponse(
+                {"detail": "Invalid Content-Length header"}, status_code=400
+            )
+            return await response(scope, receive, send)
+        if content_length and int(content_length) > limit:
+            response = JSONResponse(
+                {"detail": f"Request body exceeds {limit} bytes"}, status_code=413
+            )
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(
+                        status_code=413, detail=f"Request body exceeds {limit} bytes"
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# UPLOAD PIPELINE
+class UploadMemoryStats:
+    """Peak bytes held by the upload pipeline and RSS growth, per request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def record(self, held_bytes: int, rss_growth: int) -> None:
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["last_peak_bytes"] = held_bytes
+            self._stats["max_peak_bytes"] = max(
+                self._stats["max_peak_bytes"], held_bytes
+            )
+            self._stats["max_rss_growth_bytes"] = max(
+                self._stats["max_rss_growth_bytes"], rss_growth
+            )
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "rss_bytes": current_rss_bytes()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats = {
+                "requests": 0,
+                "last_peak_bytes": 0,
+                "max_peak_bytes": 0,
+                "max_rss_growth_bytes": 0,
+            }
+
+
+UPLOAD_STATS = UploadMemoryStats()
+
+
+async def prepare_uploads(files: List[UploadFile]) -> List[EncodedImage]:
+    """Read and prepare uploads one at a time within the request's budgets.
+
+    Only one raw upload buffer is alive at a time; what stays in memory is
+    the encoded payload that will be sent to the model.
+    """
+    rss_start = peak_rss = current_rss_bytes()
+    images: List[EncodedImage] = []
+    held_bytes = peak_bytes = total_pixels = 0
+    for file in files:
+        data = await file.read()
+        await file.close()
+        PAYLOAD_BYTES.inc(len(data), kind="upload")
+        peak_bytes = max(peak_bytes, held_bytes + len(data))
+        try:
+            total_pixels += image_pixels(data)
+            if total_pixels > MAX_REQUEST_PIXELS:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Images exceed {MAX_REQUEST_PIXELS} pixels per request",
+                )
+            # Acceptable JPEG/PNG/WebP uploads are forwarded without decoding,
+            # everything else is decoded on the image worker pool
+            with span("image_prepare", bytes=len(data)) as prepared:
+                image = await prepare_image_bytes_async(data)
+                prepared.set(
+                    passthrough=image.passthrough, encoded_bytes=len(image.data)
+                )
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=f"{file.filename}: {e}")
+        except UnidentifiedImageError:
+            raise HTTPException(
+                status_code=400, detail=f"Unsupported image: {file.filename}"
+            )
+        del data
+        images.append(image)
+        held_bytes += len(image.data)
+        peak_bytes = max(peak_bytes, held_bytes)
+        peak_rss = max(peak_rss, current_rss_bytes())
+
+    UPLOAD_STATS.record(peak_bytes, peak_rss - rss_start)
+    logger.info(
+        f"Prepared {len(images)} uploads ({total_pixels} pixels): peak {peak_bytes} bytes held, RSS +{peak_rss - rss_start} bytes"
+    )
+    return images
+
+
+def get_upload_limits() -> Dict[str, int]:
+    return {
+        "max_request_bytes": MAX_REQUEST_BYTES,
+        "max_request_pixels": MAX_REQUEST_PIXELS,
+        "max_image_pixels": MAX_IMAGE_PIXELS,
+        # Upload parts larger than this are spooled to disk (Starlette's default)
+        "spool_bytes": MultiPartParser.spool_max_size,
+    }